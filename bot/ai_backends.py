@@ -0,0 +1,247 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import re
+
+logger = logging.getLogger(__name__)
+
+# Model backends for bot/ai_service.py, selected by AI_BACKEND ('gemini' or 'fake').
+# Models follow the google.generativeai surface that ai_service relies on:
+#   model.generate_content_async(contents, generation_config=None)
+#   model.start_chat(history=[...]).send_message_async(text, stream=False)
+#   model.count_tokens_async(contents).total_tokens
+# Responses (and streamed chunks) expose `.text`.
+
+class ModelBackend:
+    name = "base"
+    requires_key = True # False: works without GEMINI_API_KEY
+
+    def configure(self, api_key: str):
+        pass
+
+    def create_model(self, name: str, system_instruction: str = None):
+        raise NotImplementedError
+
+    def is_fault(self, e: Exception) -> bool:
+        """Does this error say the model is unhealthy (vs. a problem with the request)?"""
+        return False
+
+    def stats(self) -> dict:
+        return {}
+
+class GeminiBackend(ModelBackend):
+    name = "gemini"
+
+    def __init__(self):
+        import google.generativeai as genai
+        from google.api_core import exceptions as api_exceptions
+        self.genai = genai
+        # Quota, 5xx, unknown/forbidden model. Blocked content or bad input don't count.
+        self.fault_errors = (
+            api_exceptions.ServerError, api_exceptions.TooManyRequests,
+            api_exceptions.NotFound, api_exceptions.PermissionDenied, api_exceptions.RetryError
+        )
+
+    def configure(self, api_key: str):
+        self.genai.configure(api_key=api_key)
+
+    def create_model(self, name: str, system_instruction: str = None):
+        # Note: 'system_instruction' is supported in newer versions (we have 0.8.6)
+        return self.genai.GenerativeModel(name, system_instruction=system_instruction)
+
+    def is_fault(self, e: Exception) -> bool:
+        return isinstance(e, self.fault_errors)
+
+# --- Fake backend ---
+# Offline stand-in for load and latency testing. Configured by env vars:
+#   FAKE_AI_LATENCY         time to first token: 'fixed:MS', 'uniform:MIN_MS:MAX_MS',
+#                           'normal:MEAN_MS:STD_MS' or 'lognormal:MEDIAN_MS:SIGMA'
+#   FAKE_AI_CHUNK_DELAY_MS  gap between streamed chunks
+#   FAKE_AI_CHUNK_WORDS     words per streamed chunk
+#   FAKE_AI_REPLY_WORDS     reply length
+#   FAKE_AI_ERROR_RATE      share of calls failing with FakeAPIError (a 503 stand-in)
+#   FAKE_AI_HANG_RATE       share of calls that never answer (exercises deadlines)
+#   FAKE_AI_FAILING_MODELS  comma-separated model names that always fail (failover)
+#   FAKE_AI_SEED            makes latencies and injected errors reproducible
+# Reply text depends only on the prompt, so identical prompts get identical replies.
+
+_WORDS = (
+    "бот автоматизация заявка клиент бизнес магазин crm запись оплата telegram "
+    "время продажи менеджер отчет интеграция каталог доставка уведомление"
+).split()
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+_JSON_ARRAY_RE = re.compile(r"\[.*\]", re.S)
+
+class FakeAPIError(Exception):
+    """Injected failure, treated like a 503 from the real API."""
+
+def count_tokens(text: str) -> int:
+    # Words and punctuation marks: close enough to a subword tokenizer for load tests
+    return len(_TOKEN_RE.findall(text or ""))
+
+def _flatten(contents) -> str:
+    if isinstance(contents, str):
+        return contents
+    if isinstance(contents, dict):
+        return " ".join(str(p) for p in contents.get("parts", []))
+    return " ".join(_flatten(c) for c in contents or [])
+
+def _parse_latency(spec: str):
+    """'kind:a:b' -> function(rng) returning seconds."""
+    kind, *args = spec.split(":")
+    args = [float(a) for a in args]
+    if kind == "fixed":
+        return lambda rng: args[0] / 1000
+    if kind == "uniform":
+        return lambda rng: rng.uniform(args[0], args[1]) / 1000
+    if kind == "normal":
+        return lambda rng: max(0.0, rng.gauss(args[0], args[1])) / 1000
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(math.log(args[0]), args[1]) / 1000
+    raise ValueError(f"Unknown FAKE_AI_LATENCY distribution: {spec}")
+
+class _Usage:
+    def __init__(self, prompt_tokens: int, output_tokens: int):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = output_tokens
+        self.total_token_count = prompt_tokens + output_tokens
+
+class _TokenCount:
+    def __init__(self, total_tokens: int):
+        self.total_tokens = total_tokens
+
+class FakeResponse:
+    def __init__(self, text: str, usage: _Usage = None):
+        self.text = text
+        self.usage_metadata = usage
+
+class FakeStreamResponse:
+    """Async-iterable of chunks; `.text` holds the full reply once consumed (like the SDK)."""
+
+    def __init__(self, backend, chunks: list, usage: _Usage, on_done=None):
+        self._backend = backend
+        self._chunks = chunks
+        self._on_done = on_done
+        self.usage_metadata = usage
+        self.text = ""
+
+    async def __aiter__(self):
+        for i, chunk in enumerate(self._chunks):
+            if i:
+                await asyncio.sleep(self._backend.chunk_delay)
+            self.text += chunk
+            yield FakeResponse(chunk)
+        if self._on_done:
+            self._on_done(self.text)
+
+class FakeChat:
+    def __init__(self, model, history: list):
+        self.model = model
+        self.history = list(history or [])
+
+    async def send_message_async(self, content, stream: bool = False):
+        def remember(reply: str):
+            self.history += [{"role": "user", "parts": [content]}, {"role": "model", "parts": [reply]}]
+        return await self.model._respond(self.history + [content], stream=stream, on_done=remember)
+
+class FakeModel:
+    def __init__(self, backend, name: str, system_instruction: str = None):
+        self.backend = backend
+        self.model_name = name
+        self.system_instruction = system_instruction or ""
+
+    def start_chat(self, history: list = None):
+        return FakeChat(self, history)
+
+    async def generate_content_async(self, contents, generation_config=None, stream: bool = False):
+        json_output = bool(generation_config) and generation_config.get("response_mime_type") == "application/json"
+        return await self._respond(contents, stream=stream, json_output=json_output)
+
+    async def count_tokens_async(self, contents):
+        return _TokenCount(count_tokens(self.system_instruction + " " + _flatten(contents)))
+
+    async def _respond(self, contents, stream: bool = False, json_output: bool = False, on_done=None):
+        prompt = _flatten(contents)
+        await self.backend._before_call(self.model_name)
+
+        reply = self.backend._reply_json(prompt) if json_output else self.backend._reply_text(prompt)
+        usage = _Usage(count_tokens(self.system_instruction + " " + prompt), count_tokens(reply))
+        self.backend._count(usage)
+
+        if not stream:
+            if on_done:
+                on_done(reply)
+            return FakeResponse(reply, usage)
+        words = reply.split(" ")
+        step = self.backend.chunk_words
+        chunks = [" ".join(words[i:i + step]) + (" " if i + step < len(words) else "") for i in range(0, len(words), step)]
+        return FakeStreamResponse(self.backend, chunks, usage, on_done)
+
+class FakeBackend(ModelBackend):
+    name = "fake"
+    requires_key = False
+
+    def __init__(self):
+        self.latency = _parse_latency(os.getenv("FAKE_AI_LATENCY", "lognormal:600:0.5"))
+        self.chunk_delay = float(os.getenv("FAKE_AI_CHUNK_DELAY_MS", 40)) / 1000
+        self.chunk_words = max(1, int(os.getenv("FAKE_AI_CHUNK_WORDS", 6)))
+        self.reply_words = int(os.getenv("FAKE_AI_REPLY_WORDS", 60))
+        self.error_rate = float(os.getenv("FAKE_AI_ERROR_RATE", 0))
+        self.hang_rate = float(os.getenv("FAKE_AI_HANG_RATE", 0))
+        self.failing_models = {m.strip() for m in os.getenv("FAKE_AI_FAILING_MODELS", "").split(",") if m.strip()}
+        self.seed = os.getenv("FAKE_AI_SEED")
+        self.rng = random.Random(self.seed)
+        self._stats = {"calls": 0, "errors": 0, "hangs": 0, "prompt_tokens": 0, "output_tokens": 0}
+        logger.warning("🧪 AI_BACKEND=fake: replies are generated locally, no Gemini calls are made.")
+
+    def create_model(self, name: str, system_instruction: str = None):
+        return FakeModel(self, name, system_instruction)
+
+    def is_fault(self, e: Exception) -> bool:
+        return isinstance(e, FakeAPIError)
+
+    def stats(self) -> dict:
+        return dict(self._stats)
+
+    async def _before_call(self, model_name: str):
+        self._stats["calls"] += 1
+        if model_name in self.failing_models or self.rng.random() < self.error_rate:
+            self._stats["errors"] += 1
+            raise FakeAPIError(f"503 Injected failure ({model_name})")
+        if self.rng.random() < self.hang_rate:
+            self._stats["hangs"] += 1
+            await asyncio.sleep(3600)
+        await asyncio.sleep(self.latency(self.rng))
+
+    def _count(self, usage: _Usage):
+        self._stats["prompt_tokens"] += usage.prompt_token_count
+        self._stats["output_tokens"] += usage.candidates_token_count
+
+    def _reply_text(self, prompt: str) -> str:
+        rng = random.Random(f"{self.seed}:{prompt}")
+        return "[fake] " + " ".join(rng.choice(_WORDS) for _ in range(self.reply_words))
+
+    def _reply_json(self, prompt: str) -> str:
+        """Scores every {"id": ...} object of the first JSON array found in the prompt."""
+        rng = random.Random(f"{self.seed}:{prompt}")
+        match = _JSON_ARRAY_RE.search(prompt)
+        try:
+            items = json.loads(match.group(0)) if match else []
+        except ValueError:
+            items = []
+        return json.dumps([
+            {"id": item["id"], "temperature": rng.choice(["cold", "warm", "hot"]), "advice": "[fake] " + rng.choice(_WORDS)}
+            for item in items if isinstance(item, dict) and "id" in item
+        ], ensure_ascii=False)
+
+_BACKENDS = {"gemini": GeminiBackend, "fake": FakeBackend}
+
+def get_backend(name: str = None) -> ModelBackend:
+    """Instantiates the backend named by `name` (default: AI_BACKEND env var, 'gemini')."""
+    name = (name or os.getenv("AI_BACKEND", "gemini")).lower()
+    if name not in _BACKENDS:
+        raise ValueError(f"Unknown AI_BACKEND '{name}' (expected one of: {', '.join(_BACKENDS)})")
+    return _BACKENDS[name]()
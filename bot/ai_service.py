@@ -1,6 +1,15 @@
-import google.generativeai as genai
-from bot.config import GEMINI_API_KEY
+from bot.config import GEMINI_API_KEY, AI_BACKEND
+from bot.ai_backends import get_backend
+from bot.database import add_message
+from bot.chat_context import build_history
+from bot.faq_cache import lookup_answer, remember_answer
+from bot.background import spawn
+import asyncio
+import hashlib
+import json
 import logging
+import os
+import time
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -52,82 +61,430 @@ SYSTEM_PROMPT = """
 Используй эмодзи 🤝, 🚀, 💡, чтобы текст дышал.
 """
 
-def setup_ai():
-    """Initializes the AI model."""
-    if not GEMINI_API_KEY:
-        logger.warning("⚠️ GEMINI_API_KEY is missing. AI will not work.")
+# --- Model Selection ---
+# Importing this module does no network I/O. The model is chosen on first use
+# (get_model), by probing candidates concurrently; the winner is cached on disk
+# so restarts skip the probe.
+
+# Preferred models in order (updated based on API check)
+MODEL_NAMES = [
+    'gemini-2.0-flash',
+    'gemini-2.5-flash',
+    'gemini-flash-latest',
+    'gemini-pro'
+]
+
+PROBE_CACHE_FILE = os.getenv("AI_PROBE_CACHE_FILE", ".ai_model_cache.json")
+PROBE_CACHE_TTL = int(os.getenv("AI_PROBE_CACHE_TTL", 24 * 3600)) # seconds
+PROBE_TIMEOUT = 15     # seconds per candidate
+AI_CALL_TIMEOUT = float(os.getenv("AI_CALL_TIMEOUT", 30))              # seconds per call, failover included
+AI_STREAM_CHUNK_TIMEOUT = float(os.getenv("AI_STREAM_CHUNK_TIMEOUT", 20)) # max gap between streamed chunks
+BREAKER_FAILURES = 3        # consecutive failures that open a model's circuit
+BREAKER_RESET_SECONDS = 30  # open -> half-open after this long
+FAQ_FALLBACK_THRESHOLD = 0.5 # looser FAQ match (seeded entries only) served while every circuit is open
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", 4)) # Gemini calls in flight, all users
+
+# Model SDK: Gemini, or the offline fake (AI_BACKEND=fake, see bot/ai_backends.py)
+backend = get_backend(AI_BACKEND)
+
+# Global model instance (None until initialized, or if AI is unavailable)
+model = None
+model_name = None
+
+_initialized = False
+_init_lock = asyncio.Lock()
+
+def _key_fingerprint() -> str:
+    # Cache is only valid for the backend and API key it was probed with
+    return hashlib.sha256(f"{backend.name}:{GEMINI_API_KEY or ''}".encode()).hexdigest()[:12]
+
+def _enabled() -> bool:
+    return bool(GEMINI_API_KEY) or not backend.requires_key
+
+def _build_model(name: str):
+    return backend.create_model(name, system_instruction=SYSTEM_PROMPT)
+
+def _read_probe_cache():
+    try:
+        with open(PROBE_CACHE_FILE, "r") as f:
+            data = json.load(f)
+        if data.get("key") != _key_fingerprint() or data.get("model") not in MODEL_NAMES:
+            return None
+        if time.time() - data.get("probed_at", 0) > PROBE_CACHE_TTL:
+            return None
+        return data["model"]
+    except (OSError, ValueError, KeyError):
         return None
+
+def _write_probe_cache(name: str):
+    try:
+        with open(PROBE_CACHE_FILE, "w") as f:
+            json.dump({"model": name, "key": _key_fingerprint(), "probed_at": time.time()}, f)
+    except OSError as e:
+        logger.warning(f"Could not write AI probe cache: {e}")
+
+async def _probe(name: str) -> bool:
+    """The constructor is lazy and won't throw 404. We must generate something."""
+    try:
+        await asyncio.wait_for(_build_model(name).generate_content_async("Test"), PROBE_TIMEOUT)
+        return True
+    except Exception as e:
+        logger.warning(f"❌ Model {name} failed: {e}")
+        return False
+
+async def _select_model():
+    """Probes all candidates concurrently; returns the most preferred working name (or None)."""
+    logger.info(f"Testing models: {', '.join(MODEL_NAMES)}...")
+    results = await asyncio.gather(*(_probe(name) for name in MODEL_NAMES))
+    for name, ok in zip(MODEL_NAMES, results):
+        if ok:
+            return name
+    return None
+
+async def _init_model():
+    global model, model_name, _initialized
+    if not _enabled():
+        logger.warning("⚠️ GEMINI_API_KEY is missing. AI will not work.")
+        _initialized = True
+        return
     
     try:
-        genai.configure(api_key=GEMINI_API_KEY)
-        
-        # Try preferred models in order (updated based on API check)
-        model_names = [
-            'gemini-2.0-flash',
-            'gemini-2.5-flash',
-            'gemini-flash-latest',
-            'gemini-pro'
-        ]
+        backend.configure(GEMINI_API_KEY)
         
-        for name in model_names:
-            try:
-                # Note: 'system_instruction' is supported in newer versions (we have 0.8.6)
-                # But some older models might reject it or the API endpoint might vary.
-                # We try with it first.
-                model = genai.GenerativeModel(name, system_instruction=SYSTEM_PROMPT)
-                
-                # CRITICAL: Test the model immediately. 
-                # The constructor is lazy and won't throw 404. We must generate something.
-                logger.info(f"Testing model: {name}...")
-                model.generate_content("Test")
-                
+        name = _read_probe_cache()
+        if name:
+            logger.info(f"✅ AI using cached model choice: {name}")
+        else:
+            name = await _select_model()
+            if name:
+                _write_probe_cache(name)
                 logger.info(f"✅ AI Successfully configured using: {name}")
-                return model
-            except Exception as e:
-                logger.warning(f"❌ Model {name} failed: {e}")
-                continue
+            else:
+                logger.error("❌ All AI models failed to initialize.")
         
-        logger.error("❌ All AI models failed to initialize.")
-        return None
+        if name:
+            model, model_name = _build_model(name), name
     except Exception as e:
         logger.error(f"Failed to configure AI: {e}")
-        return None
+    _initialized = True
+
+async def get_model():
+    """Returns the Gemini model (None if unavailable). Initializes once, on first call."""
+    if not _initialized:
+        async with _init_lock:
+            if not _initialized:
+                await _init_model()
+    return model
+
+def warm_up():
+    """Starts model initialization in the background (call on app startup)."""
+    if not _initialized:
+        spawn(get_model(), name="ai-warm-up")
+
+# --- Circuit Breaker & Failover ---
+# Every model call gets a deadline. Each model has its own breaker: after
+# BREAKER_FAILURES consecutive failures it opens and calls skip to the next model
+# in MODEL_NAMES. After BREAKER_RESET_SECONDS one trial call is let through
+# (half-open); its result closes or re-opens the breaker. When every breaker is
+# open, calls fail immediately (AIUnavailableError) instead of waiting on the network.
+
+class AIUnavailableError(Exception):
+    """No model accepted the call (all circuits open, or every attempt failed)."""
+
+class CircuitBreaker:
+    def __init__(self, name: str):
+        self.name = name
+        self.state = "closed" # 'closed', 'open' or 'half_open'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_running = False
+
+    def available(self) -> bool:
+        """Would a call be let through right now? (No side effects.)"""
+        if self.state == "open":
+            return time.monotonic() - self.opened_at >= BREAKER_RESET_SECONDS
+        if self.state == "half_open":
+            return not self.trial_running
+        return True
+
+    def allow(self) -> bool:
+        """Claims permission for one call (the trial call, when half-open)."""
+        if not self.available():
+            return False
+        if self.state == "open":
+            self.state = "half_open"
+            logger.info(f"🟡 Circuit {self.name}: half-open, sending a trial call")
+        if self.state == "half_open":
+            self.trial_running = True
+        return True
+
+    def record_success(self):
+        if self.state != "closed":
+            logger.info(f"🟢 Circuit {self.name}: closed")
+        self.state, self.failures, self.trial_running = "closed", 0, False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_running = False
+        if self.state == "half_open" or self.failures >= BREAKER_FAILURES:
+            if self.state != "open":
+                logger.warning(f"🔴 Circuit {self.name}: open for {BREAKER_RESET_SECONDS}s")
+            self.state, self.opened_at = "open", time.monotonic()
 
-# Global model instance
-model = setup_ai()
+    def release(self):
+        """Call was cancelled before it could succeed or fail."""
+        self.trial_running = False
 
-from bot.database import add_message, get_chat_history
+_breakers = {name: CircuitBreaker(name) for name in MODEL_NAMES}
+_models = {} # (name, persona) -> GenerativeModel
 
-# ... (imports and setup_ai remain same)
+def _is_model_fault(e: Exception) -> bool:
+    # Timeouts and backend-specific API faults (quota, 5xx, unknown model): the model is the problem.
+    # Anything else (blocked content, bad input) says nothing about its health.
+    return isinstance(e, asyncio.TimeoutError) or backend.is_fault(e)
 
-# Global model instance
-model = setup_ai()
+def _candidates() -> list:
+    """Failover order: the selected model first, then the rest of MODEL_NAMES."""
+    # If startup probing found nothing (e.g. network down at boot), every model is still tried
+    return ([model_name] if model_name else []) + [name for name in MODEL_NAMES if name != model_name]
 
-async def get_ai_response(user_id: int, user_text: str) -> str:
+def _get_model(name: str, persona: bool = True):
+    key = (name, persona)
+    if key not in _models:
+        _models[key] = _build_model(name) if persona else backend.create_model(name)
+    return _models[key]
+
+def circuit_open() -> bool:
+    """True when no model would accept a call right now (fast-fail)."""
+    if not _enabled():
+        return True
+    return not any(_breakers[name].available() for name in _candidates())
+
+async def call_model(fn, persona: bool = True, timeout: float = None):
+    """
+    Runs `await fn(model)` with failover: every available model is tried in order
+    until one succeeds or the deadline (AI_CALL_TIMEOUT in total) runs out.
+    Raises AIUnavailableError if no model answered; non-model errors propagate as is.
+    """
+    if not _enabled():
+        raise AIUnavailableError("GEMINI_API_KEY is missing")
+    await get_model() # Configures the client on first use
+    deadline = time.monotonic() + (timeout or AI_CALL_TIMEOUT)
+    last_error = None
+    for name in _candidates():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        breaker = _breakers[name]
+        if not breaker.allow():
+            continue
+        try:
+            result = await asyncio.wait_for(fn(_get_model(name, persona)), remaining)
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except Exception as e:
+            if not _is_model_fault(e):
+                breaker.release()
+                raise
+            breaker.record_failure()
+            last_error = e
+            logger.warning(f"❌ Model {name} failed ({type(e).__name__}: {e}), failing over.")
+            continue
+        breaker.record_success()
+        return result
+    raise AIUnavailableError(f"No model available: {last_error}")
+
+async def stream_model(history: list, user_text: str):
+    """
+    Streaming chat call with failover (async generator of text chunks).
+    Fails over only until the first chunk has been yielded; every chunk has a deadline.
+    """
+    if not _enabled():
+        raise AIUnavailableError("GEMINI_API_KEY is missing")
+    await get_model() # Configures the client on first use
+    last_error = None
+    for name in _candidates():
+        breaker = _breakers[name]
+        if not breaker.allow():
+            continue
+        started = False
+        try:
+            chat = _get_model(name).start_chat(history=history)
+            response = await asyncio.wait_for(chat.send_message_async(user_text, stream=True), AI_CALL_TIMEOUT)
+            chunks = response.__aiter__()
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), AI_STREAM_CHUNK_TIMEOUT)
+                except StopAsyncIteration:
+                    break
+                started = True
+                yield chunk.text
+        except (asyncio.CancelledError, GeneratorExit):
+            breaker.release()
+            raise
+        except Exception as e:
+            if not _is_model_fault(e):
+                breaker.release()
+                raise
+            breaker.record_failure()
+            last_error = e
+            if started:
+                raise
+            logger.warning(f"❌ Model {name} failed ({type(e).__name__}: {e}), failing over.")
+            continue
+        breaker.record_success()
+        return
+    raise AIUnavailableError(f"No model available: {last_error}")
+
+def get_circuit_states() -> dict:
+    return {name: b.state for name, b in _breakers.items()}
+
+async def generate_text(prompt: str, json_output: bool = False) -> str:
+    """
+    One-off completion on the selected model, without the chat persona
+    (summaries, scoring and other internal prompts). Raises on failure.
+    json_output=True asks the model for a JSON response body.
+    """
+    config = {"response_mime_type": "application/json"} if json_output else None
+    async with ai_slot():
+        response = await call_model(lambda m: m.generate_content_async(prompt, generation_config=config), persona=False)
+    return response.text.strip()
+
+AI_UNAVAILABLE_TEXT = "Извините, мой искусственный интеллект сейчас отдыхает (нет ключа API). 😴\nПопробуйте позже или выберите пункт в меню."
+AI_ERROR_TEXT = "Что-то пошло не так с моим электронным мозгом. 🤯\nПопробуйте переформулировать вопрос."
+AI_BUSY_TEXT = "Мой электронный мозг сейчас перегружен. 🔌\nПопробуйте через минуту или выберите пункт в меню."
+
+async def _save_turn(user_id: int, user_text: str, answer: str):
+    await add_message(user_id, 'user', user_text)
+    await add_message(user_id, 'model', answer)
+
+async def fallback_reply(user_text: str, lang: str) -> str:
+    """Answer while the AI is unreachable: a looser FAQ match, else a canned message."""
+    if not _enabled():
+        return AI_UNAVAILABLE_TEXT
+    cached = await lookup_answer(user_text, lang, threshold=FAQ_FALLBACK_THRESHOLD)
+    return cached if cached is not None else AI_BUSY_TEXT
+
+async def stream_ai_response(user_id: int, user_text: str, lang: str = "ru"):
     """
-    Generates a response using Google Gemini, maintaining conversation history via SQLite.
+    Generates a chat reply with Gemini, keeping conversation history in the database
+    (async generator; called through dispatch_ai_response, which answers FAQ hits first).
+    Yields the reply accumulated so far after every chunk; on failure yields the error text last.
+    History is saved only once the full reply has arrived.
     """
-    if not model:
-        return "Извините, мой искусственный интеллект сейчас отдыхает (нет ключа API). 😴\nПопробуйте позже или выберите пункт в меню."
+    if circuit_open():
+        yield await fallback_reply(user_text, lang)
+        return
 
     try:
-        # 1. Fetch persistent history (Last 20 messages)
-        # Note: History does NOT include the current message yet
-        history = await get_chat_history(user_id, limit=20)
+        history = await build_history(user_id)
         
-        # 2. Start chat session with history
-        chat = model.start_chat(history=history)
+        text = ""
+        async for chunk in stream_model(history, user_text):
+            text += chunk
+            yield text
         
-        # 3. Send new message to AI
-        response = await chat.send_message_async(user_text)
-        
-        # 4. Save interactions to DB (Commit to history)
-        # We save AFTER success to avoid saving failed prompts if AI crashes
         await add_message(user_id, 'user', user_text)
-        await add_message(user_id, 'model', response.text)
-        
-        return response.text
+        await add_message(user_id, 'model', text)
+        if not history:
+            remember_answer(user_text, text, lang)
         
+    except AIUnavailableError as e:
+        logger.error(f"AI Unavailable: {e}")
+        yield await fallback_reply(user_text, lang)
     except Exception as e:
-        logger.error(f"AI Generation Error: {e}")
-        return "Что-то пошло не так с моим электронным мозгом. 🤯\nПопробуйте переформулировать вопрос."
+        logger.error(f"AI Streaming Error: {e}")
+        yield AI_ERROR_TEXT
+
+# --- Dispatcher ---
+# Every Gemini call goes through one global semaphore (quota / p99 protection).
+# Chat messages are additionally serialized per user: while a user's request is
+# waiting or running, their new messages are collected into the next batch and
+# answered together, with a single call, once the previous one has finished.
+
+_ai_semaphore = asyncio.Semaphore(AI_MAX_CONCURRENCY)
+
+class _UserQueue:
+    __slots__ = ("open_batch", "tail", "depth")
+
+    def __init__(self):
+        self.open_batch = None # Texts still accepting coalesced messages
+        self.tail = None       # Event set when the user's last batch is done
+        self.depth = 0         # Batches waiting or running
+
+_user_queues = {}
+_metrics = {"in_flight": 0, "waiting": 0, "peak_waiting": 0, "requests": 0, "batches": 0, "coalesced": 0}
+
+class ai_slot:
+    """`async with ai_slot():` around any model call, to respect AI_MAX_CONCURRENCY."""
+    async def __aenter__(self):
+        _metrics["waiting"] += 1
+        _metrics["peak_waiting"] = max(_metrics["peak_waiting"], _metrics["waiting"])
+        try:
+            await _ai_semaphore.acquire()
+        finally:
+            _metrics["waiting"] -= 1
+        _metrics["in_flight"] += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        _metrics["in_flight"] -= 1
+        _ai_semaphore.release()
+
+async def dispatch_ai_response(user_id: int, user_text: str, lang: str = "ru"):
+    """
+    Queued, coalescing front of stream_ai_response (async generator, same output).
+    FAQ cache hits are answered without taking an AI slot.
+    Yields nothing when the message was merged into a batch another call answers.
+    """
+    _metrics["requests"] += 1
+    queue = _user_queues.get(user_id)
+    if queue and queue.open_batch is not None:
+        queue.open_batch.append(user_text)
+        _metrics["coalesced"] += 1
+        return
+
+    if queue is None:
+        queue = _user_queues[user_id] = _UserQueue()
+    batch = queue.open_batch = [user_text]
+    previous, done = queue.tail, asyncio.Event()
+    queue.tail = done
+    queue.depth += 1
+    try:
+        if previous is not None:
+            await previous.wait() # FIFO: the user's earlier batch goes first
+        if len(batch) == 1:
+            cached = await lookup_answer(user_text, lang)
+            if cached is not None and len(batch) == 1: # Nothing coalesced in the meantime
+                queue.open_batch = None
+                await _save_turn(user_id, user_text, cached)
+                yield cached
+                return
+        if circuit_open(): # Fast-fail: don't queue for a slot while every model is down
+            if queue.open_batch is batch:
+                queue.open_batch = None
+            yield await fallback_reply("\n".join(batch), lang)
+            return
+        async with ai_slot():
+            if queue.open_batch is batch:
+                queue.open_batch = None # Closed: later messages start the next batch
+            _metrics["batches"] += 1
+            async for text in stream_ai_response(user_id, "\n".join(batch), lang):
+                yield text
+    finally:
+        if queue.open_batch is batch:
+            queue.open_batch = None
+        queue.depth -= 1
+        done.set()
+        if queue.depth == 0 and _user_queues.get(user_id) is queue:
+            del _user_queues[user_id]
+
+def get_ai_queue_stats() -> dict:
+    """Queue-depth metrics for the admin API."""
+    return {
+        **_metrics,
+        "max_concurrency": AI_MAX_CONCURRENCY,
+        "users_queued": len(_user_queues),
+        "batches_queued": sum(q.depth for q in _user_queues.values()),
+    }
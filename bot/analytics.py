@@ -0,0 +1,127 @@
+"""
+Order analytics over the `daily_stats` rollup (see bot/database.py).
+
+Every query here reads rollup cells (days x services x statuses), never raw
+orders, so cost grows with the date range, not with the order count.
+The rollup is maintained incrementally on writes; a background job
+reconciles the recent window against `orders` in case anything bypassed it
+(manual SQL, a crash between statements).
+
+Reconcile offline:
+    python -m bot.analytics --days 0      (0 = whole history)
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+from datetime import date, timedelta
+from bot.database import engine, get_daily_rollup, reconcile_daily_stats, REVENUE_STATUSES
+from bot.background import spawn
+
+logger = logging.getLogger(__name__)
+
+STATS_RECONCILE_INTERVAL_HOURS = float(os.getenv("STATS_RECONCILE_INTERVAL_HOURS", 6)) # 0 = not scheduled
+STATS_RECONCILE_DAYS = int(os.getenv("STATS_RECONCILE_DAYS", 35))
+MAX_RANGE_DAYS = 731
+GROUPS = ("day", "week", "month")
+
+# Pipeline order. An order counts as having reached every stage up to its current one;
+# cancelled orders are reported separately (the stage they dropped from isn't stored).
+FUNNEL_STAGES = ("new", "negotiation_pending", "in_progress", "completed")
+
+def _period(day: date, group: str) -> str:
+    if group == "week":
+        return (day - timedelta(days=day.weekday())).isoformat() # Monday
+    if group == "month":
+        return day.strftime("%Y-%m")
+    return day.isoformat()
+
+def _funnel(statuses: dict) -> list:
+    total = sum(n for status, n in statuses.items() if status != "cancelled")
+    stages, reached = [], total
+    for stage in FUNNEL_STAGES:
+        stages.append({"stage": stage, "orders": reached, "share": round(reached / total, 3) if total else 0.0})
+        reached -= statuses.get(stage, 0)
+    return stages
+
+async def get_stats_range(start: date, end: date, group: str = "day", service: str = None) -> dict:
+    """
+    Orders, revenue and status breakdowns for start..end (inclusive), bucketed by day/week/month.
+    Raises ValueError on a bad range or group.
+    """
+    if group not in GROUPS:
+        raise ValueError(f"group must be one of: {', '.join(GROUPS)}")
+    if end < start or (end - start).days >= MAX_RANGE_DAYS:
+        raise ValueError(f"Date range must be 1..{MAX_RANGE_DAYS} days")
+
+    # Every period in range, gaps included
+    series = {}
+    day = start
+    while day <= end:
+        series.setdefault(_period(day, group), {"orders": 0, "revenue": 0, "statuses": {}})
+        day += timedelta(days=1)
+
+    statuses, services = {}, {}
+    totals = {"orders": 0, "amount": 0, "revenue": 0, "paid_orders": 0}
+    for row in await get_daily_rollup(start, end, service):
+        revenue = row.amount if row.status in REVENUE_STATUSES else 0
+        bucket = series[_period(row.day, group)]
+        bucket["orders"] += row.orders
+        bucket["revenue"] += revenue
+        bucket["statuses"][row.status] = bucket["statuses"].get(row.status, 0) + row.orders
+
+        statuses[row.status] = statuses.get(row.status, 0) + row.orders
+        by_service = services.setdefault(row.service, {"orders": 0, "revenue": 0})
+        by_service["orders"] += row.orders
+        by_service["revenue"] += revenue
+
+        totals["orders"] += row.orders
+        if row.status != "cancelled":
+            totals["amount"] += row.amount # Pipeline value
+        if row.status in REVENUE_STATUSES:
+            totals["revenue"] += revenue
+            totals["paid_orders"] += row.orders
+
+    totals["avg_check"] = round(totals["revenue"] / totals["paid_orders"]) if totals["paid_orders"] else 0
+    return {
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "group": group,
+        "totals": totals,
+        "series": [{"period": period, **values} for period, values in series.items()],
+        "statuses": statuses,
+        "funnel": _funnel(statuses),
+        "cancelled": statuses.get("cancelled", 0),
+        "services": dict(sorted(services.items(), key=lambda kv: kv[1]["revenue"], reverse=True)),
+    }
+
+# --- Reconciliation ---
+
+async def _reconcile_loop(interval_hours: float, days: int):
+    while True:
+        await asyncio.sleep(interval_hours * 3600)
+        try:
+            await reconcile_daily_stats(days)
+        except Exception as e:
+            logger.error(f"❌ daily_stats reconciliation failed: {e}")
+
+def start_stats_reconciler():
+    """Reconciles the last STATS_RECONCILE_DAYS of daily_stats every STATS_RECONCILE_INTERVAL_HOURS (no-op if 0)."""
+    if STATS_RECONCILE_INTERVAL_HOURS > 0:
+        spawn(_reconcile_loop(STATS_RECONCILE_INTERVAL_HOURS, STATS_RECONCILE_DAYS), name="stats-reconcile")
+        logger.info(f"📊 daily_stats reconciliation scheduled every {STATS_RECONCILE_INTERVAL_HOURS}h.")
+
+async def _main(args):
+    try:
+        drift = await reconcile_daily_stats(args.days or None)
+        print(json.dumps({"corrected_cells": drift}))
+    finally:
+        await engine.dispose()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+    parser = argparse.ArgumentParser(description="Rebuild the daily_stats rollup from orders.")
+    parser.add_argument("--days", type=int, default=STATS_RECONCILE_DAYS, help="window to reconcile (0 = everything)")
+    asyncio.run(_main(parser.parse_args()))
@@ -1,14 +1,23 @@
 from aiohttp import web
 from bot.database import (
-    count_users, get_recent_orders, count_orders, get_order_by_id, 
+    get_recent_orders, get_order_by_id, 
     update_order_status as db_update_order_status, 
     update_order_details as db_update_order_details,
-    get_daily_stats, get_all_user_ids, add_order,
+    get_dashboard_snapshot, get_product_sales, add_order,
     add_product, get_all_products, update_product, delete_product,
-    get_referred_users
+    get_referred_users, get_clients_page, get_resource_version,
+    create_broadcast, get_broadcast, get_pool_stats
 )
+from bot.broadcast import start_broadcast
+from bot.search import search_orders
 from bot.config import ADMIN_ID
+from bot.events import subscribe_orders, unsubscribe_orders, streams_closing, wait_or_close, STREAM_CLOSED
+from datetime import datetime
 import asyncio
+import json
+
+# Keep-alive interval for the live order stream (Render's proxy drops idle connections)
+SSE_HEARTBEAT_SECONDS = 15
 
 def require_admin(handler):
     """
@@ -34,32 +43,72 @@ def require_admin(handler):
         return await handler(request)
     return wrapper
 
+def conditional_get(*resources, daily: bool = False):
+    """
+    Decorator for read-only JSON endpoints (Conditional GET).
+    The ETag is built from the write versions of `resources`, so a matching
+    If-None-Match is answered with 304 before any query or serialization.
+    daily=True also rolls the ETag over at midnight (date-windowed data).
+    """
+    def decorator(handler):
+        async def wrapper(request):
+            # Version is read BEFORE the handler runs: a concurrent write can only
+            # make the ETag older than the body (-> one extra 200), never newer.
+            parts = [get_resource_version(r) for r in resources]
+            if daily:
+                parts.append(datetime.utcnow().strftime("%Y%m%d"))
+            etag = 'W/"' + "-".join(parts) + '"'
+            headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+            
+            if_none_match = request.headers.get("If-None-Match", "")
+            client_tags = {tag.strip() for tag in if_none_match.split(",")}
+            if etag in client_tags or "*" in client_tags:
+                return web.Response(status=304, headers=headers)
+            
+            response = await handler(request)
+            if response.status == 200:
+                response.headers.update(headers)
+            return response
+        return wrapper
+    return decorator
+
+def page_params(request, default: int = 20, maximum: int = 100):
+    """Reads ?limit=&cursor= for keyset-paginated lists."""
+    try:
+        limit = int(request.query.get("limit", default))
+    except ValueError:
+        limit = default
+    return max(1, min(limit, maximum)), request.query.get("cursor")
+
+def page_response(data: list, next_cursor: str = None):
+    """JSON list body; the cursor of the next (older) page goes in X-Next-Cursor."""
+    response = web.json_response(data)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response
+
 @require_admin
+@conditional_get("users", "orders", daily=True)
 async def get_dashboard_stats(request):
     """
     Returns JSON statistics + Chart Data.
     GET /api/stats
     """
-    total_users = await count_users()
-    total_orders = await count_orders()
-    
-    # Revenue (Mock, or derive from budget if parsed)
-    revenue = total_orders * 150 # Mock avg
+    # One cached, single-query snapshot (totals + gap-filled 7-day series)
+    snapshot = await get_dashboard_snapshot(7)
+    total_orders = snapshot["orders"]
     
-    # Chart Data
-    daily_stats = await get_daily_stats(7)
-    # Format for Chart.js: labels=["Mon", "Tue"], data=[5, 2]
-    chart_labels = []
-    chart_values = []
+    # Revenue: sum of orders.amount over accepted deals (in_progress/completed)
+    revenue = snapshot["revenue"]
     
-    # Fill gaps? For MVP just return what we have.
-    for date_str, count in daily_stats:
-        chart_labels.append(str(date_str)[5:]) # "MM-DD"
-        chart_values.append(count)
+    # Format for Chart.js: labels=["MM-DD", ...], data=[5, 2, ...]
+    chart_labels = [date_str[5:] for date_str, _ in snapshot["daily"]]
+    chart_values = [count for _, count in snapshot["daily"]]
 
     stats = {
-        "users": total_users,
-        "revenue_today": revenue,  
+        "users": snapshot["users"],
+        "revenue_today": snapshot["revenue_today"],
+        "revenue": revenue,
         "active_orders": total_orders,
         "chart": {
             "labels": chart_labels,
@@ -70,26 +119,82 @@ async def get_dashboard_stats(request):
     return web.json_response(stats)
 
 @require_admin
+@conditional_get("orders")
 async def get_bookings_list(request):
-    """GET /api/bookings?q=search_term"""
+    """
+    GET /api/bookings?limit=20&cursor=...  (newest first, next page cursor in X-Next-Cursor)
+    GET /api/bookings?q=search_term&offset=0  (ranked; next page offset in X-Next-Offset)
+    """
     search_query = request.query.get('q')
-    limit = 50 if search_query else 20 # Show more results if searching
     
-    orders = await get_recent_orders(limit=limit, search_query=search_query)
-    data = []
-    for o in orders:
-        data.append({
-            "id": o.id,
-            "client": o.name or "Unknown",
-            "service": o.service_context or "Service",
-            "time": o.created_at.isoformat() if o.created_at else None,
-            "status": o.status,
-            "budget": o.budget,
-            "desc": o.task_description,
-            "ai_summary": o.admin_comment,
-            "items": o.items or "[]"
-        })
-    return web.json_response(data)
+    if search_query:
+        try:
+            offset = int(request.query.get('offset', 0))
+        except ValueError:
+            offset = -1
+        if offset < 0:
+            return web.json_response({"error": "Invalid offset"}, status=400)
+        orders, next_offset = await search_orders(search_query, limit=50, offset=offset)
+        response = web.json_response([serialize_order(o) for o in orders])
+        if next_offset is not None:
+            response.headers["X-Next-Offset"] = str(next_offset)
+        return response
+    
+    limit, cursor = page_params(request, default=20)
+    try:
+        page = await get_recent_orders(limit=limit, cursor=cursor)
+    except ValueError:
+        return web.json_response({"error": "Invalid cursor"}, status=400)
+    return page_response([serialize_order(o) for o in page.items], page.next_cursor)
+
+def serialize_order(o):
+    """Order row -> JSON shape used by the CRM lists (bookings + live stream)."""
+    return {
+        "id": o.id,
+        "client": o.name or "Unknown",
+        "service": o.service_context or "Service",
+        "time": o.created_at.isoformat() if o.created_at else None,
+        "status": o.status,
+        "budget": o.budget,
+        "desc": o.task_description,
+        "ai_summary": o.admin_comment,
+        "items": o.items or "[]"
+    }
+
+@require_admin
+async def stream_orders(request):
+    """
+    GET /api/bookings/stream
+    Server-Sent Events feed of order changes ('created', 'status', 'updated').
+    A 'resync' event tells the client to re-fetch /api/bookings.
+    """
+    response = web.StreamResponse(headers={
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no" # Disable proxy buffering
+    })
+    await response.prepare(request)
+    
+    queue = subscribe_orders()
+    try:
+        await response.write(b"retry: 3000\n\n")
+        while not streams_closing():
+            try:
+                event, order = await asyncio.wait_for(queue.get(), timeout=SSE_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                await response.write(b": ping\n\n")
+                continue
+            if (event, order) == STREAM_CLOSED:
+                break # Server shutting down; the client reconnects after `retry`
+            
+            payload = json.dumps(serialize_order(order) if order else {})
+            await response.write(f"event: {event}\ndata: {payload}\n\n".encode("utf-8"))
+    except (ConnectionResetError, ConnectionError):
+        pass # Client closed the tab
+    finally:
+        unsubscribe_orders(queue)
+    
+    return response
 
 @require_admin
 async def analyze_order(request):
@@ -100,10 +205,10 @@ async def analyze_order(request):
     if not order:
         return web.json_response({"error": "Order not found"}, status=404)
         
-    # Lazy load AI model
-    from bot.ai_service import model
-    if not model:
-        return web.json_response({"error": "AI not initialized"}, status=503)
+    # Lazy load AI service
+    from bot.ai_service import call_model, circuit_open, ai_slot, AIUnavailableError
+    if circuit_open():
+        return web.json_response({"error": "AI unavailable"}, status=503)
         
     prompt = (
         f"Ты — бизнес-ассистент. Проанализируй этот лид:\n"
@@ -116,17 +221,77 @@ async def analyze_order(request):
     )
     
     try:
-        response = await model.generate_content_async(prompt)
+        async with ai_slot():
+            response = await call_model(lambda model: model.generate_content_async(prompt))
         analysis = response.text.strip()
         
         # Save to DB
         await db_update_order_details(order_id, {"admin_comment": analysis})
         
         return web.json_response({"analysis": analysis})
+    except AIUnavailableError as e:
+        return web.json_response({"error": str(e)}, status=503)
     except Exception as e:
         print(f"AI Analysis Error: {e}")
         return web.json_response({"error": str(e)}, status=500)
 
+@require_admin
+async def analyze_orders_batch(request):
+    """
+    POST /api/orders/analyze
+    Body (optional): {"all": false, "status": "new"}
+    Scores every lead without an AI comment ("all": true re-scores them too) in the background.
+    Returns 202 with the job id; progress via /api/orders/analyze/{job_id}[/stream].
+    """
+    from bot.lead_scoring import start_scoring
+    try:
+        body = await request.json() if request.can_read_body else {}
+    except ValueError:
+        body = None
+    if not isinstance(body, dict):
+        return web.json_response({"error": "Body must be a JSON object"}, status=400)
+    job = await start_scoring(only_unscored=not body.get("all"), status=body.get("status"))
+    return web.json_response({"status": "queued", "job_id": job.id, "count": job.total}, status=202)
+
+@require_admin
+async def get_analysis_job(request):
+    """GET /api/orders/analyze/{job_id}"""
+    from bot.lead_scoring import get_scoring_job
+    job = get_scoring_job(int(request.match_info['job_id']))
+    if not job:
+        return web.json_response({"error": "Job not found"}, status=404)
+    return web.json_response(job.snapshot())
+
+@require_admin
+async def stream_analysis_job(request):
+    """
+    GET /api/orders/analyze/{job_id}/stream
+    Server-Sent Events: 'progress' after every batch, then a final 'done'.
+    """
+    from bot.lead_scoring import get_scoring_job
+    job = get_scoring_job(int(request.match_info['job_id']))
+    if not job:
+        return web.json_response({"error": "Job not found"}, status=404)
+
+    response = web.StreamResponse(headers={
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+    await response.prepare(request)
+    try:
+        while True:
+            changed = job.changed # Grab before reading state, so no update is missed
+            event = "progress" if job.status == "running" else "done"
+            await response.write(f"event: {event}\ndata: {json.dumps(job.snapshot())}\n\n".encode("utf-8"))
+            if event == "done":
+                break
+            if not await wait_or_close(changed, SSE_HEARTBEAT_SECONDS):
+                break # Server shutting down
+    except (ConnectionResetError, ConnectionError):
+        pass
+    return response
+
 @require_admin
 async def get_order_details(request):
     """GET /api/orders/{id}"""
@@ -204,13 +369,10 @@ async def negotiate_order(request):
     try:
         body = await request.json()
         
-        # Update Details (Budget, Comment)
-        updated_order = await db_update_order_details(order_id, body)
+        # Update Details (Budget, Comment) + status pending negotiation, one statement
+        updated_order = await db_update_order_details(order_id, body, status="negotiation_pending")
         if not updated_order:
             return web.json_response({"error": "Order not found"}, status=404)
-            
-        # Update Status to pending negotiation
-        await db_update_order_status(order_id, "negotiation_pending")
         
         # Notify User via Bot with Buttons
         bot = request.app["bot"]
@@ -247,6 +409,7 @@ async def send_broadcast(request):
     """
     POST /api/broadcast
     Body: {"message": "Hello everyone!"}
+    Queues a background job and returns immediately (202).
     """
     body = await request.json()
     text = body.get("message")
@@ -254,19 +417,29 @@ async def send_broadcast(request):
     if not text:
         return web.json_response({"error": "Message required"}, status=400)
         
-    user_ids = await get_all_user_ids()
-    bot = request.app["bot"]
-    
-    count = 0
-    for uid in user_ids:
-        try:
-            await bot.send_message(chat_id=uid, text=text)
-            count += 1
-            await asyncio.sleep(0.05) # Avoid hitting limits
-        except Exception as e:
-            print(f"Broadcast fail for {uid}: {e}")
+    job_id, total = await create_broadcast(text)
+    start_broadcast(request.app["bot"], job_id)
             
-    return web.json_response({"status": "sent", "count": count})
+    return web.json_response({"status": "queued", "job_id": job_id, "count": total}, status=202)
+
+@require_admin
+async def get_broadcast_status(request):
+    """GET /api/broadcast/{id}"""
+    job_id = int(request.match_info['id'])
+    job = await get_broadcast(job_id)
+    if not job:
+        return web.json_response({"error": "Broadcast not found"}, status=404)
+    
+    return web.json_response({
+        "id": job.id,
+        "status": job.status,
+        "total": job.total,
+        "sent": job.sent,
+        "failed": job.failed,
+        "pending": job.total - job.sent - job.failed,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None
+    })
 
 async def create_client_order(request):
     """
@@ -300,7 +473,8 @@ async def create_client_order(request):
         "business_type": "Web App Order",
         "budget": f"{total} TJS",
         "task_description": description,
-        "service_context": "Storefront"
+        "service_context": "Storefront",
+        "items": body.get("items", [])
     }
     
     try:
@@ -332,68 +506,58 @@ async def create_client_order(request):
 
 async def get_client_referrals(request):
     """
-    GET /api/client/referrals
+    GET /api/client/referrals?limit=50&cursor=...
     Headers: X-Telegram-User
     """
     user_id = request.headers.get("X-Telegram-User")
     if not user_id:
         return web.json_response({"error": "Unauthorized"}, status=401)
-        
-    referrals = await get_referred_users(int(user_id))
+    
+    limit, cursor = page_params(request, default=50)
+    try:
+        page = await get_referred_users(int(user_id), limit=limit, cursor=cursor)
+    except ValueError:
+        return web.json_response({"error": "Invalid cursor"}, status=400)
     data = []
-    for r in referrals:
+    for r in page.items:
         data.append({
             "id": r.id,
             "name": r.full_name or "Unknown",
             "date": r.joined_at.isoformat() if r.joined_at else None,
             "earned": "0 TJS" # Placeholder for cashback logic
         })
-    return web.json_response(data)
+    return page_response(data, page.next_cursor)
 
 @require_admin
+@conditional_get("orders")
 async def get_clients_list(request):
     """
-    GET /api/clients
-    Returns aggregated stats per user:
-    [{id: 123, name: "Ali", total_orders: 5, total_spend: 5000, last_order: "2023-..."}]
+    GET /api/clients?limit=50&cursor=...
+    Returns aggregated stats per user, most recently active first (next page cursor in X-Next-Cursor):
+    [{id: 123, name: "Ali", orders_count: 5, total_spend: 5000, last_seen: "2023-..."}]
+    total_spend (LTV) sums orders.amount over accepted deals.
     """
-    from bot.database import AsyncSessionLocal, Order, select, func
+    limit, cursor = page_params(request, default=50)
+    try:
+        page = await get_clients_page(limit, cursor)
+    except ValueError:
+        return web.json_response({"error": "Invalid cursor"}, status=400)
     
-    async with AsyncSessionLocal() as session:
-        # Group by user_id and aggregate
-        # Note: In a real SQL, we'd join with Users table. 
-        # Here we rely on Order data + aggregation.
-        
-        stmt = (
-            select(
-                Order.user_id, 
-                func.max(Order.name).label('name'), # Take latest name
-                func.max(Order.contact_info).label('contact'),
-                func.count(Order.id).label('count'),
-                func.max(Order.created_at).label('last_seen')
-                # For sum, budget is string "5000 TJS", detailed parsing needed in real app.
-                # using Count as proxy for now for MVP speed.
-            )
-            .group_by(Order.user_id)
-            .order_by(func.count(Order.id).desc())
-        )
-        
-        result = await session.execute(stmt)
-        rows = result.all()
+    clients = []
+    for r in page.items:
+        clients.append({
+            "id": r.user_id,
+            "name": r.name or "Unknown",
+            "contact": r.contact,
+            "orders_count": r.count,
+            "total_spend": r.spend,
+            "last_seen": r.last_seen.isoformat() if r.last_seen else None,
+            "ltv_grade": "VIP" if r.count > 3 else "New" # Simple segmentation logic
+        })
         
-        clients = []
-        for r in rows:
-            clients.append({
-                "id": r.user_id,
-                "name": r.name or "Unknown",
-                "contact": r.contact,
-                "orders_count": r.count,
-                "last_seen": r.last_seen.isoformat() if r.last_seen else None,
-                "ltv_grade": "VIP" if r.count > 3 else "New" # Simple segmentation logic
-            })
-            
-        return web.json_response(clients)
+    return page_response(clients, page.next_cursor)
 
+@conditional_get("products")
 async def get_products_list(request):
     """GET /api/products"""
     products = await get_all_products(only_active=True)
@@ -409,6 +573,39 @@ async def get_products_list(request):
         })
     return web.json_response(data)
 
+@require_admin
+@conditional_get("orders", daily=True)
+async def get_stats_range_endpoint(request):
+    """
+    GET /api/stats/range?from=2026-01-01&to=2026-03-31&group=day|week|month&service=...
+    Orders/revenue series, status funnel and per-service totals from the daily_stats rollup.
+    Defaults: the last 30 days, grouped by day.
+    """
+    from bot.analytics import get_stats_range
+    from datetime import date, timedelta
+    
+    try:
+        end = date.fromisoformat(request.query["to"]) if "to" in request.query else datetime.utcnow().date()
+        start = date.fromisoformat(request.query["from"]) if "from" in request.query else end - timedelta(days=29)
+        data = await get_stats_range(start, end, request.query.get("group", "day"), request.query.get("service"))
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=400)
+    return web.json_response(data)
+
+@require_admin
+@conditional_get("orders")
+async def get_product_sales_stats(request):
+    """
+    GET /api/stats/products?limit=20
+    Units and revenue per product over accepted orders (from order_items).
+    """
+    limit, _ = page_params(request, default=20)
+    rows = await get_product_sales(limit)
+    return web.json_response([
+        {"product_id": r.product_id, "title": r.title, "units": r.units, "revenue": r.revenue, "orders": r.orders}
+        for r in rows
+    ])
+
 @require_admin
 async def create_product(request):
     """POST /api/products"""
@@ -435,6 +632,28 @@ async def delete_product_endpoint(request):
         return web.json_response({"status": "deleted"})
     return web.json_response({"error": "Not found"}, status=404)
 
+@require_admin
+async def get_ai_stats(request):
+    """
+    GET /api/ai/stats
+    AI dispatcher queue depth (in-flight calls, semaphore waiters, queued users/batches)
+    per-model circuit states and FAQ cache hit rate.
+    """
+    from bot.ai_service import get_ai_queue_stats, get_circuit_states, model_name, backend
+    from bot.faq_cache import get_faq_stats
+    return web.json_response({
+        "backend": backend.name, "model": model_name, **get_ai_queue_stats(),
+        "circuits": get_circuit_states(), "faq": get_faq_stats(), "backend_stats": backend.stats()
+    })
+
+@require_admin
+async def get_db_pool_stats(request):
+    """
+    GET /api/db/pool
+    Connection pool gauges (size, checked out, overflow) and checkout waits/timeouts.
+    """
+    return web.json_response(get_pool_stats())
+
 async def health_check(request):
     """Simple health check for Render."""
     return web.Response(text="OK", status=200)
@@ -0,0 +1,28 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Fire-and-forget tasks (schedulers, scoring jobs, broadcasts, flushes).
+# The event loop only keeps weak references to tasks, so an unreferenced task
+# can be garbage-collected mid-run; spawn() holds them until they finish, and
+# cancel_background_tasks() stops whatever is left on shutdown.
+
+_tasks = set()
+
+def spawn(coro, name: str = None) -> asyncio.Task:
+    """asyncio.create_task that keeps the task alive until it is done."""
+    task = asyncio.create_task(coro, name=name)
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
+
+async def cancel_background_tasks(timeout: float = 5.0) -> int:
+    """Cancels every running background task and waits (up to `timeout`) for them. Returns the count."""
+    tasks = [task for task in _tasks if not task.done()]
+    for task in tasks:
+        task.cancel()
+    if tasks:
+        await asyncio.wait(tasks, timeout=timeout)
+        logger.info(f"🛑 Cancelled {len(tasks)} background task(s).")
+    return len(tasks)
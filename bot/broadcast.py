@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import time
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
+from bot.database import (
+    get_broadcast, get_unfinished_broadcasts, set_broadcast_status,
+    get_pending_recipients, record_broadcast_results
+)
+from bot.background import spawn
+
+logger = logging.getLogger(__name__)
+
+# Telegram limits: ~30 msg/s across all chats, 1 msg/s to the same chat.
+# We stay a bit under the global one so interactive replies still get through.
+GLOBAL_RATE = 25
+PER_CHAT_INTERVAL = 1.0
+CHUNK_SIZE = 25      # Recipients sent concurrently, then recorded in one DB write
+MAX_ATTEMPTS = 3     # Per recipient (RetryAfter / network errors)
+
+class TokenBucket:
+    """
+    Async token bucket. acquire() waits until a token is available.
+    pause() blocks every caller for N seconds (Telegram RetryAfter).
+    """
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+class BroadcastSender:
+    """Shared sender: every job draws from the same global budget."""
+    def __init__(self):
+        self.bucket = TokenBucket(GLOBAL_RATE)
+        self._chat_last_sent = {}
+
+    async def _wait_chat_slot(self, chat_id: int):
+        last = self._chat_last_sent.get(chat_id)
+        if last is not None:
+            delay = PER_CHAT_INTERVAL - (time.monotonic() - last)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        self._chat_last_sent[chat_id] = time.monotonic()
+
+        # Keep the map small: only recent chats matter
+        if len(self._chat_last_sent) > 10000:
+            cutoff = time.monotonic() - PER_CHAT_INTERVAL
+            self._chat_last_sent = {k: v for k, v in self._chat_last_sent.items() if v > cutoff}
+
+    async def send(self, bot: Bot, chat_id: int, text: str):
+        """Sends one message. Returns (chat_id, 'sent' | 'failed', error)."""
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            await self._wait_chat_slot(chat_id)
+            await self.bucket.acquire()
+            try:
+                await bot.send_message(chat_id=chat_id, text=text)
+                return chat_id, "sent", None
+            except TelegramRetryAfter as e:
+                logger.warning(f"⏳ Broadcast: RetryAfter {e.retry_after}s (chat {chat_id})")
+                self.bucket.pause(e.retry_after)
+            except (TelegramForbiddenError, TelegramBadRequest) as e:
+                # Blocked the bot / deleted account / chat not found: retrying won't help
+                return chat_id, "failed", str(e)[:200]
+            except Exception as e:
+                if attempt == MAX_ATTEMPTS:
+                    return chat_id, "failed", str(e)[:200]
+                await asyncio.sleep(attempt)
+        return chat_id, "failed", "RetryAfter limit exceeded"
+
+sender = BroadcastSender()
+
+# Running jobs (job_id -> Task). Keeps references so tasks aren't garbage-collected.
+_jobs = {}
+
+async def run_broadcast(bot: Bot, job_id: int):
+    """Delivers a job until no pending recipients are left. Safe to re-run (resume)."""
+    job = await get_broadcast(job_id)
+    if not job:
+        return
+
+    await set_broadcast_status(job_id, "running")
+    logger.info(f"📢 Broadcast #{job_id} running ({job.total} recipients)")
+
+    while True:
+        chunk = await get_pending_recipients(job_id, limit=CHUNK_SIZE)
+        if not chunk:
+            break
+        results = await asyncio.gather(*(sender.send(bot, uid, job.text) for uid in chunk))
+        await record_broadcast_results(job_id, results)
+
+    await set_broadcast_status(job_id, "done")
+    job = await get_broadcast(job_id)
+    logger.info(f"✅ Broadcast #{job_id} finished: sent={job.sent}, failed={job.failed}")
+
+def start_broadcast(bot: Bot, job_id: int):
+    """Schedules a job in the background (no-op if it is already running)."""
+    if job_id in _jobs and not _jobs[job_id].done():
+        return
+    task = spawn(run_broadcast(bot, job_id), name=f"broadcast-{job_id}") # Cancelled on shutdown, resumed on startup
+    _jobs[job_id] = task
+    task.add_done_callback(lambda t: _on_job_done(job_id, t))
+
+def _on_job_done(job_id: int, task: asyncio.Task):
+    _jobs.pop(job_id, None)
+    if not task.cancelled() and task.exception():
+        logger.error(f"❌ Broadcast #{job_id} crashed: {task.exception()}")
+
+async def resume_broadcasts(bot: Bot):
+    """Restarts jobs interrupted by a restart/deploy. Call once on startup."""
+    for job_id in await get_unfinished_broadcasts():
+        logger.info(f"🔁 Resuming broadcast #{job_id}")
+        start_broadcast(bot, job_id)
@@ -0,0 +1,95 @@
+import logging
+import os
+from bot.database import get_messages_after, get_chat_summary, save_chat_summary, flush_messages
+from bot.background import spawn
+
+logger = logging.getLogger(__name__)
+
+# Chat context for Gemini: a rolling per-user summary (`chat_summaries`) plus only
+# the most recent turns that fit HISTORY_TOKEN_BUDGET. Once the unsummarized tail
+# outgrows the budget, older turns are folded into the summary in the background.
+
+HISTORY_TOKEN_BUDGET = int(os.getenv("AI_HISTORY_TOKEN_BUDGET", 1500))
+SUMMARY_KEEP_MESSAGES = 6   # Newest messages never folded into the summary
+SUMMARY_MAX_WORDS = 150
+HISTORY_FETCH_LIMIT = 100   # Unsummarized messages considered per request
+
+SUMMARY_PROMPT = (
+    "Ты ведешь заметки о переписке бизнес-ассистента с клиентом.\n"
+    "Обнови краткое содержание разговора (не более {max_words} слов). Сохрани факты: "
+    "имя, бизнес, задачи и боли клиента, бюджет, сроки, обещания и договоренности.\n\n"
+    "Текущее содержание:\n{summary}\n\n"
+    "Новые сообщения:\n{dialog}\n\n"
+    "Ответь только обновленным содержанием."
+)
+
+_summarizing = {} # user_id -> running summarize task
+
+def estimate_tokens(text: str) -> int:
+    # ~3 characters per token for mixed Russian/English text; no API round-trip
+    return len(text or "") // 3 + 1
+
+def _recent_window(rows, budget: int) -> list:
+    """Newest rows that fit `budget` (at least one exchange), starting on a user turn."""
+    picked, used = [], 0
+    for row in reversed(rows):
+        cost = estimate_tokens(row.content)
+        if picked and used + cost > budget and len(picked) >= 2:
+            break
+        picked.append(row)
+        used += cost
+    picked.reverse()
+    while picked and picked[0].role != "user":
+        picked.pop(0) # Gemini history must open with the user
+    return picked
+
+async def build_history(user_id: int) -> list:
+    """Gemini `history` for the next turn: summary (if any) + recent turns within the token budget."""
+    summary, last_id = await get_chat_summary(user_id)
+    rows = await get_messages_after(user_id, last_id, limit=HISTORY_FETCH_LIMIT)
+
+    history = []
+    budget = HISTORY_TOKEN_BUDGET
+    if summary:
+        history = [
+            {"role": "user", "parts": [f"Краткое содержание нашего предыдущего разговора:\n{summary}"]},
+            {"role": "model", "parts": ["Понял, учту это в ответах."]},
+        ]
+        budget -= estimate_tokens(summary)
+
+    recent = _recent_window(rows, max(budget, 0))
+    history += [{"role": row.role, "parts": [row.content]} for row in recent]
+
+    if sum(estimate_tokens(row.content) for row in rows) > HISTORY_TOKEN_BUDGET:
+        schedule_summary(user_id)
+    return history
+
+def schedule_summary(user_id: int):
+    """Starts a background summary refresh for the user (one at a time per user)."""
+    task = _summarizing.get(user_id)
+    if task and not task.done():
+        return
+    _summarizing[user_id] = spawn(_summarize(user_id), name=f"chat-summary-{user_id}")
+
+async def _summarize(user_id: int):
+    try:
+        await flush_messages() # Folded rows need their ids
+        summary, last_id = await get_chat_summary(user_id)
+        rows = await get_messages_after(user_id, last_id, limit=HISTORY_FETCH_LIMIT)
+        fold = rows[:-SUMMARY_KEEP_MESSAGES]
+        while fold and fold[-1].role != "model":
+            fold.pop() # Cut after a complete exchange, so the kept tail starts with the user
+        if not fold:
+            return
+
+        from bot.ai_service import generate_text
+        dialog = "\n".join(f"{'Клиент' if row.role == 'user' else 'Ассистент'}: {row.content}" for row in fold)
+        new_summary = await generate_text(SUMMARY_PROMPT.format(
+            max_words=SUMMARY_MAX_WORDS, summary=summary or "(пусто)", dialog=dialog
+        ))
+        await save_chat_summary(user_id, new_summary, fold[-1].id)
+        logger.info(f"🧠 Summarized {len(fold)} messages for user {user_id}.")
+    except Exception as e:
+        logger.warning(f"Chat summary for user {user_id} failed: {e}")
+    finally:
+        _summarizing.pop(user_id, None)
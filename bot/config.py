@@ -25,6 +25,7 @@ SPREADSHEET_ID = os.getenv("SPREADSHEET_ID")
 
 # AI Config
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+AI_BACKEND = os.getenv("AI_BACKEND", "gemini") # 'gemini' or 'fake' (offline load testing)
 
 # Webhook Config
 WEBHOOK_URL = os.getenv("WEBHOOK_URL")
@@ -1,9 +1,19 @@
+import asyncio
+import json
 import os
+import re
+import time
 import logging
-from datetime import datetime, timedelta
-from sqlalchemy import Column, BigInteger, String, DateTime, Integer, select, text
+from datetime import date, datetime, timedelta
+from typing import NamedTuple, Optional
+from sqlalchemy import Column, BigInteger, String, Date, DateTime, Integer, select, text, func, insert, update, delete, union, union_all, literal, cast, tuple_, event, case, exists, bindparam
+from sqlalchemy import exc as sa_exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
-from sqlalchemy.orm import declarative_base
+from sqlalchemy.orm import declarative_base, aliased
+from bot.events import publish_order_event
+from bot.cache import TTLCache
+from bot.background import spawn
 
 # Configure Logging
 logger = logging.getLogger(__name__)
@@ -24,11 +34,177 @@ else:
     DATABASE_URL = "sqlite+aiosqlite:///bot_database.db"
     logger.info("📁 Using local SQLite database.")
 
+# Apply schema migrations from the web process on startup?
+# Default: yes for local SQLite, no for remote databases (run `python -m bot.migrations` on deploy).
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "1" if DATABASE_URL.startswith("sqlite") else "0") == "1"
+
+# --- Engine ---
+# Pool settings (PostgreSQL and SQLite files), all overridable from the environment.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))   # seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))   # seconds; below typical server/proxy idle timeouts
+# asyncpg prepared statements cached per connection (set 0 behind PgBouncer in transaction mode)
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", 500))
+# SQLite: WAL lets readers run alongside the (single) writer; busy_timeout makes writers queue instead of failing
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+POOL_WAIT_THRESHOLD = 0.005 # a checkout slower than this counts as a wait
+
+class MeteredPool(AsyncAdaptedQueuePool):
+    """Queue pool that records checkouts and how long they waited for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = {"checkouts": 0, "waits": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0, "timeouts": 0}
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except sa_exc.TimeoutError:
+            self.metrics["timeouts"] += 1
+            raise
+        waited = time.perf_counter() - started
+        self.metrics["checkouts"] += 1
+        if waited > POOL_WAIT_THRESHOLD:
+            self.metrics["waits"] += 1
+            self.metrics["wait_seconds"] += waited
+            self.metrics["max_wait_seconds"] = max(self.metrics["max_wait_seconds"], waited)
+        return connection
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL") # Safe with WAL: a crash can lose the last commits, never corrupt
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.close()
+
+def create_db_engine(url: str):
+    """Async engine with pooling tuned from the environment (and SQLite pragmas on connect)."""
+    if url.startswith("sqlite") and ":memory:" in url:
+        return create_async_engine(url, echo=False)
+
+    options = dict(
+        echo=False,
+        poolclass=MeteredPool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+    )
+    if url.startswith("sqlite"):
+        db_engine = create_async_engine(url, **options)
+        event.listen(db_engine.sync_engine, "connect", _set_sqlite_pragmas)
+        return db_engine
+
+    return create_async_engine(
+        url,
+        pool_pre_ping=True, # Drop connections the server/proxy closed while idle
+        connect_args={
+            "statement_cache_size": DB_STATEMENT_CACHE_SIZE,           # asyncpg
+            "prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE,  # SQLAlchemy's asyncpg adapter
+        },
+        **options
+    )
+
+def get_pool_stats() -> dict:
+    """Connection pool gauges and checkout wait counters (admin metrics)."""
+    pool = engine.pool
+    stats = {"dialect": engine.dialect.name, "pool": type(pool).__name__}
+    if isinstance(pool, AsyncAdaptedQueuePool):
+        stats.update(
+            size=pool.size(), checked_out=pool.checkedout(), checked_in=pool.checkedin(),
+            overflow=pool.overflow(), max_overflow=DB_MAX_OVERFLOW, timeout=DB_POOL_TIMEOUT
+        )
+    stats.update(getattr(pool, "metrics", {}))
+    return stats
+
 # SQLAlchemy Setup
-engine = create_async_engine(DATABASE_URL, echo=False)
+engine = create_db_engine(DATABASE_URL)
 AsyncSessionLocal = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
 Base = declarative_base()
 
+# --- Change Tracking ---
+# Per-resource write counters, bumped by every write below.
+# The read-only API uses them as cheap ETags (no query needed to answer 304).
+# The epoch makes versions from a previous process run never match.
+_VERSION_EPOCH = int(time.time())
+_resource_versions = {"orders": 0, "products": 0, "users": 0}
+
+def bump_version(resource: str):
+    """Marks a resource ('orders', 'products', 'users') as changed."""
+    _resource_versions[resource] += 1
+
+def get_resource_version(resource: str) -> str:
+    """Returns the current version token of a resource."""
+    return f"{_VERSION_EPOCH}.{_resource_versions[resource]}"
+
+# --- User Context Cache ---
+# (language, role) per user. Read on every update, so it lives in memory;
+# writes below invalidate it.
+_user_context_cache = TTLCache(maxsize=10000, ttl=300)
+
+# --- Keyset Pagination ---
+# Lists are paged on (created_at, id) DESC: each page is an index range scan,
+# so cost stays constant no matter how deep the client scrolls (no OFFSET).
+
+class Page(NamedTuple):
+    items: list
+    next_cursor: Optional[str] = None # Older items
+    prev_cursor: Optional[str] = None # Newer items
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    """Compact, callback_data-safe cursor: 'YYYYmmddHHMMSSffffff_id'."""
+    return f"{created_at.strftime('%Y%m%d%H%M%S%f')}_{row_id}"
+
+def decode_cursor(cursor: str):
+    """Returns (created_at, id). Raises ValueError on malformed input."""
+    stamp, row_id = cursor.split("_", 1)
+    return datetime.strptime(stamp, "%Y%m%d%H%M%S%f"), int(row_id)
+
+async def _keyset_page(session, query, created_col, id_col, limit: int, cursor: str = None, backward: bool = False) -> Page:
+    """
+    Runs `query` (a select of ORM rows) as one page, newest first.
+    cursor=None -> first page; backward=True -> the page just before (newer than) `cursor`.
+    """
+    created_attr, id_attr = created_col.key, id_col.key
+    if cursor:
+        c_at, c_id = decode_cursor(cursor)
+        if backward:
+            query = query.where(tuple_(created_col, id_col) > tuple_(c_at, c_id))
+        else:
+            query = query.where(tuple_(created_col, id_col) < tuple_(c_at, c_id))
+    
+    if backward:
+        query = query.order_by(created_col.asc(), id_col.asc())
+    else:
+        query = query.order_by(created_col.desc(), id_col.desc())
+    
+    result = await session.execute(query.limit(limit + 1))
+    rows = list(result.scalars().all())
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if backward:
+        rows.reverse()
+    if not rows:
+        return Page([])
+    
+    first = encode_cursor(getattr(rows[0], created_attr), getattr(rows[0], id_attr))
+    last = encode_cursor(getattr(rows[-1], created_attr), getattr(rows[-1], id_attr))
+    if backward:
+        return Page(rows, next_cursor=last, prev_cursor=first if has_more else None)
+    return Page(rows, next_cursor=last if has_more else None, prev_cursor=first if cursor else None)
+
+class ClientRow(NamedTuple):
+    user_id: int
+    name: Optional[str]
+    contact: Optional[str]
+    count: int
+    spend: int
+    last_seen: Optional[datetime]
+
 # --- Models ---
 
 class User(Base):
@@ -38,7 +214,7 @@ class User(Base):
     username = Column(String, nullable=True)
     full_name = Column(String, nullable=True)
     language_code = Column(String, default="ru")
-    invited_by = Column(BigInteger, nullable=True) # Referrer ID
+    invited_by = Column(BigInteger, nullable=True, index=True) # Referrer ID
     referral_count = Column(Integer, default=0)    # How many people they invited
     role = Column(String, default="user")          # 'admin', 'manager', 'user'
     joined_at = Column(DateTime, default=datetime.utcnow)
@@ -55,100 +231,102 @@ class Message(Base):
 # --- Functions ---
 
 async def init_db():
-    """Initializes the database (creates tables) and performs auto-migrations."""
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    """
+    Checks that the schema is up to date. DDL lives in bot/migrations.py
+    (`python -m bot.migrations`); the web process only migrates itself when
+    AUTO_MIGRATE is on (default for local SQLite).
+    """
+    from bot.migrations import get_schema_version, migrate, LATEST_VERSION
     
-    # Auto-migration: Add admin_comment if missing
-    try:
-        async with engine.begin() as conn:
-            await conn.execute(text("ALTER TABLE orders ADD COLUMN admin_comment TEXT;"))
-            logger.info("🔄 Migration: Added 'admin_comment' column.")
-    except Exception as e:
-        logger.info(f"ℹ️ Migration note (orders): {e}")
-
-    # Auto-migration: Add language_code to users if missing
-    try:
-        async with engine.begin() as conn:
-            await conn.execute(text("ALTER TABLE users ADD COLUMN language_code VARCHAR(5) DEFAULT 'ru';"))
-            logger.info("🔄 Migration: Added 'language_code' column.")
-    except Exception as e:
-        logger.info(f"ℹ️ Migration note (users): {e}")
-
-    # Auto-migration: Referral System
-    try:
-        async with engine.begin() as conn:
-            await conn.execute(text("ALTER TABLE users ADD COLUMN invited_by BIGINT;"))
-            await conn.execute(text("ALTER TABLE users ADD COLUMN referral_count INTEGER DEFAULT 0;"))
-            logger.info("🔄 Migration: Added Referral columns.")
-    except Exception as e:
-        logger.info(f"ℹ️ Migration note (referrals): {e}")
-
-    # Auto-migration: Order Items (JSON)
-    try:
-        async with engine.begin() as conn:
-            await conn.execute(text("ALTER TABLE orders ADD COLUMN items TEXT DEFAULT '[]';"))
-            logger.info("🔄 Migration: Added 'items' column.")
-    except Exception as e:
-        logger.info(f"ℹ️ Migration note (order items): {e}")
+    current = await get_schema_version()
+    if current >= LATEST_VERSION:
+        logger.info(f"✅ Database ready (schema v{current}).")
+    elif AUTO_MIGRATE:
+        await migrate()
+    else:
+        logger.warning(
+            f"⚠️ Database schema is v{current}, code expects v{LATEST_VERSION}. "
+            f"Run: python -m bot.migrations"
+        )
 
-    # Auto-migration: User Role
-    try:
-        async with engine.begin() as conn:
-            await conn.execute(text("ALTER TABLE users ADD COLUMN role VARCHAR(20) DEFAULT 'user';"))
-            logger.info("🔄 Migration: Added 'role' column.")
-    except Exception as e:
-        logger.info(f"ℹ️ Migration note (user role): {e}")
-    
-    logger.info("✅ Database initialized.")
+def _insert(model):
+    """INSERT with the dialect's ON CONFLICT support (PostgreSQL and SQLite share the same API)."""
+    if engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    return dialect_insert(model)
 
 async def add_user(user_id: int, username: str, full_name: str, invited_by: int = None):
-    """Adds a new user if they don't exist. Handles referrals."""
+    """
+    Adds a new user if they don't exist. Handles referrals.
+    INSERT ... ON CONFLICT DO NOTHING RETURNING tells whether the row is new, and the
+    referrer's counter is incremented in SQL, so concurrent referrals are all counted.
+    """
     async with AsyncSessionLocal() as session:
-        result = await session.execute(select(User).filter_by(id=user_id))
-        user = result.scalar_one_or_none()
+        result = await session.execute(
+            _insert(User)
+            .values(id=user_id, username=username, full_name=full_name, invited_by=invited_by)
+            .on_conflict_do_nothing(index_elements=[User.id])
+            .returning(User.id)
+        )
+        if result.scalar_one_or_none() is None:
+            return False # User existed
         
-        if not user:
-            new_user = User(
-                id=user_id, 
-                username=username, 
-                full_name=full_name,
-                invited_by=invited_by
+        # Increment Referrer Count
+        referral_count = None
+        if invited_by:
+            result = await session.execute(
+                update(User)
+                .where(User.id == invited_by)
+                .values(referral_count=func.coalesce(User.referral_count, 0) + 1)
+                .returning(User.referral_count)
             )
-            session.add(new_user)
-            
-            # Increment Referrer Count
-            if invited_by:
-                referrer_res = await session.execute(select(User).filter_by(id=invited_by))
-                referrer = referrer_res.scalar_one_or_none()
-                if referrer:
-                    referrer.referral_count += 1
-            
-            await session.commit()
-            logger.info(f"🆕 New user added: {user_id} (Invited by: {invited_by})")
-            return True # Indicates new user created
-        return False # User existed
+            referral_count = result.scalar_one_or_none()
+        
+        await session.commit()
+    bump_version("users")
+    _user_context_cache.pop(user_id)
+    logger.info(f"🆕 New user added: {user_id} (Invited by: {invited_by}, referrals: {referral_count})")
+    return True # Indicates new user created
+
+async def get_user_context(user_id: int):
+    """Returns (language_code, role) for a user in one query, cached per process."""
+    context = _user_context_cache.get(user_id)
+    if context is None:
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(User.language_code, User.role).where(User.id == user_id)
+            )
+            row = result.first()
+        if row:
+            context = (row.language_code or "ru", row.role or "user")
+        else:
+            context = ("ru", "user")
+        _user_context_cache.set(user_id, context)
+    return context
 
 async def get_user_language(user_id: int):
     """Returns user's language code (default 'ru')."""
-    async with AsyncSessionLocal() as session:
-        result = await session.execute(select(User.language_code).where(User.id == user_id))
-        lang = result.scalar_one_or_none()
-        return lang if lang else "ru"
+    lang, _ = await get_user_context(user_id)
+    return lang
+
+async def get_user_role(user_id: int):
+    """Returns user's role (default 'user')."""
+    _, role = await get_user_context(user_id)
+    return role
 
 async def set_user_language(user_id: int, lang_code: str):
-    """Updates user's preferred language."""
+    """Updates user's preferred language (creates the user if not found, rare)."""
     async with AsyncSessionLocal() as session:
-        result = await session.execute(select(User).where(User.id == user_id))
-        user = result.scalar_one_or_none()
-        if user:
-            user.language_code = lang_code
-            await session.commit()
-        else:
-            # If user not found (rare), create them
-            new_user = User(id=user_id, language_code=lang_code)
-            session.add(new_user)
-            await session.commit()
+        await session.execute(
+            _insert(User)
+            .values(id=user_id, language_code=lang_code)
+            .on_conflict_do_update(index_elements=[User.id], set_={"language_code": lang_code})
+        )
+        await session.commit()
+    bump_version("users")
+    _user_context_cache.pop(user_id)
 
 async def get_referral_stats(user_id: int):
     """Returns number of users invited by this user."""
@@ -157,11 +335,11 @@ async def get_referral_stats(user_id: int):
         count = result.scalar_one_or_none()
         return count if count else 0
 
-async def get_referred_users(user_id: int):
-    """Returns list of users invited by this user."""
+async def get_referred_users(user_id: int, limit: int = 50, cursor: str = None) -> Page:
+    """Returns a page of users invited by this user (newest first)."""
     async with AsyncSessionLocal() as session:
-        result = await session.execute(select(User).where(User.invited_by == user_id))
-        return result.scalars().all()
+        query = select(User).where(User.invited_by == user_id)
+        return await _keyset_page(session, query, User.joined_at, User.id, limit, cursor)
 
 async def get_all_users():
     """Returns a list of all user IDs."""
@@ -172,34 +350,142 @@ async def get_all_users():
 async def count_users():
     """Returns the total number of users."""
     async with AsyncSessionLocal() as session:
-        # Optimized count query
-        result = await session.execute(select(User.id))
-        return len(result.scalars().all())
+        result = await session.execute(select(func.count()).select_from(User))
+        return result.scalar_one()
+
+# --- Message Log (write-behind) ---
+# Chat messages are buffered in memory and written with one bulk INSERT every
+# MESSAGE_FLUSH_INTERVAL seconds, or as soon as MESSAGE_FLUSH_BATCH rows are waiting.
+# The buffer is a single FIFO, so ids follow arrival order (per user too).
+# Readers merge the buffer in, so nothing looks lost: they copy it under the
+# flush lock, query without it, and retry if a flush committed in between.
+# Call flush_messages() on shutdown.
+
+MESSAGE_FLUSH_INTERVAL = float(os.getenv("MESSAGE_FLUSH_INTERVAL", 1.0)) # seconds
+MESSAGE_FLUSH_BATCH = int(os.getenv("MESSAGE_FLUSH_BATCH", 100))
+
+class BufferedMessage(NamedTuple):
+    id: Optional[int] # None until flushed
+    role: str
+    content: str
+
+_message_buffer = [] # dicts for insert(Message), oldest first
+_flush_lock = asyncio.Lock()
+_flush_task = None
+_flush_generation = 0 # Bumped (under the lock) after every committed flush
 
 async def add_message(user_id: int, role: str, content: str):
-    """Saves a message to history."""
-    async with AsyncSessionLocal() as session:
-        msg = Message(user_id=user_id, role=role, content=content)
-        session.add(msg)
-        await session.commit()
+    """
+    Saves a message to history (buffered, see flush_messages).
+    Never raises on a failed flush: the rows stay buffered and are retried.
+    """
+    global _flush_task
+    _message_buffer.append({"user_id": user_id, "role": role, "content": content, "timestamp": datetime.utcnow()})
+    if len(_message_buffer) >= MESSAGE_FLUSH_BATCH:
+        try:
+            await flush_messages()
+        except Exception as e:
+            logger.error(f"❌ Message flush failed, {len(_message_buffer)} rows kept for retry: {e}")
+    if _message_buffer and (_flush_task is None or _flush_task.done()):
+        _flush_task = spawn(_flush_later(), name="message-flush")
+
+async def _flush_later():
+    """Flushes after MESSAGE_FLUSH_INTERVAL; on failure keeps retrying at that pace."""
+    while _message_buffer:
+        await asyncio.sleep(MESSAGE_FLUSH_INTERVAL)
+        try:
+            await flush_messages()
+        except Exception as e:
+            logger.error(f"❌ Message flush failed, {len(_message_buffer)} rows kept for retry: {e}")
+
+async def flush_messages() -> int:
+    """Writes all buffered messages in one INSERT. Returns the number written."""
+    global _flush_generation
+    async with _flush_lock:
+        if not _message_buffer:
+            return 0
+        batch = list(_message_buffer)
+        async with AsyncSessionLocal() as session:
+            await session.execute(insert(Message), batch)
+            await session.commit()
+        del _message_buffer[:len(batch)] # Rows added during the commit stay for the next flush
+        _flush_generation += 1
+    return len(batch)
+
+def _buffered_for(user_id: int) -> list:
+    return [BufferedMessage(None, m["role"], m["content"]) for m in _message_buffer if m["user_id"] == user_id]
+
+async def _with_buffered(user_id: int, stmt, limit: int) -> list:
+    """
+    Rows of `stmt` (newest first) + the user's unflushed messages: newest `limit`, oldest first.
+    The query runs outside the flush lock; if a flush committed meanwhile, its rows may be
+    in both the result and the buffer copy, so the read is retried (under the lock at last).
+    """
+    async def query():
+        async with AsyncSessionLocal() as session:
+            rows = (await session.execute(stmt)).fetchall()
+        rows.reverse()
+        return rows
+
+    for _ in range(2):
+        async with _flush_lock:
+            generation, pending = _flush_generation, _buffered_for(user_id)
+        rows = await query()
+        async with _flush_lock: # Also waits out a flush that is committing right now
+            if generation == _flush_generation:
+                return (rows + pending)[-limit:]
+    async with _flush_lock: # Flushes keep overtaking us
+        return ((await query()) + _buffered_for(user_id))[-limit:]
 
 async def get_chat_history(user_id: int, limit: int = 20):
     """Retrieves recent chat history for context."""
+    # Get last N messages
+    stmt = (
+        select(Message.role, Message.content)
+        .where(Message.user_id == user_id)
+        .order_by(Message.id.desc())
+        .limit(limit)
+    )
+    rows = await _with_buffered(user_id, stmt, limit) # Chronological order (Oldest first)
+    return [{"role": row.role, "parts": [row.content]} for row in rows]
+
+async def get_messages_after(user_id: int, after_id: int = 0, limit: int = 100):
+    """
+    Newest `limit` messages with id > after_id, oldest first: rows of (id, role, content).
+    Unflushed messages are included with id=None.
+    """
+    stmt = (
+        select(Message.id, Message.role, Message.content)
+        .where(Message.user_id == user_id, Message.id > after_id)
+        .order_by(Message.id.desc())
+        .limit(limit)
+    )
+    return await _with_buffered(user_id, stmt, limit)
+
+class ChatSummary(Base):
+    __tablename__ = "chat_summaries"
+    
+    user_id = Column(BigInteger, primary_key=True)
+    summary = Column(String)
+    last_message_id = Column(Integer, default=0) # Messages up to this id are folded into the summary
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+async def get_chat_summary(user_id: int):
+    """Returns (summary, last_message_id), or (None, 0) if the conversation has no summary yet."""
     async with AsyncSessionLocal() as session:
-        # Get last N messages
-        stmt = (
-            select(Message.role, Message.content)
-            .where(Message.user_id == user_id)
-            .order_by(Message.id.desc())
-            .limit(limit)
+        result = await session.execute(
+            select(ChatSummary.summary, ChatSummary.last_message_id).where(ChatSummary.user_id == user_id)
         )
-        result = await session.execute(stmt)
-        rows = result.fetchall()
-        
-        # Reverse to chronological order (Oldest first)
-        rows.reverse()
-        
-        return [{"role": row.role, "parts": [row.content]} for row in rows]
+        row = result.first()
+        return (row.summary, row.last_message_id) if row else (None, 0)
+
+async def save_chat_summary(user_id: int, summary: str, last_message_id: int):
+    """Stores (or replaces) the rolling conversation summary."""
+    async with AsyncSessionLocal() as session:
+        await session.merge(ChatSummary(
+            user_id=user_id, summary=summary, last_message_id=last_message_id, updated_at=datetime.utcnow()
+        ))
+        await session.commit()
 
 class Booking(Base):
     __tablename__ = "bookings"
@@ -242,13 +528,126 @@ class Order(Base):
     budget = Column(String)
     task_description = Column(String)
     service_context = Column(String)
-    status = Column(String, default="new")
+    status = Column(String, default="new", index=True)
     admin_comment = Column(String, nullable=True) # Comment from Admin to Client
     items = Column(String, default="[]") # JSON string of items: [{"title": "Pizza", "price": 50, "qty": 1}]
-    created_at = Column(DateTime, default=datetime.utcnow)
+    amount = Column(Integer, nullable=True) # Deal value in TJS (see order_amount); NULL = unknown
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+class OrderItem(Base):
+    """Order lines, normalized from Order.items for per-product sales."""
+    __tablename__ = "order_items"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    order_id = Column(Integer, index=True)
+    product_id = Column(Integer, nullable=True, index=True) # NULL for free-form lines
+    title = Column(String)
+    price = Column(Integer, default=0)
+    qty = Column(Integer, default=1)
+
+class DailyStat(Base):
+    """
+    Rollup of orders by creation day, service and CURRENT status (orders + sum of amounts).
+    Kept current in the same transaction as every order insert/status/amount change;
+    reconcile_daily_stats() rebuilds it from `orders` if it ever drifts.
+    """
+    __tablename__ = "daily_stats"
+    
+    day = Column(Date, primary_key=True)
+    service = Column(String, primary_key=True)
+    status = Column(String, primary_key=True)
+    orders = Column(Integer, default=0)
+    amount = Column(Integer, default=0)
+
+async def _bump_daily_stats(session, created_at: datetime, service: str, changes: list):
+    """
+    Adds [(status, orders, amount), ...] to the rollup cells of one day/service, atomically:
+    one multi-row upsert with in-SQL increments (changes to the same cell are merged first).
+    """
+    day, service, cells = (created_at or datetime.utcnow()).date(), service or "General", {}
+    for status, orders, amount in changes:
+        n, total = cells.get(status or "new", (0, 0))
+        cells[status or "new"] = (n + orders, total + (amount or 0))
+    stmt = _insert(DailyStat).values([
+        {"day": day, "service": service, "status": status, "orders": n, "amount": total}
+        for status, (n, total) in cells.items()
+    ])
+    await session.execute(stmt.on_conflict_do_update(
+        index_elements=[DailyStat.day, DailyStat.service, DailyStat.status],
+        set_={"orders": DailyStat.orders + stmt.excluded.orders, "amount": DailyStat.amount + stmt.excluded.amount}
+    ))
+
+def daily_stats_source(start: date = None):
+    """SELECT rebuilding daily_stats rows from `orders` (created on/after `start`, or all)."""
+    stmt = (
+        select(
+            func.date(Order.created_at).label("day"),
+            func.coalesce(Order.service_context, "General").label("service"),
+            func.coalesce(Order.status, "new").label("status"),
+            func.count(Order.id).label("orders"),
+            func.coalesce(func.sum(Order.amount), 0).label("amount")
+        )
+        .group_by(func.date(Order.created_at), func.coalesce(Order.service_context, "General"), func.coalesce(Order.status, "new"))
+    )
+    if start:
+        stmt = stmt.where(Order.created_at >= datetime.combine(start, datetime.min.time()))
+    return stmt
+
+# --- Order Amounts ---
+# Revenue and LTV are sums of orders.amount over deals the client accepted.
+REVENUE_STATUSES = ("in_progress", "completed")
+
+_AMOUNT_RE = re.compile(r"\d+(?:[ \u00a0]\d{3})*")
+
+def _to_int(value, default: int = 0) -> int:
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return default
+
+def parse_items(items) -> list:
+    """
+    Order.items (JSON string or list) -> [{"product_id", "title", "price", "qty"}].
+    Accepts both the shop shape (product dict + 'quantity') and the CRM shape ('qty').
+    """
+    if isinstance(items, str):
+        try:
+            items = json.loads(items or "[]")
+        except ValueError:
+            return []
+    lines = []
+    for item in items or []:
+        if not isinstance(item, dict):
+            continue
+        product_id = item.get("product_id", item.get("id"))
+        lines.append({
+            "product_id": product_id if isinstance(product_id, int) else None,
+            "title": item.get("title"),
+            "price": _to_int(item.get("price")),
+            "qty": _to_int(item.get("qty") or item.get("quantity"), 1)
+        })
+    return lines
+
+def parse_amount(budget):
+    """'5000 TJS' / '12 500' / 5000 -> int. Ranges ('1000-2000 с.'), text, None -> None."""
+    if isinstance(budget, (int, float)):
+        return int(budget)
+    numbers = _AMOUNT_RE.findall(budget or "")
+    if len(numbers) != 1:
+        return None
+    return int(re.sub(r"\D", "", numbers[0]))
+
+def order_amount(lines: list, budget: str = None):
+    """A single-number budget (the agreed price) wins; otherwise the items total (None without items)."""
+    amount = parse_amount(budget)
+    if amount is None and lines:
+        amount = sum(line["price"] * line["qty"] for line in lines)
+    return amount
 
 async def add_order(user_id: int, data: dict):
     """Saves a new order/lead to the database."""
+    items = data.get("items", "[]") # Handle structured items
+    lines = parse_items(items)
     async with AsyncSessionLocal() as session:
         order = Order(
             user_id=user_id,
@@ -258,36 +657,67 @@ async def add_order(user_id: int, data: dict):
             budget=data.get("budget"),
             task_description=data.get("task_description"),
             service_context=data.get("service_context", "General"),
-            items=data.get("items", "[]") # Handle structured items
+            items=items if isinstance(items, str) else json.dumps(items, ensure_ascii=False),
+            amount=order_amount(lines, data.get("budget"))
         )
         session.add(order)
+        await session.flush()
+        if lines:
+            await session.execute(insert(OrderItem), [{"order_id": order.id, **line} for line in lines])
+        await _bump_daily_stats(session, order.created_at, order.service_context, [(order.status, 1, order.amount)])
         await session.commit()
         logger.info(f"📝 New order saved: {order.id}")
+        bump_version("orders")
+        publish_order_event("created", order)
         return order.id
 
-async def get_recent_orders(limit: int = 10, search_query: str = None):
+async def get_recent_orders(limit: int = 10, cursor: str = None) -> Page:
+    """Returns a page of orders, newest first. (Search lives in bot/search.py.)"""
     async with AsyncSessionLocal() as session:
-        query = select(Order).order_by(Order.created_at.desc())
-        
-        if search_query:
-            search_filter = f"%{search_query}%"
-            query = query.where(
-                (Order.name.ilike(search_filter)) | 
-                (Order.contact_info.ilike(search_filter))
-            )
-        
-        if limit:
-            query = query.limit(limit)
-            
-        result = await session.execute(query)
-        return result.scalars().all()
+        return await _keyset_page(session, select(Order), Order.created_at, Order.id, limit, cursor)
 
-async def get_user_orders(user_id: int):
-    """Returns all orders for a specific user."""
+async def get_user_orders(user_id: int, limit: int = 5, cursor: str = None, backward: bool = False) -> Page:
+    """Returns a page of orders for a specific user, newest first."""
     async with AsyncSessionLocal() as session:
-        query = select(Order).where(Order.user_id == user_id).order_by(Order.created_at.desc())
-        result = await session.execute(query)
-        return result.scalars().all()
+        query = select(Order).where(Order.user_id == user_id)
+        return await _keyset_page(session, query, Order.created_at, Order.id, limit, cursor, backward)
+
+async def get_clients_page(limit: int = 50, cursor: str = None) -> Page:
+    """
+    Returns a page of per-client aggregates, most recently active first:
+    rows of (user_id, name, contact, count, spend, last_seen).
+    The page is keyed on each client's latest order (created_at, id): a walk down
+    ix_orders_created_at_id that skips orders with a newer sibling (an
+    ix_orders_user_created_at_id probe), so only this page's clients get aggregated.
+    """
+    newer = aliased(Order)
+    latest = select(Order).where(~exists().where(
+        newer.user_id == Order.user_id,
+        tuple_(newer.created_at, newer.id) > tuple_(Order.created_at, Order.id),
+    ))
+    async with AsyncSessionLocal() as session:
+        page = await _keyset_page(session, latest, Order.created_at, Order.id, limit, cursor)
+        if not page.items:
+            return page
+        result = await session.execute(
+            select(
+                Order.user_id,
+                func.max(Order.name).label('name'),
+                func.max(Order.contact_info).label('contact'),
+                func.count(Order.id).label('count'),
+                func.coalesce(func.sum(case((Order.status.in_(REVENUE_STATUSES), Order.amount))), 0).label('spend'),
+            )
+            .where(Order.user_id.in_([order.user_id for order in page.items]))
+            .group_by(Order.user_id)
+        )
+        stats = {row.user_id: row for row in result.all()}
+    
+    clients = [
+        ClientRow(order.user_id, stats[order.user_id].name, stats[order.user_id].contact,
+                  stats[order.user_id].count, stats[order.user_id].spend, order.created_at)
+        for order in page.items
+    ]
+    return page._replace(items=clients)
 
 async def get_all_user_ids():
     """Returns a list of unique user_ids who have interacted/ordered."""
@@ -302,8 +732,8 @@ async def get_all_user_ids():
 async def count_orders():
     """Returns total number of orders."""
     async with AsyncSessionLocal() as session:
-        result = await session.execute(select(Order.id))
-        return len(result.scalars().all())
+        result = await session.execute(select(func.count()).select_from(Order))
+        return result.scalar_one()
 
 async def get_order_by_id(order_id: int):
     """Returns a single order by ID."""
@@ -311,48 +741,246 @@ async def get_order_by_id(order_id: int):
         result = await session.execute(select(Order).where(Order.id == order_id))
         return result.scalar_one_or_none()
 
+# Order mutations are one UPDATE ... RETURNING each (no load-mutate-commit round trips).
+# The returned row has the columns the live feed (api.serialize_order) and the
+# client notifications read; contact_info/business_type are not sent back.
+ORDER_RETURNING = (
+    Order.id, Order.user_id, Order.name, Order.service_context, Order.budget, Order.task_description,
+    Order.status, Order.admin_comment, Order.items, Order.amount, Order.created_at
+)
+ORDER_EDITABLE = ("budget", "contact_info", "task_description", "admin_comment", "items")
+
+ORDER_UPDATE_RETRIES = 5
+
+async def _update_order(order_id: int, values: dict, event: str, lines: list = None):
+    """
+    Applies `values` to one order, publishes `event`. Returns the updated row or None.
+    lines: new order_items rows (replaces the existing ones in the same transaction).
+    Status/amount changes also move the order between daily_stats cells, so the UPDATE
+    must know the values it replaced:
+      - PostgreSQL: the UPDATE joins a FOR UPDATE subquery of the row and returns its old
+        status/amount itself (the lock makes it see the latest committed version);
+      - SQLite (no FOR UPDATE): read them, then compare-and-set; a loser re-reads and retries.
+    Either way concurrent writers never leave the same cell twice.
+    """
+    moves_cell = "status" in values or "amount" in values
+    locking = moves_cell and engine.dialect.name == "postgresql"
+    for _ in range(ORDER_UPDATE_RETRIES):
+        async with AsyncSessionLocal() as session:
+            stmt = update(Order).where(Order.id == order_id)
+            returning = ORDER_RETURNING
+            old = None
+            if locking:
+                locked = select(Order.id, Order.status, Order.amount).where(Order.id == order_id).with_for_update().subquery("old")
+                stmt = update(Order).where(Order.id == locked.c.id)
+                returning = (locked.c.status.label("old_status"), locked.c.amount.label("old_amount"), *ORDER_RETURNING)
+            elif moves_cell:
+                result = await session.execute(select(Order.status, Order.amount).where(Order.id == order_id))
+                old = result.first()
+                if old is None:
+                    return None
+                stmt = stmt.where(
+                    Order.status.is_not_distinct_from(old.status), Order.amount.is_not_distinct_from(old.amount)
+                )
+            result = await session.execute(stmt.values(**values).returning(*returning))
+            row = result.first()
+            if row is None:
+                if moves_cell and not locking:
+                    await session.rollback()
+                    continue # Changed concurrently: re-read the cell
+                return None
+            if locking:
+                old = (row.old_status, row.old_amount)
+            if old is not None and tuple(old) != (row.status, row.amount):
+                old_status, old_amount = old
+                await _bump_daily_stats(session, row.created_at, row.service_context, [
+                    (old_status, -1, -(old_amount or 0)), (row.status, 1, row.amount)
+                ])
+            if lines is not None:
+                await session.execute(delete(OrderItem).where(OrderItem.order_id == order_id))
+                if lines:
+                    await session.execute(insert(OrderItem), [{"order_id": order_id, **line} for line in lines])
+            await session.commit()
+        bump_version("orders")
+        publish_order_event(event, row)
+        return row
+    raise RuntimeError(f"Order {order_id} kept changing concurrently, update not applied")
+
 async def update_order_status(order_id: int, new_status: str):
     """Updates the status of an order."""
+    return await _update_order(order_id, {"status": new_status}, "status")
+
+async def update_order_details(order_id: int, data: dict, status: str = None):
+    """Updates editable fields of an order (and optionally its status, in the same statement)."""
+    values = {key: data[key] for key in ORDER_EDITABLE if key in data}
+    lines = None
+    if "items" in data:
+        lines = parse_items(data["items"])
+        if not isinstance(data["items"], str):
+            values["items"] = json.dumps(data["items"], ensure_ascii=False)
+        budget = data.get("budget")
+        if "budget" not in data:
+            # Items-only edit: the stored budget still wins if it is a single number
+            async with AsyncSessionLocal() as session:
+                result = await session.execute(select(Order.budget).where(Order.id == order_id))
+                budget = result.scalar_one_or_none()
+        values["amount"] = order_amount(lines, budget)
+    elif "budget" in data:
+        # Non-numeric budget: fall back to the stored items total
+        items_total = (
+            select(func.sum(OrderItem.price * OrderItem.qty)).where(OrderItem.order_id == order_id).scalar_subquery()
+        )
+        amount = parse_amount(data["budget"])
+        values["amount"] = items_total if amount is None else amount
+    if status:
+        values["status"] = status
+    if not values:
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(select(*ORDER_RETURNING).where(Order.id == order_id))
+            return result.first()
+    return await _update_order(order_id, values, "status" if status else "updated", lines)
+
+async def get_orders_for_scoring(only_unscored: bool = True, status: str = None):
+    """Orders for the batch lead scoring job: without admin_comment (or all), optionally by status."""
     async with AsyncSessionLocal() as session:
-        result = await session.execute(select(Order).where(Order.id == order_id))
-        order = result.scalar_one_or_none()
-        
-        if order:
-            order.status = new_status
-            await session.commit()
-            return order
-        return None
+        stmt = select(Order).order_by(Order.id)
+        if only_unscored:
+            stmt = stmt.where((Order.admin_comment.is_(None)) | (Order.admin_comment == ""))
+        if status:
+            stmt = stmt.where(Order.status == status)
+        result = await session.execute(stmt)
+        return result.scalars().all()
 
-async def update_order_details(order_id: int, data: dict):
-    """Updates editable fields of an order."""
+async def set_admin_comments(comments: dict):
+    """Bulk write {order_id: admin_comment} in one statement, then publishes the updated orders."""
+    if not comments:
+        return
     async with AsyncSessionLocal() as session:
-        result = await session.execute(select(Order).where(Order.id == order_id))
-        order = result.scalar_one_or_none()
-        
-        if order:
-            if "budget" in data: order.budget = data["budget"]
-            if "contact_info" in data: order.contact_info = data["contact_info"]
-            if "task_description" in data: order.task_description = data["task_description"]
-            if "admin_comment" in data: order.admin_comment = data["admin_comment"]
-            if "items" in data: order.items = data["items"] # Allow updating cart
-            
-            await session.commit()
-            return order
-        return None
+        await session.execute(
+            update(Order), [{"id": order_id, "admin_comment": text} for order_id, text in comments.items()]
+        )
+        await session.commit()
+        result = await session.execute(select(Order).where(Order.id.in_(list(comments))))
+        orders = result.scalars().all()
+    bump_version("orders")
+    for order in orders:
+        publish_order_event("updated", order)
+
+def _fill_days(rows, days: int):
+    """[(date, count), ...] with gaps -> one ('YYYY-MM-DD', count) per day, oldest first."""
+    counts = {str(day)[:10]: count for day, count in rows}
+    today = datetime.utcnow().date()
+    result = []
+    for offset in range(days - 1, -1, -1):
+        day = (today - timedelta(days=offset)).isoformat()
+        result.append((day, counts.get(day, 0)))
+    return result
+
+async def get_daily_rollup(start: date, end: date, service: str = None):
+    """daily_stats rows (day, service, status, orders, amount) for start..end inclusive."""
+    async with AsyncSessionLocal() as session:
+        stmt = (
+            select(DailyStat.day, DailyStat.service, DailyStat.status, DailyStat.orders, DailyStat.amount)
+            .where(DailyStat.day >= start, DailyStat.day <= end, DailyStat.orders != 0)
+            .order_by(DailyStat.day)
+        )
+        if service:
+            stmt = stmt.where(DailyStat.service == service)
+        result = await session.execute(stmt)
+        return result.all()
+
+async def reconcile_daily_stats(days: int = None) -> int:
+    """
+    Rebuilds daily_stats from `orders` for the last `days` days (None = everything).
+    Returns the number of cells that had drifted (0 = rollup was exact).
+    """
+    start = datetime.utcnow().date() - timedelta(days=days - 1) if days else None
+    cell = (DailyStat.day, DailyStat.service, DailyStat.status, DailyStat.orders, DailyStat.amount)
+    wipe = delete(DailyStat).returning(*cell)
+    if start:
+        wipe = wipe.where(DailyStat.day >= start)
+    rebuild = insert(DailyStat).from_select(
+        ["day", "service", "status", "orders", "amount"], daily_stats_source(start)
+    ).returning(*cell)
+    
+    # One transaction that order writers cannot interleave with: on PostgreSQL the table
+    # lock waits for (and then blocks) every _bump_daily_stats; on SQLite the DELETE,
+    # issued before anything is read, takes the database write lock. So the aggregate
+    # below sees exactly the orders whose deltas the wiped cells hold.
+    async with AsyncSessionLocal() as session:
+        if session.bind.dialect.name == "postgresql":
+            await session.execute(text("LOCK TABLE daily_stats IN SHARE ROW EXCLUSIVE MODE"))
+        current = {
+            (r.day, r.service, r.status): (r.orders, r.amount)
+            for r in (await session.execute(wipe)).all() if r.orders or r.amount
+        }
+        fresh = {(r.day, r.service, r.status): (r.orders, r.amount) for r in (await session.execute(rebuild)).all()}
+        await session.commit()
+    drift = len(fresh.keys() ^ current.keys()) + sum(1 for k in fresh.keys() & current.keys() if fresh[k] != current[k])
+    if drift:
+        bump_version("orders")
+        logger.warning(f"📊 daily_stats reconciled: {drift} cell(s) corrected.")
+    return drift
 
-async def get_daily_stats(days: int = 7):
-    """Returns order counts grouped by day for the last N days."""
-    from sqlalchemy import func
+# Dashboard snapshot: (key, value). Valid while users/orders versions and the day are unchanged.
+_stats_snapshot = None
+
+async def get_dashboard_snapshot(days: int = 7):
+    """
+    Returns {"users": int, "orders": int, "revenue": int, "revenue_today": int, "daily": [(day, count), ...]}.
+    revenue_today covers accepted orders created today (the rollup is keyed by creation day).
+    Totals and the daily chart come from ONE UNION ALL statement (single round trip)
+    over the daily_stats rollup; the result is reused until a write bumps the users/orders version.
+    """
+    global _stats_snapshot
+    today = datetime.utcnow().date()
+    key = (get_resource_version("users"), get_resource_version("orders"), days, today)
+    if _stats_snapshot and _stats_snapshot[0] == key:
+        return _stats_snapshot[1]
+    
+    start = today - timedelta(days=days - 1)
+    day = cast(DailyStat.day, String)
+    stmt = union_all(
+        select(literal("users", String).label("metric"), func.count().label("value")).select_from(User),
+        select(literal("orders", String).label("metric"), func.coalesce(func.sum(DailyStat.orders), 0).label("value")),
+        select(literal("revenue", String).label("metric"), func.coalesce(func.sum(DailyStat.amount), 0).label("value"))
+        .where(DailyStat.status.in_(REVENUE_STATUSES)),
+        select(literal("revenue_today", String).label("metric"), func.coalesce(func.sum(DailyStat.amount), 0).label("value"))
+        .where(DailyStat.status.in_(REVENUE_STATUSES), DailyStat.day == today),
+        select(day.label("metric"), func.sum(DailyStat.orders).label("value"))
+        .where(DailyStat.day >= start)
+        .group_by(day)
+    )
+    async with AsyncSessionLocal() as session:
+        rows = (await session.execute(stmt)).all()
+    
+    totals = {"users": 0, "orders": 0, "revenue": 0, "revenue_today": 0}
+    daily_rows = []
+    for metric, value in rows:
+        if metric in totals:
+            totals[metric] = value
+        else:
+            daily_rows.append((metric, value))
+    
+    snapshot = {**totals, "daily": _fill_days(daily_rows, days)}
+    _stats_snapshot = (key, snapshot)
+    return snapshot
+
+async def get_product_sales(limit: int = 20):
+    """Units sold and revenue per product line over accepted orders, best sellers first."""
+    revenue = func.sum(OrderItem.price * OrderItem.qty)
     async with AsyncSessionLocal() as session:
-        # Note: This query is dialect specific. Assuming SQLite/Postgres compatibility for simple date casting.
-        # For cross-db simplicity in this demo, we might fetch recent and aggregate in python if SQL is tricky without specific dialect imports.
-        # But let's try a standard approach.
-        cutoff = datetime.utcnow() - timedelta(days=days)
         result = await session.execute(
-            select(func.date(Order.created_at), func.count(Order.id))
-            .where(Order.created_at >= cutoff)
-            .group_by(func.date(Order.created_at))
-            .order_by(func.date(Order.created_at))
+            select(
+                OrderItem.product_id, OrderItem.title,
+                func.sum(OrderItem.qty).label("units"), revenue.label("revenue"),
+                func.count(func.distinct(OrderItem.order_id)).label("orders")
+            )
+            .join(Order, Order.id == OrderItem.order_id)
+            .where(Order.status.in_(REVENUE_STATUSES))
+            .group_by(OrderItem.product_id, OrderItem.title)
+            .order_by(revenue.desc())
+            .limit(limit)
         )
         return result.all()
 
@@ -381,6 +1009,7 @@ async def add_product(data: dict):
         )
         session.add(product)
         await session.commit()
+        bump_version("products")
         return product.id
 
 async def get_all_products(only_active: bool = True):
@@ -397,30 +1026,175 @@ async def get_all_products(only_active: bool = True):
         return result.scalars().all()
 
 async def update_product(product_id: int, data: dict):
-    """Updates a product."""
+    """Updates a product. Returns (id, title) of the updated row or None."""
+    values = {key: value for key, value in data.items() if key in Product.__table__.columns and key != "id"}
     async with AsyncSessionLocal() as session:
-        result = await session.execute(select(Product).where(Product.id == product_id))
-        product = result.scalar_one_or_none()
-        
-        if product:
-            for key, value in data.items():
-                if hasattr(product, key):
-                    setattr(product, key, value)
-            await session.commit()
-            return product
-        return None
+        if not values:
+            result = await session.execute(select(Product.id, Product.title).where(Product.id == product_id))
+            return result.first()
+        result = await session.execute(
+            update(Product).where(Product.id == product_id).values(**values).returning(Product.id, Product.title)
+        )
+        row = result.first()
+        await session.commit()
+    if row:
+        bump_version("products")
+    return row
 
 async def delete_product(product_id: int):
     """Soft deletes a product."""
     async with AsyncSessionLocal() as session:
-        result = await session.execute(select(Product).where(Product.id == product_id))
-        product = result.scalar_one_or_none()
+        result = await session.execute(
+            update(Product).where(Product.id == product_id).values(is_active=0).returning(Product.id)
+        )
+        deleted = result.scalar_one_or_none() is not None
+        await session.commit()
+    if deleted:
+        bump_version("products")
+    return deleted
+
+class Broadcast(Base):
+    __tablename__ = "broadcasts"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    text = Column(String)
+    status = Column(String, default="queued") # queued, running, done
+    total = Column(Integer, default=0)
+    sent = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+class BroadcastRecipient(Base):
+    __tablename__ = "broadcast_recipients"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    broadcast_id = Column(Integer, index=True)
+    user_id = Column(BigInteger)
+    status = Column(String, default="pending", index=True) # pending, sent, failed
+    error = Column(String, nullable=True)
+    sent_at = Column(DateTime, nullable=True)
+
+async def create_broadcast(message_text: str):
+    """
+    Creates a broadcast job and snapshots its recipients in one transaction.
+    Recipients = everyone in `users` + anyone who left an order (legacy rows without a user record).
+    Returns (job_id, total_recipients).
+    """
+    async with AsyncSessionLocal() as session:
+        job = Broadcast(text=message_text, status="queued")
+        session.add(job)
+        await session.flush()
         
-        if product:
-            product.is_active = 0
-            await session.commit()
-            return True
-        return False
+        audience = union(
+            select(User.id.label("user_id")),
+            select(Order.user_id.label("user_id")).where(Order.user_id.isnot(None))
+        ).subquery()
+        await session.execute(
+            insert(BroadcastRecipient).from_select(
+                ["broadcast_id", "user_id"],
+                select(literal(job.id), audience.c.user_id)
+            )
+        )
+        
+        total = (await session.execute(
+            select(func.count()).where(BroadcastRecipient.broadcast_id == job.id)
+        )).scalar_one()
+        job.total = total
+        await session.commit()
+        return job.id, total
+
+async def get_broadcast(job_id: int):
+    """Returns a broadcast job by ID."""
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(select(Broadcast).where(Broadcast.id == job_id))
+        return result.scalar_one_or_none()
+
+async def get_unfinished_broadcasts():
+    """Returns IDs of jobs that were queued or interrupted (e.g. by a restart)."""
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(Broadcast.id).where(Broadcast.status.in_(["queued", "running"])).order_by(Broadcast.id)
+        )
+        return result.scalars().all()
+
+async def set_broadcast_status(job_id: int, status: str):
+    """Moves a job to a new status (stamps finished_at when done)."""
+    values = {"status": status}
+    if status == "done":
+        values["finished_at"] = datetime.utcnow()
+    async with AsyncSessionLocal() as session:
+        await session.execute(update(Broadcast).where(Broadcast.id == job_id).values(**values))
+        await session.commit()
+
+async def get_pending_recipients(job_id: int, limit: int = 100):
+    """Returns the next chunk of user IDs that have not been processed yet."""
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(BroadcastRecipient.user_id)
+            .where(BroadcastRecipient.broadcast_id == job_id, BroadcastRecipient.status == "pending")
+            .order_by(BroadcastRecipient.id)
+            .limit(limit)
+        )
+        return result.scalars().all()
+
+async def record_broadcast_results(job_id: int, results: list):
+    """
+    Stores delivery results for a chunk of recipients and bumps job counters.
+    results: [(user_id, 'sent' | 'failed', error_or_None), ...]
+    """
+    if not results:
+        return
+    now = datetime.utcnow()
+    sent = sum(1 for _, status, _ in results if status == "sent")
+    
+    recipients = BroadcastRecipient.__table__
+    set_result = (
+        update(recipients)
+        .where(recipients.c.broadcast_id == job_id, recipients.c.user_id == bindparam("recipient_id"))
+        .values(status=bindparam("result_status"), error=bindparam("result_error"), sent_at=now)
+    )
+    
+    async with AsyncSessionLocal() as session:
+        # One executemany for the whole chunk
+        await session.execute(set_result, [
+            {"recipient_id": user_id, "result_status": status, "result_error": error}
+            for user_id, status, error in results
+        ])
+        await session.execute(
+            update(Broadcast)
+            .where(Broadcast.id == job_id)
+            .values(sent=Broadcast.sent + sent, failed=Broadcast.failed + (len(results) - sent))
+        )
+        await session.commit()
+
+class MediaFile(Base):
+    __tablename__ = "media_files"
+    
+    content_hash = Column(String, primary_key=True) # sha256 of the local file
+    path = Column(String)
+    file_id = Column(String) # Telegram file_id returned by the first upload
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+async def get_media_file_id(content_hash: str):
+    """Returns the stored Telegram file_id for a file content hash (or None)."""
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(select(MediaFile.file_id).where(MediaFile.content_hash == content_hash))
+        return result.scalar_one_or_none()
+
+async def save_media_file_id(content_hash: str, path: str, file_id: str):
+    """Stores (or replaces) the Telegram file_id for a file content hash."""
+    async with AsyncSessionLocal() as session:
+        await session.merge(MediaFile(
+            content_hash=content_hash, path=path, file_id=file_id, updated_at=datetime.utcnow()
+        ))
+        await session.commit()
+
+async def delete_media_file_id(content_hash: str):
+    """Forgets a file_id that Telegram rejected."""
+    async with AsyncSessionLocal() as session:
+        await session.execute(delete(MediaFile).where(MediaFile.content_hash == content_hash))
+        await session.commit()
 
 async def seed_products():
     """Seeds default products if table is empty."""
@@ -484,6 +1258,9 @@ async def seed_dummy_orders(user_id: int):
                     text(f"UPDATE orders SET created_at = :date WHERE id = :id"),
                     {"date": backdate, "id": order_id}
                 )
+            bump_version("orders")
     
+    # Backdating bypasses the rollup
+    await reconcile_daily_stats(7)
     logger.info(f"🌱 Seeded {len(orders)} orders for user {user_id}")
 
@@ -0,0 +1,73 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# In-process pub/sub for the live order feed (Smart CRM).
+# Every open CRM stream owns one queue; database writes publish into all of them.
+ORDER_QUEUE_SIZE = 100
+
+_order_subscribers = set()
+_closing = None # asyncio.Event, set once the app shuts down
+
+# Queued into every order feed on shutdown: the stream ends instead of waiting for its next ping
+STREAM_CLOSED = ("shutdown", None)
+
+def subscribe_orders() -> asyncio.Queue:
+    """Registers a new listener of order events and returns its queue."""
+    queue = asyncio.Queue(maxsize=ORDER_QUEUE_SIZE)
+    _order_subscribers.add(queue)
+    logger.info(f"📡 Order feed subscriber added ({len(_order_subscribers)} active)")
+    return queue
+
+def unsubscribe_orders(queue: asyncio.Queue):
+    """Removes a listener (stream closed)."""
+    _order_subscribers.discard(queue)
+    logger.info(f"📡 Order feed subscriber removed ({len(_order_subscribers)} active)")
+
+def publish_order_event(event: str, order):
+    """
+    Pushes an order change to every subscriber.
+    event: 'created', 'status' or 'updated'. Never blocks the writer:
+    a subscriber that can't keep up gets its backlog replaced by a 'resync' marker.
+    """
+    for queue in list(_order_subscribers):
+        try:
+            queue.put_nowait((event, order))
+        except asyncio.QueueFull:
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(("resync", None))
+
+def _closing_event() -> asyncio.Event:
+    global _closing
+    if _closing is None:
+        _closing = asyncio.Event()
+    return _closing
+
+def streams_closing() -> bool:
+    return _closing is not None and _closing.is_set()
+
+async def wait_or_close(event: asyncio.Event, timeout: float) -> bool:
+    """Waits for `event` up to `timeout` seconds. Returns False if streams are closing."""
+    closing = _closing_event()
+    waiters = [asyncio.ensure_future(event.wait()), asyncio.ensure_future(closing.wait())]
+    try:
+        await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for waiter in waiters:
+            waiter.cancel()
+    return not closing.is_set()
+
+async def close_streams(app=None):
+    """
+    on_shutdown hook: ends every open SSE stream (order feed, job progress).
+    aiohttp waits for running handlers before on_cleanup, so open streams would
+    otherwise hold shutdown for the whole shutdown_timeout.
+    """
+    _closing_event().set()
+    for queue in list(_order_subscribers):
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(STREAM_CLOSED)
+    logger.info(f"📡 Closing {len(_order_subscribers)} order feed stream(s) for shutdown")
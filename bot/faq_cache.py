@@ -0,0 +1,212 @@
+import logging
+import math
+import os
+import re
+from collections import Counter, OrderedDict
+from bot.database import get_all_products, get_resource_version
+
+logger = logging.getLogger(__name__)
+
+# Local answer cache in front of Gemini.
+# Each language has its own partition. A question is looked up by normalized text
+# (exact hit), then by cosine similarity of TF-IDF weighted character trigrams
+# (near hit, >= FAQ_SIMILARITY_THRESHOLD). Seeded entries (products, cases) are
+# pinned; answers learned from Gemini are evicted LRU-first.
+# Learned answers are shared between users, so only short generic questions are
+# learned (no names, numbers or contacts) and they are served on exact hits only:
+# near and fallback matches come from the seeded entries.
+
+FAQ_SIMILARITY_THRESHOLD = float(os.getenv("FAQ_SIMILARITY_THRESHOLD", 0.85))
+FAQ_MAX_ENTRIES = int(os.getenv("FAQ_MAX_ENTRIES", 500)) # Learned entries per language
+FAQ_MIN_LENGTH = 4 # Shorter questions ("да", "ок") depend on context, never cached
+FAQ_LEARN_MAX_WORDS = 8 # Longer questions carry personal detail more often than not
+
+_PUNCT_RE = re.compile(r"[^\w\s]+")
+_SPACE_RE = re.compile(r"\s+")
+_TAG_RE = re.compile(r"</?b>")
+_PRIVATE_RE = re.compile(r"\d|@|https?://|www\.", re.I) # Phones, amounts, order ids, handles, links
+_INTRO_RE = re.compile(r"\b(меня зовут|мое имя|моё имя|я из компании|my name|i am|i'm)\b", re.I)
+_WORD_RE = re.compile(r"[^\W\d_]+")
+
+def normalize(text: str) -> str:
+    text = (text or "").lower().replace("ё", "е")
+    return _SPACE_RE.sub(" ", _PUNCT_RE.sub(" ", text)).strip()
+
+def is_generic_question(text: str) -> bool:
+    """Short, impersonal question whose answer may be reused for anyone."""
+    if not text or _PRIVATE_RE.search(text) or _INTRO_RE.search(text):
+        return False
+    words = _WORD_RE.findall(text)
+    if not words or len(words) > FAQ_LEARN_MAX_WORDS:
+        return False
+    # A capitalized word after the first is most likely a name ("Алишер", "Фаррух"); acronyms are fine
+    return not any(w[0].isupper() and not w.isupper() for w in words[1:])
+
+def _ngrams(normalized: str) -> Counter:
+    grams = Counter()
+    for word in normalized.split():
+        padded = f" {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+class _Entry:
+    __slots__ = ("answer", "grams", "pinned", "source")
+
+    def __init__(self, answer: str, grams: Counter, pinned: bool, source: str):
+        self.answer = answer
+        self.grams = grams
+        self.pinned = pinned
+        self.source = source
+
+class FAQPartition:
+    """Entries of one language: normalized question -> _Entry, with an n-gram inverted index."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries = OrderedDict() # LRU order: oldest first
+        self.postings = {}           # n-gram -> set of questions containing it
+        self.learned = 0
+
+    def _idf(self, gram: str) -> float:
+        return math.log((1 + len(self.entries)) / (1 + len(self.postings.get(gram, ())))) + 1
+
+    def _weights(self, grams: Counter) -> dict:
+        return {g: tf * self._idf(g) for g, tf in grams.items()}
+
+    def add(self, question: str, answer: str, pinned: bool = False, source: str = "learned"):
+        key = normalize(question)
+        if len(key) < FAQ_MIN_LENGTH:
+            return
+        if key in self.entries:
+            self._remove(key)
+        grams = _ngrams(key)
+        self.entries[key] = _Entry(answer, grams, pinned, source)
+        for g in grams:
+            self.postings.setdefault(g, set()).add(key)
+        if not pinned:
+            self.learned += 1
+            self._evict()
+
+    def _remove(self, key: str):
+        entry = self.entries.pop(key)
+        for g in entry.grams:
+            keys = self.postings.get(g)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self.postings[g]
+        if not entry.pinned:
+            self.learned -= 1
+
+    def _evict(self):
+        if self.learned <= self.max_entries:
+            return
+        for key, entry in self.entries.items():
+            if not entry.pinned:
+                self._remove(key)
+                return
+
+    def remove_source(self, source: str):
+        for key in [k for k, e in self.entries.items() if e.source == source]:
+            self._remove(key)
+
+    def lookup(self, text: str, threshold: float = None):
+        """Returns (answer, kind) with kind 'exact'/'near' (pinned entries only), or None."""
+        key = normalize(text)
+        if len(key) < FAQ_MIN_LENGTH:
+            return None
+        entry = self.entries.get(key)
+        if entry:
+            self.entries.move_to_end(key)
+            return entry.answer, "exact"
+
+        grams = _ngrams(key)
+        candidates = set()
+        for g in grams:
+            candidates |= self.postings.get(g, set())
+        candidates = {c for c in candidates if self.entries[c].pinned} # Learned answers: exact only
+        if not candidates:
+            return None
+
+        query = self._weights(grams)
+        query_norm = math.sqrt(sum(w * w for w in query.values()))
+        best_key, best_score = None, 0.0
+        for cand in candidates:
+            weights = self._weights(self.entries[cand].grams)
+            dot = sum(w * weights.get(g, 0.0) for g, w in query.items())
+            norm = math.sqrt(sum(w * w for w in weights.values()))
+            score = dot / (query_norm * norm)
+            if score > best_score:
+                best_key, best_score = cand, score
+
+        if best_score < (threshold or FAQ_SIMILARITY_THRESHOLD):
+            return None
+        self.entries.move_to_end(best_key)
+        return self.entries[best_key].answer, "near"
+
+_partitions = {}
+_metrics = {"exact": 0, "near": 0, "miss": 0}
+_products_version = None
+
+def _partition(lang: str) -> FAQPartition:
+    part = _partitions.get(lang)
+    if part is None:
+        part = _partitions[lang] = FAQPartition(FAQ_MAX_ENTRIES)
+    return part
+
+def _html_to_markdown(text: str) -> str:
+    return _TAG_RE.sub("*", text)
+
+async def _seed_products():
+    global _products_version
+    version = get_resource_version("products")
+    part = _partition("ru")
+    part.remove_source("products")
+    for p in await get_all_products():
+        answer = f"{p.icon} *{p.title}* — {p.desc}\nЦена: от {p.price} TJS.\n\nХотите обсудить детали? Нажмите «Оставить заявку» 🚀"
+        for question in (p.title, f"сколько стоит {p.title}", f"цена {p.title}", f"что такое {p.title}"):
+            part.add(question, answer, pinned=True, source="products")
+    _products_version = version
+
+def _seed_cases():
+    from bot.handlers import CASES_INFO
+    part = _partition("ru")
+    part.remove_source("cases")
+    for text in CASES_INFO.values():
+        title = normalize(_TAG_RE.sub("", text.split("\n", 1)[0]).split(":", 1)[-1])
+        for question in (title, f"кейс {title}", f"расскажи про {title}", f"пример {title}"):
+            part.add(question, _html_to_markdown(text), pinned=True, source="cases")
+
+async def seed_faq_cache():
+    """Seeds the Russian partition from the product catalog and CASES_INFO (call on startup)."""
+    await _seed_products()
+    _seed_cases()
+    logger.info(f"📚 FAQ cache seeded: {len(_partition('ru').entries)} questions.")
+
+async def lookup_answer(text: str, lang: str = "ru", threshold: float = None):
+    """
+    Cached answer for a chat message, or None. Re-seeds products if the catalog changed.
+    A custom `threshold` (fallback lookups while the AI is down) is not counted in the metrics.
+    """
+    if _products_version is not None and _products_version != get_resource_version("products"):
+        await _seed_products()
+    hit = _partitions[lang].lookup(text, threshold) if lang in _partitions else None
+    if threshold is None:
+        _metrics[hit[1] if hit else "miss"] += 1
+    return hit[0] if hit else None
+
+def remember_answer(text: str, answer: str, lang: str = "ru") -> bool:
+    """Caches a Gemini answer to a context-free question, if the question is generic. Returns True if cached."""
+    if not is_generic_question(text):
+        return False
+    _partition(lang).add(text, answer)
+    return True
+
+def get_faq_stats() -> dict:
+    lookups = sum(_metrics.values())
+    hits = _metrics["exact"] + _metrics["near"]
+    return {
+        **_metrics,
+        "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+        "entries": {lang: len(part.entries) for lang, part in _partitions.items()},
+    }
@@ -1,4 +1,6 @@
+import asyncio
 import os
+import time
 import datetime
 from aiogram import Router, F, types
 from aiogram.filters import Command, CommandStart, StateFilter, CommandObject
@@ -7,9 +9,11 @@ from aiogram.types import FSInputFile
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from bot.states import ApplicationState
 from bot.config import ADMIN_ID, ADMIN_USERNAME, WEBHOOK_URL
-from bot.keyboards import main_menu_kb, cases_kb, case_action_kb, post_submit_kb, budget_kb
+from bot.keyboards import main_menu_kb, cases_kb, case_action_kb, post_submit_kb
 from bot.locales_data import LOCALES
-from bot.database import add_user, get_user_language, set_user_language, add_order, get_referral_stats
+from bot.screens import Screen, get_screen
+from bot.media import answer_photo_cached
+from bot.database import add_user, set_user_language, add_order, get_referral_stats
 
 router = Router()
 
@@ -86,47 +90,52 @@ from bot.database import add_user, get_all_users
 import asyncio
 
 # --- Localization Helpers ---
-async def get_text(user_id: int, key: str) -> str:
-    lang = await get_user_language(user_id)
+# Handlers receive `lang` (and `user_role`) from UserContextMiddleware,
+# so looking up a string is a dict access, not a DB query.
+# Menu texts + keyboards are pre-rendered per language in bot.screens.
+def locale_text(lang: str, key: str) -> str:
     return LOCALES.get(lang, LOCALES["ru"]).get(key, key)
 
-async def get_main_keyboard_dynamic(user_id: int):
-    shop_url = f"{os.getenv('WEBHOOK_URL', 'https://google.com')}/shop/index.html"
-    
-    t_store = await get_text(user_id, "btn_store")
-    t_cases = await get_text(user_id, "btn_cases")
-    t_about = await get_text(user_id, "btn_about")
-    t_discuss = await get_text(user_id, "btn_discuss")
-    t_my_orders = await get_text(user_id, "btn_my_orders")
-    
-    from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=t_store, web_app=WebAppInfo(url=shop_url))],
-        [InlineKeyboardButton(text=t_my_orders, callback_data="my_orders")],
-        [InlineKeyboardButton(text=t_cases, callback_data="nav_cases"), 
-         InlineKeyboardButton(text=t_about, callback_data="nav_about")],
-        [InlineKeyboardButton(text=t_discuss, callback_data="new_application")]
-    ])
+async def _show_screen(callback: types.CallbackQuery, screen: Screen):
+    """Edits the callback message in place (photo messages can't become text: resend)."""
+    if callback.message.photo:
+        await callback.message.delete()
+        await callback.message.answer(**screen.as_kwargs())
+    else:
+        await callback.message.edit_text(**screen.as_kwargs())
 
 # ... cmd_start ...
 
-@router.callback_query(F.data == "my_orders")
-async def show_my_orders(callback: types.CallbackQuery):
+MY_ORDERS_PAGE_SIZE = 5
+
+@router.callback_query(F.data.startswith("my_orders"))
+async def show_my_orders(callback: types.CallbackQuery, lang: str):
+    """
+    "My orders", paged with keyset cursors (fits Telegram's 4096-char limit).
+    callback_data: "my_orders" (first page), "my_orders:n:<cursor>" (older), "my_orders:p:<cursor>" (newer).
+    """
     from bot.database import get_user_orders
-    orders = await get_user_orders(callback.from_user.id)
     
-    header = await get_text(callback.from_user.id, "header_my_orders")
-    no_orders = await get_text(callback.from_user.id, "no_orders")
-    back_text = await get_text(callback.from_user.id, "btn_back")
+    parts = callback.data.split(":", 2)
+    cursor = parts[2] if len(parts) == 3 else None
+    backward = len(parts) == 3 and parts[1] == "p"
+    try:
+        page = await get_user_orders(callback.from_user.id, limit=MY_ORDERS_PAGE_SIZE, cursor=cursor, backward=backward)
+    except ValueError:
+        page = await get_user_orders(callback.from_user.id, limit=MY_ORDERS_PAGE_SIZE) # Stale/malformed button
+    
+    screen = get_screen(lang, "my_orders")
+    header = screen.text
+    no_orders = locale_text(lang, "no_orders")
     
-    if not orders:
+    if not page.items:
         text = header + no_orders
     else:
         text = header
-        for o in orders:
+        for o in page.items:
             # Localize status
             status_key = f"status_{o.status}"
-            status_text = await get_text(callback.from_user.id, status_key)
+            status_text = locale_text(lang, status_key)
             
             date_str = o.created_at.strftime("%d.%m.%Y")
             budget_str = o.budget if o.budget else "—"
@@ -139,16 +148,18 @@ async def show_my_orders(callback: types.CallbackQuery):
                 f"💰 {budget_str}\n"
                 f"──────────────\n\n"
             )
-            
-    kb = types.InlineKeyboardMarkup(inline_keyboard=[
-        [types.InlineKeyboardButton(text=back_text, callback_data="nav_back_main")]
-    ])
     
-    if callback.message.photo:
-        await callback.message.delete()
-        await callback.message.answer(text, reply_markup=kb, parse_mode="HTML")
-    else:
-        await callback.message.edit_text(text, reply_markup=kb, parse_mode="HTML")
+    # Pagination row on top of the shared "Back" keyboard
+    nav_row = []
+    if page.prev_cursor:
+        nav_row.append(types.InlineKeyboardButton(text="◀️", callback_data=f"my_orders:p:{page.prev_cursor}"))
+    if page.next_cursor:
+        nav_row.append(types.InlineKeyboardButton(text="▶️", callback_data=f"my_orders:n:{page.next_cursor}"))
+    kb = screen.reply_markup
+    if nav_row:
+        kb = types.InlineKeyboardMarkup(inline_keyboard=[nav_row, *kb.inline_keyboard])
+    
+    await _show_screen(callback, screen._replace(text=text, reply_markup=kb))
     await callback.answer()
 
 @router.message(CommandStart())
@@ -204,8 +215,8 @@ async def process_language_selection(callback: types.CallbackQuery):
     lang_code = callback.data.split("_")[1]
     await set_user_language(callback.from_user.id, lang_code)
     
-    text = await get_text(callback.from_user.id, "welcome")
-    kb = await get_main_keyboard_dynamic(callback.from_user.id)
+    screen = get_screen(lang_code, "welcome")
+    text, kb = screen.text, screen.reply_markup
     
     # Try to verify photo existence
     photo_path = "bot/my-photo.jpeg" if os.path.exists("bot/my-photo.jpeg") else None
@@ -214,8 +225,9 @@ async def process_language_selection(callback: types.CallbackQuery):
         # If message has photo, edit caption. If not (text), delete and send photo.
         # But callback is from text message usually.
         await callback.message.delete()
-        await callback.message.answer_photo(
-            photo=FSInputFile(photo_path),
+        await answer_photo_cached(
+            callback.message,
+            photo_path,
             caption=text,
             reply_markup=kb,
             parse_mode="Markdown"
@@ -320,62 +332,19 @@ async def cmd_seed(message: types.Message):
 
 
 @router.callback_query(F.data == "nav_cases")
-async def nav_cases(callback: types.CallbackQuery):
-    text = await get_text(callback.from_user.id, "cases_intro")
-    
-    # Cases buttons should probably be localized too, but for now we use the static `cases_kb`
-    # Ideally, we should update `cases_kb` to be dynamic or just inline it here.
-    # Let's rely on the existing kb for now to save time, assume titles are "universal" enough or accept Russian there.
-    # Actually, let's look at locales_data.py -> "case_food", etc.
-    # We should update the buttons!
-    
-    c1 = await get_text(callback.from_user.id, "case_food")
-    c2 = await get_text(callback.from_user.id, "case_school")
-    c3 = await get_text(callback.from_user.id, "case_beauty")
-    back = await get_text(callback.from_user.id, "btn_back")
-    
-    kb = types.InlineKeyboardMarkup(inline_keyboard=[
-        [types.InlineKeyboardButton(text="🥗 Calorie AI (Vision)", callback_data="case_calorie")],
-        [types.InlineKeyboardButton(text=c1, callback_data="case_food")],
-        [types.InlineKeyboardButton(text=c2, callback_data="case_school")],
-        [types.InlineKeyboardButton(text=c3, callback_data="case_beauty")],
-        [types.InlineKeyboardButton(text=back, callback_data="nav_back_main")]
-    ])
-    
-    if callback.message.photo:
-        await callback.message.delete()
-        await callback.message.answer(text, reply_markup=kb, parse_mode="Markdown")
-    else:
-        await callback.message.edit_text(text, reply_markup=kb, parse_mode="Markdown")
+async def nav_cases(callback: types.CallbackQuery, lang: str):
+    await _show_screen(callback, get_screen(lang, "cases"))
     await callback.answer()
 
 @router.callback_query(F.data == "nav_about")
-async def nav_about(callback: types.CallbackQuery):
-    text = await get_text(callback.from_user.id, "about_text")
-    back = await get_text(callback.from_user.id, "btn_back")
-    
-    kb = types.InlineKeyboardMarkup(inline_keyboard=[[types.InlineKeyboardButton(text=back, callback_data="nav_back_main")]])
-    
-    if callback.message.photo:
-        await callback.message.delete()
-        await callback.message.answer(text, reply_markup=kb, parse_mode="HTML")
-    else:
-        await callback.message.edit_text(text, reply_markup=kb, parse_mode="HTML")
+async def nav_about(callback: types.CallbackQuery, lang: str):
+    await _show_screen(callback, get_screen(lang, "about"))
     await callback.answer()
 
 @router.callback_query(F.data == "nav_back_main")
-async def nav_back_main(callback: types.CallbackQuery, state: FSMContext):
+async def nav_back_main(callback: types.CallbackQuery, state: FSMContext, lang: str):
     await state.clear()
-    
-    text = await get_text(callback.from_user.id, "menu_main")
-    kb = await get_main_keyboard_dynamic(callback.from_user.id)
-    
-    if callback.message.photo:
-        await callback.message.delete()
-        await callback.message.answer(text, reply_markup=kb, parse_mode="Markdown")
-    else:
-        await callback.message.edit_text(text, reply_markup=kb, parse_mode="Markdown")
-    await callback.answer()
+    await _show_screen(callback, get_screen(lang, "main"))
     await callback.answer()
 
 @router.callback_query(F.data.startswith("case_"))
@@ -396,26 +365,23 @@ async def show_case_detail(callback: types.CallbackQuery):
 
 
 @router.callback_query(F.data == "new_application")
-async def start_application_direct(callback: types.CallbackQuery, state: FSMContext):
+async def start_application_direct(callback: types.CallbackQuery, state: FSMContext, lang: str):
     # Set default context for generic application
     await state.update_data(service_context="Общая заявка")
-    await _start_fsm(callback.message, state)
+    await _start_fsm(callback.message, state, lang)
     await callback.answer()
 
-async def _start_fsm(message: types.Message, state: FSMContext, context: str = None):
+async def _start_fsm(message: types.Message, state: FSMContext, lang: str, context: str = None):
     """
     Helper to start the FSM flow.
     """
     await state.set_state(ApplicationState.name)
-    user_id = message.from_user.id
     
-    # We will use "fsm_name" which corresponds to "Step 1 of 5..."
-    text = await get_text(user_id, "fsm_name")
-        
-    await message.answer(text, reply_markup=types.ReplyKeyboardRemove(), parse_mode="Markdown")
+    # "fsm_name" corresponds to "Step 1 of 5..."
+    await message.answer(**get_screen(lang, "fsm_name").as_kwargs())
 
 @router.message(ApplicationState.name)
-async def process_name(message: types.Message, state: FSMContext):
+async def process_name(message: types.Message, state: FSMContext, lang: str):
     if not message.text:
         await message.answer("Пожалуйста, введите ваше имя текстом / Лутфан номи худро нависед.")
         return
@@ -423,17 +389,11 @@ async def process_name(message: types.Message, state: FSMContext):
     await state.update_data(name=message.text)
     await state.set_state(ApplicationState.business_type)
     
-    text = await get_text(message.from_user.id, "fsm_business")
-    
-    # Quick replies could be localized too, but let's keep it simple or remove them if text is generic
-    # For now, let's remove the keyboard to simplify logic or reuse generic ones
-    # Or give broad categories that are understandable. 
-    # Let's just use text input for business type to avoid translating 10 buttons right now.
-    
-    await message.answer(text, reply_markup=types.ReplyKeyboardRemove(), parse_mode="Markdown")
+    # Free text input for business type (no quick-reply buttons to translate)
+    await message.answer(**get_screen(lang, "fsm_business").as_kwargs())
 
 @router.message(ApplicationState.business_type)
-async def process_business_type(message: types.Message, state: FSMContext):
+async def process_business_type(message: types.Message, state: FSMContext, lang: str):
     if not message.text:
         await message.answer("Пожалуйста, напишите вид деятельности текстом.")
         return
@@ -441,17 +401,11 @@ async def process_business_type(message: types.Message, state: FSMContext):
     await state.update_data(business_type=message.text)
     await state.set_state(ApplicationState.budget)
     
-    text = await get_text(message.from_user.id, "fsm_budget")
-    # Budget buttons: low/mid/high. 
-    # We should update budget_kb to be dynamic. 
-    # For now, let's reuse `budget_kb` but be aware labels are Russian. 
-    # Better: just ask for text if we don't want to refactor buttons deeply.
-    # User can type number.
-    
-    await message.answer(text, reply_markup=budget_kb(), parse_mode="Markdown")
+    # Budget buttons: low/mid/high (labels are Russian for now)
+    await message.answer(**get_screen(lang, "fsm_budget").as_kwargs())
 
 @router.callback_query(ApplicationState.budget)
-async def process_budget(callback: types.CallbackQuery, state: FSMContext):
+async def process_budget(callback: types.CallbackQuery, state: FSMContext, lang: str):
     budget_map = {
         "budget_low": "Эконом (1000-2000 с.)",
         "budget_mid": "Бизнес (2000-5000 с.)",
@@ -462,12 +416,12 @@ async def process_budget(callback: types.CallbackQuery, state: FSMContext):
     await state.update_data(budget=selected_budget)
     await state.set_state(ApplicationState.task_description)
     
-    text = await get_text(callback.from_user.id, "fsm_task")
+    text = locale_text(lang, "fsm_task")
     await callback.message.edit_text(f"✅ {selected_budget}\n\n{text}", parse_mode="Markdown")
     await callback.answer()
 
 @router.message(ApplicationState.task_description)
-async def process_task_description(message: types.Message, state: FSMContext):
+async def process_task_description(message: types.Message, state: FSMContext, lang: str):
     if not message.text:
         await message.answer("Пожалуйста, опишите задачу текстом.")
         return
@@ -475,18 +429,12 @@ async def process_task_description(message: types.Message, state: FSMContext):
     await state.update_data(task_description=message.text)
     await state.set_state(ApplicationState.contact_info)
     
-    text = await get_text(message.from_user.id, "fsm_contact")
-    btn_text = await get_text(message.from_user.id, "btn_contact")
-    
-    kb = [[types.KeyboardButton(text=btn_text, request_contact=True)]]
-    keyboard = types.ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True, one_time_keyboard=True)
-    
-    await message.answer(text, reply_markup=keyboard, parse_mode="Markdown")
+    await message.answer(**get_screen(lang, "fsm_contact").as_kwargs())
 
 
 
 @router.message(ApplicationState.contact_info)
-async def process_contact_info(message: types.Message, state: FSMContext):
+async def process_contact_info(message: types.Message, state: FSMContext, lang: str):
     contact_info = ""
     if message.contact:
         contact_info = message.contact.phone_number
@@ -540,42 +488,79 @@ async def process_contact_info(message: types.Message, state: FSMContext):
     # Notify User & Show Post-Submit Menu
     await state.set_state(ApplicationState.submitted)
     
-    msg_thanks = await get_text(message.from_user.id, "msg_thanks")
-    await message.answer(
-        msg_thanks,
-        reply_markup=types.ReplyKeyboardRemove()
-    )
+    await message.answer(**get_screen(lang, "thanks").as_kwargs())
     
     # Show main menu again as prompt
-    menu_main = await get_text(message.from_user.id, "menu_main")
-    kb = await get_main_keyboard_dynamic(message.from_user.id)
-    
-    await message.answer(
-        menu_main,
-        reply_markup=kb,
-        parse_mode="Markdown"
-    )
+    await message.answer(**get_screen(lang, "main").as_kwargs())
+
+# Streaming AI replies: Telegram tolerates roughly one edit per second per chat
+AI_STREAM_EDIT_INTERVAL = 1.0
+TELEGRAM_TEXT_LIMIT = 4096
 
 @router.message(F.text, StateFilter(None))
-async def ai_chat_handler(message: types.Message):
+async def ai_chat_handler(message: types.Message, lang: str):
     """
     Handles all text messages when user is NOT in a form (FSM).
-    Passes text to Gemini AI.
+    Streams the Gemini reply: a message is sent once a second chunk arrives,
+    then the same message is edited as more text comes in. Single-chunk replies
+    (FAQ hits, fallback text) are sent once, already in their final form.
     """
     # Send "typing" action to show the bot is thinking
     await message.bot.send_chat_action(chat_id=message.chat.id, action="typing")
     
-    from bot.ai_service import get_ai_response
-    response = await get_ai_response(message.from_user.id, message.text)
-    
+    from bot.ai_service import dispatch_ai_response
     from bot.keyboards import ai_response_kb
-    from aiogram.exceptions import TelegramBadRequest
+    from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+    sent = None
+    text = ""
+    next_edit_at = 0.0
+    shown = ""
+
+    # Nothing is yielded if this message was merged into the user's pending request
+    async for chunk in dispatch_ai_response(message.from_user.id, message.text, lang):
+        if not chunk.strip():
+            continue
+        # One chunk of lookahead: progress shows the previous text, so a reply that
+        # arrives in one piece goes straight to the final render below
+        progress, text = text, chunk
+        if not progress:
+            continue
+        now = time.monotonic()
+        try:
+            if sent is None:
+                # Partial Markdown may be unbalanced, so intermediate updates go as plain text
+                sent = await message.answer(progress[:TELEGRAM_TEXT_LIMIT], parse_mode=None)
+                shown, next_edit_at = progress, now + AI_STREAM_EDIT_INTERVAL
+            elif now >= next_edit_at and progress != shown:
+                await sent.edit_text(progress[:TELEGRAM_TEXT_LIMIT - 2] + " ▌", parse_mode=None)
+                shown, next_edit_at = progress, now + AI_STREAM_EDIT_INTERVAL
+        except TelegramRetryAfter as e:
+            next_edit_at = now + e.retry_after
+        except TelegramBadRequest:
+            pass # e.g. "message is not modified", the final edit below catches up
+
+    if not text.strip():
+        return
 
-    try:
-        await message.answer(response, parse_mode="Markdown", reply_markup=ai_response_kb())
-    except TelegramBadRequest:
-        # Fallback: If Markdown parsing fails (e.g. unclosed entities), send as plain text
-        await message.answer(response, parse_mode=None, reply_markup=ai_response_kb())
+    # Final render: full text with Markdown (plain text fallback) + keyboard on the last part
+    parts = [text[i:i + TELEGRAM_TEXT_LIMIT] for i in range(0, len(text), TELEGRAM_TEXT_LIMIT)]
+    for i, part in enumerate(parts):
+        kb = ai_response_kb() if i == len(parts) - 1 else None
+        send = sent.edit_text if (i == 0 and sent is not None) else message.answer
+        parse_mode = "Markdown"
+        while True:
+            try:
+                await send(part, parse_mode=parse_mode, reply_markup=kb)
+                break
+            except TelegramRetryAfter as e:
+                # Flood control right after the progress edits: wait it out, never leave the "▌" reply
+                await asyncio.sleep(e.retry_after)
+            except TelegramBadRequest:
+                if parse_mode is None:
+                    raise
+                # Fallback: If Markdown parsing fails (e.g. unclosed entities), send as plain text
+                parse_mode = None
 
 # --- Post-Submit & Misc Handlers ---
 
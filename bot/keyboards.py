@@ -1,7 +1,12 @@
+from functools import lru_cache
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from bot.config import ADMIN_USERNAME
 
+# Keyboards are static and aiogram markups are immutable,
+# so each one is built once and shared (lru_cache).
+
+@lru_cache(maxsize=None)
 def main_menu_kb(webapp_url: str = None) -> InlineKeyboardMarkup:
     """
     Main Menu Keyboard
@@ -17,6 +22,7 @@ def main_menu_kb(webapp_url: str = None) -> InlineKeyboardMarkup:
     ])
     return InlineKeyboardMarkup(inline_keyboard=kb)
 
+@lru_cache(maxsize=None)
 def cases_kb() -> InlineKeyboardMarkup:
     """
     Portfolio / Cases Menu
@@ -30,6 +36,7 @@ def cases_kb() -> InlineKeyboardMarkup:
     ]
     return InlineKeyboardMarkup(inline_keyboard=kb)
 
+@lru_cache(maxsize=None)
 def case_action_kb() -> InlineKeyboardMarkup:
     """
     Action buttons under a specific case
@@ -40,6 +47,7 @@ def case_action_kb() -> InlineKeyboardMarkup:
     ]
     return InlineKeyboardMarkup(inline_keyboard=kb)
 
+@lru_cache(maxsize=None)
 def post_submit_kb() -> InlineKeyboardMarkup:
     """
     Post-submit flow keyboard
@@ -51,6 +59,7 @@ def post_submit_kb() -> InlineKeyboardMarkup:
     ]
     return InlineKeyboardMarkup(inline_keyboard=kb)
 
+@lru_cache(maxsize=None)
 def ai_response_kb() -> InlineKeyboardMarkup: # Added type hint for consistency
     kb = InlineKeyboardBuilder()
     kb.button(text="📝 Оставить заявку", callback_data="new_application") # Changed callback_data to match existing "new_application"
@@ -58,6 +67,7 @@ def ai_response_kb() -> InlineKeyboardMarkup: # Added type hint for consistency
     kb.adjust(1)
     return kb.as_markup()
 
+@lru_cache(maxsize=None)
 def budget_kb():
     kb = InlineKeyboardBuilder()
     kb.button(text="📉 Эконом (1000-2000 с.)", callback_data="budget_low")
@@ -0,0 +1,122 @@
+import asyncio
+import itertools
+import json
+import logging
+import time
+from bot.database import get_orders_for_scoring, set_admin_comments
+from bot.background import spawn
+
+logger = logging.getLogger(__name__)
+
+# Batch lead scoring: many leads per Gemini request (JSON in, JSON out),
+# a few batches in flight at once, one bulk UPDATE per batch.
+# Per-lead scoring stays in api.analyze_order.
+
+LEADS_PER_REQUEST = 20
+PARALLEL_REQUESTS = 3 # Also bounded globally by ai_service.AI_MAX_CONCURRENCY
+
+TEMPERATURES = {"cold": "Холодный", "warm": "Теплый", "hot": "Горячий"}
+
+SCORING_PROMPT = (
+    "Ты — бизнес-ассистент. Оцени каждый лид из списка (JSON):\n{leads}\n\n"
+    "Для каждого лида верни объект {{\"id\": <id лида>, \"temperature\": \"cold\" | \"warm\" | \"hot\", "
+    "\"advice\": \"1 совет, что ему написать (макс 10 слов)\"}}.\n"
+    "Ответ: только JSON-массив таких объектов, по одному на каждый лид."
+)
+
+_job_ids = itertools.count(1)
+_jobs = {} # job_id -> ScoringJob (kept after completion for status polling)
+MAX_FINISHED_JOBS = 20
+
+class ScoringJob:
+    """Progress of one batch scoring run. `changed` wakes up progress streams."""
+
+    def __init__(self, job_id: int, total: int):
+        self.id = job_id
+        self.status = "running"
+        self.total = total
+        self.scored = 0
+        self.failed = 0
+        self.started_at = time.time()
+        self.finished_at = None
+        self.changed = asyncio.Event()
+
+    def snapshot(self) -> dict:
+        return {
+            "job_id": self.id, "status": self.status, "total": self.total,
+            "scored": self.scored, "failed": self.failed,
+            "started_at": self.started_at, "finished_at": self.finished_at
+        }
+
+    def notify(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+def _lead_payload(order) -> dict:
+    return {
+        "id": order.id,
+        "name": order.name,
+        "task": order.task_description,
+        "budget": order.budget,
+        "context": order.service_context
+    }
+
+def _parse_scores(raw: str, ids: set) -> dict:
+    """Model JSON -> {order_id: admin_comment}; unknown ids and malformed items are skipped."""
+    data = json.loads(raw)
+    if isinstance(data, dict): # Some models wrap the array: {"leads": [...]}
+        data = next((v for v in data.values() if isinstance(v, list)), [])
+    comments = {}
+    for item in data:
+        try:
+            order_id = int(item["id"])
+            label = TEMPERATURES[str(item["temperature"]).lower()]
+        except (KeyError, TypeError, ValueError):
+            continue
+        if order_id in ids:
+            advice = str(item.get("advice") or "").strip()
+            comments[order_id] = f"{label}. {advice}" if advice else label
+    return comments
+
+async def _score_batch(job: ScoringJob, orders: list, semaphore: asyncio.Semaphore):
+    from bot.ai_service import generate_text
+    async with semaphore:
+        try:
+            leads = json.dumps([_lead_payload(o) for o in orders], ensure_ascii=False)
+            raw = await generate_text(SCORING_PROMPT.format(leads=leads), json_output=True)
+            comments = _parse_scores(raw, {o.id for o in orders})
+            await set_admin_comments(comments)
+        except Exception as e:
+            logger.error(f"Lead scoring batch failed ({len(orders)} leads): {e}")
+            comments = {}
+    job.scored += len(comments)
+    job.failed += len(orders) - len(comments)
+    job.notify()
+
+async def run_scoring(job: ScoringJob, orders: list):
+    semaphore = asyncio.Semaphore(PARALLEL_REQUESTS)
+    batches = [orders[i:i + LEADS_PER_REQUEST] for i in range(0, len(orders), LEADS_PER_REQUEST)]
+    try:
+        await asyncio.gather(*(_score_batch(job, batch, semaphore) for batch in batches))
+        job.status = "done"
+    except asyncio.CancelledError:
+        job.status = "cancelled"
+        raise
+    finally:
+        job.finished_at = time.time()
+        job.notify()
+        logger.info(f"⚡ Lead scoring #{job.id} {job.status}: scored={job.scored}, failed={job.failed}")
+
+async def start_scoring(only_unscored: bool = True, status: str = None) -> ScoringJob:
+    """Selects the leads and schedules the job in the background. Returns it immediately."""
+    orders = await get_orders_for_scoring(only_unscored, status)
+    job = ScoringJob(next(_job_ids), len(orders))
+    for old_id in [i for i, j in _jobs.items() if j.finished_at][:-MAX_FINISHED_JOBS or None]:
+        del _jobs[old_id]
+    _jobs[job.id] = job
+    spawn(run_scoring(job, orders), name=f"lead-scoring-{job.id}")
+    logger.info(f"⚡ Lead scoring #{job.id} queued: {job.total} leads in {-(-job.total // LEADS_PER_REQUEST)} request(s)")
+    return job
+
+def get_scoring_job(job_id: int):
+    return _jobs.get(job_id)
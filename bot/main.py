@@ -6,9 +6,17 @@ from aiogram import Bot, Dispatcher
 from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 from aiohttp import web
 from bot.config import BOT_TOKEN
-from bot.database import init_db, seed_products
+from bot.database import init_db, seed_products, flush_messages
+from bot.broadcast import resume_broadcasts
+from bot.ai_service import warm_up as warm_up_ai
+from bot.faq_cache import seed_faq_cache
+from bot.retention import start_retention_scheduler
+from bot.analytics import start_stats_reconciler
 from bot.handlers import router
+from bot.middlewares import UserContextMiddleware
 from bot.routes import setup_routes
+from bot.events import close_streams
+from bot.background import spawn, cancel_background_tasks
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, stream=sys.stdout)
@@ -18,9 +26,20 @@ async def on_startup(app: web.Application):
     """Global startup event for both modes."""
     await init_db()
     await seed_products()
+    await seed_faq_cache()
     setup_routes(app)
+    await resume_broadcasts(app["bot"])
+    start_retention_scheduler()
+    start_stats_reconciler()
+    warm_up_ai() # Model probe runs in the background, startup doesn't wait
     logger.info("🚀 App started. Routes configured.")
 
+async def on_cleanup(app: web.Application):
+    """Global shutdown event: stop background tasks, then persist buffered chat messages."""
+    await cancel_background_tasks()
+    written = await flush_messages()
+    logger.info(f"💾 Flushed {written} buffered message(s) on shutdown.")
+
 async def start_polling_background(app: web.Application):
     """Background task for Polling Mode."""
     bot: Bot = app["bot"]
@@ -28,7 +47,7 @@ async def start_polling_background(app: web.Application):
     
     logger.info("📡 Starting POLLING in background...")
     await bot.delete_webhook(drop_pending_updates=True)
-    asyncio.create_task(dp.start_polling(bot))
+    spawn(dp.start_polling(bot), name="polling")
 
 async def configure_webhook(app: web.Application):
     """Startup action for Webhook Mode."""
@@ -42,6 +61,8 @@ def main():
     # Initialize Bot and Dispatcher
     bot = Bot(token=BOT_TOKEN)
     dp = Dispatcher()
+    dp.message.middleware(UserContextMiddleware())
+    dp.callback_query.middleware(UserContextMiddleware())
     dp.include_router(router)
     
     # Create Aiohttp App
@@ -51,6 +72,8 @@ def main():
     
     # Common Startup
     app.on_startup.append(on_startup)
+    app.on_shutdown.append(close_streams) # End SSE streams, or shutdown waits for them
+    app.on_cleanup.append(on_cleanup)
     
     # Determine Mode
     run_mode = os.getenv("RUN_MODE", "polling")
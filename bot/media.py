@@ -0,0 +1,51 @@
+import hashlib
+import logging
+import os
+from aiogram import types
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile
+from bot.database import get_media_file_id, save_media_file_id, delete_media_file_id
+
+logger = logging.getLogger(__name__)
+
+# Local media registry: each asset is uploaded once, then sent by Telegram file_id.
+# Keyed by content hash (persisted in `media_files`), so editing the file triggers a re-upload.
+_hash_by_stat = {}  # (path, mtime_ns, size) -> sha256, avoids re-hashing on every send
+_file_ids = {}      # sha256 -> file_id, in-memory front of the DB table
+
+def _content_hash(path: str) -> str:
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    digest = _hash_by_stat.get(key)
+    if digest is None:
+        with open(path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        _hash_by_stat[key] = digest
+    return digest
+
+async def answer_photo_cached(message: types.Message, path: str, **kwargs) -> types.Message:
+    """
+    Same as message.answer_photo(FSInputFile(path), ...), but reuses the file_id
+    of a previous upload. Re-uploads if the file changed or Telegram rejects the id.
+    """
+    digest = _content_hash(path)
+
+    file_id = _file_ids.get(digest) or await get_media_file_id(digest)
+    if file_id:
+        try:
+            sent = await message.answer_photo(photo=file_id, **kwargs)
+            _file_ids[digest] = file_id
+            return sent
+        except TelegramBadRequest as e:
+            if "file" not in str(e).lower():
+                raise # Caption/markup error, not a stale id
+            logger.warning(f"🖼 Cached file_id for {path} rejected ({e}), re-uploading.")
+            _file_ids.pop(digest, None)
+            await delete_media_file_id(digest)
+
+    sent = await message.answer_photo(photo=FSInputFile(path), **kwargs)
+    file_id = sent.photo[-1].file_id # Largest size
+    _file_ids[digest] = file_id
+    await save_media_file_id(digest, path, file_id)
+    logger.info(f"🖼 Uploaded {path}, cached file_id.")
+    return sent
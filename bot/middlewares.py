@@ -0,0 +1,22 @@
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, User
+from bot.database import get_user_context
+
+class UserContextMiddleware(BaseMiddleware):
+    """
+    Loads the user's language and role once per update (cached in bot.database)
+    and exposes them to handlers as `lang` and `user_role` arguments.
+    """
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user: User = data.get("event_from_user")
+        if user:
+            data["lang"], data["user_role"] = await get_user_context(user.id)
+        else:
+            data["lang"], data["user_role"] = "ru", "user"
+        return await handler(event, data)
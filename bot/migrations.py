@@ -0,0 +1,216 @@
+"""
+Versioned schema migrations.
+
+Run offline (before the web process starts):
+    python -m bot.migrations
+
+Every step is idempotent (checks the live schema instead of relying on
+ALTER TABLE failures) and is recorded in `schema_version` in the same
+transaction that applies it. Steps with a data backfill (BACKFILLS) commit
+their DDL first, so table locks are released at once, then backfill in short
+per-batch transactions; the version is recorded after the last batch, so an
+interrupted backfill is simply re-run.
+"""
+import asyncio
+import logging
+import sys
+from datetime import datetime
+from sqlalchemy import Table, MetaData, Column, Integer, String, DateTime, select, func, insert, update, inspect, text, bindparam
+from bot.database import engine, Base, ChatSummary, Order, OrderItem, DailyStat, parse_items, order_amount, daily_stats_source
+from bot.search import SEARCH_COLUMNS, PG_ORDER_DOCUMENT
+
+logger = logging.getLogger(__name__)
+
+schema_version = Table(
+    "schema_version", MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("description", String),
+    Column("applied_at", DateTime, default=datetime.utcnow)
+)
+
+# --- Helpers ---
+
+async def _has_column(conn, table: str, column: str) -> bool:
+    columns = await conn.run_sync(lambda c: inspect(c).get_columns(table))
+    return any(col["name"] == column for col in columns)
+
+async def _add_column(conn, table: str, column: str, ddl: str):
+    if not await _has_column(conn, table, column):
+        await conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+        logger.info(f"🔄 Added column {table}.{column}")
+
+async def _create_index(conn, name: str, table: str, columns: str):
+    # IF NOT EXISTS works on both PostgreSQL and SQLite
+    await conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})"))
+
+# --- Steps ---
+
+async def _m001_baseline(conn):
+    """Tables from the models + columns that older deployments added by hand."""
+    await conn.run_sync(Base.metadata.create_all)
+    await _add_column(conn, "orders", "admin_comment", "TEXT")
+    await _add_column(conn, "orders", "items", "TEXT DEFAULT '[]'")
+    await _add_column(conn, "users", "language_code", "VARCHAR(5) DEFAULT 'ru'")
+    await _add_column(conn, "users", "invited_by", "BIGINT")
+    await _add_column(conn, "users", "referral_count", "INTEGER DEFAULT 0")
+    await _add_column(conn, "users", "role", "VARCHAR(20) DEFAULT 'user'")
+
+async def _m002_indexes(conn):
+    """Indexes for dashboard/CRM filters and referral lookups."""
+    await _create_index(conn, "ix_orders_created_at", "orders", "created_at")
+    await _create_index(conn, "ix_orders_status", "orders", "status")
+    await _create_index(conn, "ix_users_invited_by", "users", "invited_by")
+
+async def _m003_order_search(conn):
+    """Search index over orders: pg_trgm GIN on PostgreSQL, FTS5 (+ sync triggers) on SQLite."""
+    if conn.dialect.name == "postgresql":
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        await conn.execute(text(
+            f"CREATE INDEX IF NOT EXISTS ix_orders_search_trgm ON orders "
+            f"USING gin ({PG_ORDER_DOCUMENT} gin_trgm_ops)"
+        ))
+        return
+    if conn.dialect.name != "sqlite":
+        return
+
+    cols = ", ".join(SEARCH_COLUMNS)
+    new_vals = ", ".join(f"new.{c}" for c in SEARCH_COLUMNS)
+    old_vals = ", ".join(f"old.{c}" for c in SEARCH_COLUMNS)
+    fts_table = f"CREATE VIRTUAL TABLE IF NOT EXISTS orders_fts USING fts5({cols}, content='orders', content_rowid='id', tokenize=%s)"
+    try:
+        # trigram = substring matching (SQLite >= 3.34)
+        await conn.execute(text(fts_table % "'trigram'"))
+    except Exception as e:
+        logger.warning(f"FTS5 trigram tokenizer unavailable ({e}), using unicode61 (prefix search).")
+        await conn.execute(text(fts_table % "'unicode61 remove_diacritics 2'"))
+
+    await conn.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS orders_fts_ai AFTER INSERT ON orders BEGIN "
+        f"INSERT INTO orders_fts(rowid, {cols}) VALUES (new.id, {new_vals}); END"
+    ))
+    await conn.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS orders_fts_ad AFTER DELETE ON orders BEGIN "
+        f"INSERT INTO orders_fts(orders_fts, rowid, {cols}) VALUES ('delete', old.id, {old_vals}); END"
+    ))
+    await conn.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS orders_fts_au AFTER UPDATE ON orders BEGIN "
+        f"INSERT INTO orders_fts(orders_fts, rowid, {cols}) VALUES ('delete', old.id, {old_vals}); "
+        f"INSERT INTO orders_fts(rowid, {cols}) VALUES (new.id, {new_vals}); END"
+    ))
+    # Index existing rows
+    await conn.execute(text("INSERT INTO orders_fts(orders_fts) VALUES ('rebuild')"))
+
+async def _m004_keyset_indexes(conn):
+    """Composite indexes matching the (created_at, id) keyset pagination order."""
+    await _create_index(conn, "ix_orders_created_at_id", "orders", "created_at, id")
+    await _create_index(conn, "ix_orders_user_created_at_id", "orders", "user_id, created_at, id")
+    await _create_index(conn, "ix_users_invited_by_joined_at_id", "users", "invited_by, joined_at, id")
+
+async def _m005_chat_summaries(conn):
+    """Rolling per-user conversation summaries."""
+    await conn.run_sync(ChatSummary.__table__.create, checkfirst=True)
+
+BACKFILL_BATCH = 500
+
+async def _m006_order_amounts(conn):
+    """orders.amount + order_items (filled by _backfill_order_amounts)."""
+    await _add_column(conn, "orders", "amount", "INTEGER")
+    await conn.run_sync(OrderItem.__table__.create, checkfirst=True)
+    await _create_index(conn, "ix_orders_status_amount", "orders", "status, amount")
+
+async def _backfill_order_amounts():
+    """Fills orders.amount + order_items from the items JSON and budget, one transaction per batch."""
+    set_amount = update(Order.__table__).where(Order.id == bindparam("order_id")).values(amount=bindparam("order_amount"))
+    last_id, total = 0, 0
+    while True:
+        async with engine.begin() as conn:
+            rows = (await conn.execute(
+                select(Order.id, Order.items, Order.budget)
+                .where(Order.id > last_id).order_by(Order.id).limit(BACKFILL_BATCH)
+            )).all()
+            if not rows:
+                break
+            amounts, lines = [], []
+            for row in rows:
+                parsed = parse_items(row.items)
+                amounts.append({"order_id": row.id, "order_amount": order_amount(parsed, row.budget)})
+                lines += [{"order_id": row.id, **line} for line in parsed]
+            await conn.execute(set_amount, amounts)
+            # Replace, not append: a re-run after an interruption must not duplicate lines
+            await conn.execute(OrderItem.__table__.delete().where(OrderItem.order_id.in_([row.id for row in rows])))
+            if lines:
+                await conn.execute(insert(OrderItem.__table__), lines)
+        last_id, total = rows[-1].id, total + len(rows)
+    logger.info(f"🔄 Backfilled amounts for {total} orders")
+
+async def _m007_daily_stats(conn):
+    """daily_stats rollup, filled from orders with one INSERT ... SELECT."""
+    await conn.run_sync(DailyStat.__table__.create, checkfirst=True)
+    await conn.execute(DailyStat.__table__.delete())
+    await conn.execute(insert(DailyStat.__table__).from_select(
+        ["day", "service", "status", "orders", "amount"], daily_stats_source()
+    ))
+
+# Ordered list: (version, description, step). Append only; never renumber.
+MIGRATIONS = [
+    (1, "Baseline schema + legacy columns", _m001_baseline),
+    (2, "Indexes on orders.created_at, orders.status, users.invited_by", _m002_indexes),
+    (3, "Order search index (pg_trgm / FTS5)", _m003_order_search),
+    (4, "Keyset pagination indexes", _m004_keyset_indexes),
+    (5, "chat_summaries table", _m005_chat_summaries),
+    (6, "orders.amount + order_items (backfilled)", _m006_order_amounts),
+    (7, "daily_stats rollup (backfilled)", _m007_daily_stats),
+]
+
+# Data backfills run after their step's DDL has committed: version -> backfill()
+BACKFILLS = {
+    6: _backfill_order_amounts,
+}
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# --- Runner ---
+
+async def get_schema_version() -> int:
+    """Returns the applied schema version (0 for an unversioned database). No DDL."""
+    async with engine.connect() as conn:
+        exists = await conn.run_sync(lambda c: inspect(c).has_table("schema_version"))
+        if not exists:
+            return 0
+        result = await conn.execute(select(func.max(schema_version.c.version)))
+        return result.scalar() or 0
+
+async def migrate() -> int:
+    """Applies all pending migrations in order. Returns the number applied."""
+    async with engine.begin() as conn:
+        await conn.run_sync(schema_version.create, checkfirst=True)
+
+    current = await get_schema_version()
+    applied = 0
+    for version, description, step in MIGRATIONS:
+        if version <= current:
+            continue
+        logger.info(f"⏫ Migration {version}: {description}")
+        backfill = BACKFILLS.get(version)
+        async with engine.begin() as conn:
+            await step(conn)
+            if backfill is None:
+                await conn.execute(insert(schema_version).values(version=version, description=description))
+        if backfill is not None:
+            await backfill()
+            async with engine.begin() as conn:
+                await conn.execute(insert(schema_version).values(version=version, description=description))
+        applied += 1
+
+    logger.info(f"✅ Schema at version {LATEST_VERSION} ({applied} migration(s) applied).")
+    return applied
+
+async def _main():
+    try:
+        await migrate()
+    finally:
+        await engine.dispose()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+    asyncio.run(_main())
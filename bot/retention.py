@@ -0,0 +1,197 @@
+"""
+Retention for the `messages` table.
+
+Only the newest turns per user are ever read (plus the rolling summary in
+`chat_summaries`), so older rows can go. A run:
+  1. ages out rows older than --max-age-days (if set),
+  2. caps every user at their newest --keep rows,
+  3. optionally appends the removed rows to gzip NDJSON archives, one per month
+     (messages-YYYY-MM.ndjson.gz, one JSON object per line).
+
+Rows are removed in chunks of --chunk ids, each in its own short transaction.
+Archives are written before the delete commits, so an interrupted run can
+archive a chunk twice but never loses one.
+
+Run offline:
+    python -m bot.retention --keep 200 --archive archive/
+or in-process (main.py) every MESSAGES_RETENTION_INTERVAL_HOURS hours.
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import os
+import sys
+from datetime import datetime, timedelta
+from sqlalchemy import select, delete, func, text
+from bot.database import engine, AsyncSessionLocal, Message
+from bot.background import spawn
+
+logger = logging.getLogger(__name__)
+
+MESSAGES_KEEP_PER_USER = int(os.getenv("MESSAGES_KEEP_PER_USER", 200))
+MESSAGES_MAX_AGE_DAYS = int(os.getenv("MESSAGES_MAX_AGE_DAYS", 0))        # 0 = no age limit
+MESSAGES_ARCHIVE_DIR = os.getenv("MESSAGES_ARCHIVE_DIR")                  # unset = no archive
+MESSAGES_RETENTION_INTERVAL_HOURS = float(os.getenv("MESSAGES_RETENTION_INTERVAL_HOURS", 0)) # 0 = not scheduled
+CHUNK_SIZE = 1000
+
+# --- Archive ---
+
+def _write_archive(archive_dir: str, rows) -> int:
+    """Appends rows to the monthly gzip files (a new gzip member per call). Returns bytes written."""
+    os.makedirs(archive_dir, exist_ok=True)
+    by_month = {}
+    for row in rows:
+        month = (row.timestamp or datetime.utcnow()).strftime("%Y-%m")
+        by_month.setdefault(month, []).append(json.dumps({
+            "id": row.id, "user_id": row.user_id, "role": row.role, "content": row.content,
+            "timestamp": row.timestamp.isoformat() if row.timestamp else None
+        }, ensure_ascii=False))
+
+    written = 0
+    for month, lines in by_month.items():
+        path = os.path.join(archive_dir, f"messages-{month}.ndjson.gz")
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        with gzip.open(path, "at", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        written += os.path.getsize(path) - size
+    return written
+
+# --- Size ---
+
+async def _table_size() -> int:
+    """Bytes used by messages (PostgreSQL) or the whole database file minus free pages (SQLite)."""
+    async with engine.connect() as conn:
+        if conn.dialect.name == "postgresql":
+            return (await conn.execute(text("SELECT pg_total_relation_size('messages')"))).scalar() or 0
+        if conn.dialect.name == "sqlite":
+            page_size = (await conn.execute(text("PRAGMA page_size"))).scalar()
+            pages = (await conn.execute(text("PRAGMA page_count"))).scalar()
+            free = (await conn.execute(text("PRAGMA freelist_count"))).scalar()
+            return (pages - free) * page_size
+    return 0
+
+# --- Compaction ---
+
+async def _remove_chunk(where, chunk: int, archive_dir: str, report: dict, dry_run: bool) -> int:
+    """Archives + deletes up to `chunk` rows matching `where` (oldest first). Returns rows handled."""
+    async with AsyncSessionLocal() as session:
+        if dry_run:
+            count = (await session.execute(select(func.count()).select_from(Message).where(where))).scalar()
+            report["deleted"] += count
+            return 0 # Nothing removed: stop the loop
+
+        result = await session.execute(
+            select(Message.id, Message.user_id, Message.role, Message.content, Message.timestamp)
+            .where(where).order_by(Message.id).limit(chunk)
+        )
+        rows = result.fetchall()
+        if not rows:
+            return 0
+
+        if archive_dir:
+            report["archive_bytes"] += await asyncio.to_thread(_write_archive, archive_dir, rows)
+            report["archived"] += len(rows)
+        await session.execute(delete(Message).where(Message.id.in_([row.id for row in rows])))
+        await session.commit()
+
+    report["deleted"] += len(rows)
+    report["content_bytes"] += sum(len((row.content or "").encode("utf-8")) for row in rows)
+    return len(rows)
+
+async def compact_messages(
+    keep: int = MESSAGES_KEEP_PER_USER,
+    max_age_days: int = MESSAGES_MAX_AGE_DAYS,
+    archive_dir: str = MESSAGES_ARCHIVE_DIR,
+    chunk: int = CHUNK_SIZE,
+    dry_run: bool = False,
+    vacuum: bool = False
+) -> dict:
+    """
+    Applies the retention policy. Returns a report:
+    deleted, archived rows, archive_bytes, content_bytes removed, size_before/size_after.
+    """
+    report = {"deleted": 0, "archived": 0, "archive_bytes": 0, "content_bytes": 0, "dry_run": dry_run}
+    report["size_before"] = await _table_size()
+
+    # 1. Age: old rows sit at the start of the id range, so the id-ordered scan stops early
+    aged = None
+    if max_age_days:
+        aged = Message.timestamp < datetime.utcnow() - timedelta(days=max_age_days)
+        while await _remove_chunk(aged, chunk, archive_dir, report, dry_run) == chunk:
+            pass
+
+    # 2. Cap: per user, everything older than their newest `keep` rows
+    if keep:
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(Message.user_id).group_by(Message.user_id).having(func.count(Message.id) > keep)
+            )
+            users = result.scalars().all()
+
+        for user_id in users:
+            async with AsyncSessionLocal() as session:
+                result = await session.execute(
+                    select(Message.id).where(Message.user_id == user_id)
+                    .order_by(Message.id.desc()).offset(keep).limit(1)
+                )
+                last_expired = result.scalar_one_or_none()
+            if last_expired is None:
+                continue
+            where = (Message.user_id == user_id) & (Message.id <= last_expired)
+            if aged is not None:
+                # Already counted by step 1 (dry run). NULL timestamps never age out, so keep them capped
+                where &= ~aged | Message.timestamp.is_(None)
+            while await _remove_chunk(where, chunk, archive_dir, report, dry_run) == chunk:
+                pass
+
+    if vacuum and not dry_run:
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            await conn.execute(text("VACUUM" if conn.dialect.name == "sqlite" else "VACUUM messages"))
+
+    report["size_after"] = await _table_size()
+    report["reclaimed_bytes"] = max(report["size_before"] - report["size_after"], 0)
+    logger.info(
+        f"🧹 Messages compaction{' (dry run)' if dry_run else ''}: {report['deleted']} rows removed, {report['archived']} archived "
+        f"({report['archive_bytes']} bytes), {report['reclaimed_bytes']} bytes reclaimed."
+    )
+    return report
+
+# --- Scheduling ---
+
+async def _retention_loop(interval_hours: float):
+    while True:
+        await asyncio.sleep(interval_hours * 3600)
+        try:
+            await compact_messages()
+        except Exception as e:
+            logger.error(f"❌ Messages compaction failed: {e}")
+
+def start_retention_scheduler():
+    """Runs compaction every MESSAGES_RETENTION_INTERVAL_HOURS in the background (no-op if 0)."""
+    if MESSAGES_RETENTION_INTERVAL_HOURS > 0:
+        spawn(_retention_loop(MESSAGES_RETENTION_INTERVAL_HOURS), name="messages-retention")
+        logger.info(f"🧹 Messages compaction scheduled every {MESSAGES_RETENTION_INTERVAL_HOURS}h.")
+
+async def _main(args):
+    try:
+        report = await compact_messages(
+            keep=args.keep, max_age_days=args.max_age_days, archive_dir=args.archive,
+            chunk=args.chunk, dry_run=args.dry_run, vacuum=args.vacuum
+        )
+        print(json.dumps(report, indent=2))
+    finally:
+        await engine.dispose()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+    parser = argparse.ArgumentParser(description="Compact and archive the messages table.")
+    parser.add_argument("--keep", type=int, default=MESSAGES_KEEP_PER_USER, help="newest rows kept per user (0 = no cap)")
+    parser.add_argument("--max-age-days", type=int, default=MESSAGES_MAX_AGE_DAYS, help="remove older rows (0 = no limit)")
+    parser.add_argument("--archive", default=MESSAGES_ARCHIVE_DIR, help="directory for monthly .ndjson.gz archives")
+    parser.add_argument("--chunk", type=int, default=CHUNK_SIZE, help="rows per transaction")
+    parser.add_argument("--dry-run", action="store_true", help="only count what would be removed")
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM afterwards to return space to the OS")
+    asyncio.run(_main(parser.parse_args()))
@@ -5,7 +5,10 @@ from bot.api import (
     send_broadcast, create_client_order, negotiate_order,
     get_products_list, create_product, update_product_endpoint, delete_product_endpoint,
     get_products_list, create_product, update_product_endpoint, delete_product_endpoint,
-    get_client_referrals, analyze_order, get_clients_list, get_current_user_info
+    get_client_referrals, analyze_order, get_clients_list, get_current_user_info,
+    stream_orders, get_broadcast_status, get_ai_stats,
+    analyze_orders_batch, get_analysis_job, stream_analysis_job, get_db_pool_stats,
+    get_product_sales_stats, get_stats_range_endpoint
 )
 
 def setup_routes(app: web.Application):
@@ -15,13 +18,22 @@ def setup_routes(app: web.Application):
     # API endpoints for Pocket CRM
     app.router.add_get("/api/me", get_current_user_info)
     app.router.add_get("/api/stats", get_dashboard_stats)
+    app.router.add_get("/api/stats/products", get_product_sales_stats)
+    app.router.add_get("/api/stats/range", get_stats_range_endpoint)
     app.router.add_get("/api/bookings", get_bookings_list)
+    app.router.add_get("/api/bookings/stream", stream_orders)
     app.router.add_get("/api/orders/{id}", get_order_details)
     app.router.add_post("/api/orders/{id}/status", update_order_status)
     app.router.add_post("/api/orders/{id}/update", update_order_details)
     app.router.add_post("/api/orders/{id}/analyze", analyze_order)
+    app.router.add_post("/api/orders/analyze", analyze_orders_batch)
+    app.router.add_get("/api/orders/analyze/{job_id}", get_analysis_job)
+    app.router.add_get("/api/orders/analyze/{job_id}/stream", stream_analysis_job)
+    app.router.add_get("/api/ai/stats", get_ai_stats)
+    app.router.add_get("/api/db/pool", get_db_pool_stats)
     app.router.add_post("/api/orders/{id}/negotiate", negotiate_order)
     app.router.add_post("/api/broadcast", send_broadcast)
+    app.router.add_get("/api/broadcast/{id}", get_broadcast_status)
     app.router.add_post("/api/client/orders", create_client_order)
     app.router.add_get("/api/client/referrals", get_client_referrals)
     app.router.add_get("/api/clients", get_clients_list)
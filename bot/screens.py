@@ -0,0 +1,76 @@
+from types import MappingProxyType
+from typing import NamedTuple, Optional, Union
+from aiogram.types import (
+    InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo,
+    ReplyKeyboardMarkup, ReplyKeyboardRemove, KeyboardButton
+)
+from bot.config import WEBHOOK_URL
+from bot.keyboards import budget_kb
+from bot.locales_data import LOCALES
+
+# Pre-rendered menu screens: (lang, screen) -> Screen.
+# LOCALES is static, so every keyboard/text is built once at import and shared
+# (aiogram types are frozen pydantic models, safe to reuse across updates).
+
+class Screen(NamedTuple):
+    text: str
+    reply_markup: Optional[Union[InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove]]
+    parse_mode: Optional[str] = "Markdown"
+
+    def as_kwargs(self) -> dict:
+        """Arguments for message.answer / message.edit_text."""
+        return {"text": self.text, "reply_markup": self.reply_markup, "parse_mode": self.parse_mode}
+
+def _build_language(t: dict, shop_url: str) -> dict:
+    """Builds all screens for one language dictionary."""
+    back_kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=t["btn_back"], callback_data="nav_back_main")]
+    ])
+    main_kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=t["btn_store"], web_app=WebAppInfo(url=shop_url))],
+        [InlineKeyboardButton(text=t["btn_my_orders"], callback_data="my_orders")],
+        [InlineKeyboardButton(text=t["btn_cases"], callback_data="nav_cases"),
+         InlineKeyboardButton(text=t["btn_about"], callback_data="nav_about")],
+        [InlineKeyboardButton(text=t["btn_discuss"], callback_data="new_application")]
+    ])
+    cases_kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🥗 Calorie AI (Vision)", callback_data="case_calorie")],
+        [InlineKeyboardButton(text=t["case_food"], callback_data="case_food")],
+        [InlineKeyboardButton(text=t["case_school"], callback_data="case_school")],
+        [InlineKeyboardButton(text=t["case_beauty"], callback_data="case_beauty")],
+        [InlineKeyboardButton(text=t["btn_back"], callback_data="nav_back_main")]
+    ])
+    contact_kb = ReplyKeyboardMarkup(
+        keyboard=[[KeyboardButton(text=t["btn_contact"], request_contact=True)]],
+        resize_keyboard=True,
+        one_time_keyboard=True
+    )
+    no_kb = ReplyKeyboardRemove()
+
+    return {
+        "welcome": Screen(t["welcome"], main_kb),
+        "main": Screen(t["menu_main"], main_kb),
+        "cases": Screen(t["cases_intro"], cases_kb),
+        "about": Screen(t["about_text"], back_kb, "HTML"),
+        "my_orders": Screen(t["header_my_orders"], back_kb, "HTML"), # Order list is appended by the handler
+        "fsm_name": Screen(t["fsm_name"], no_kb),
+        "fsm_business": Screen(t["fsm_business"], no_kb),
+        "fsm_budget": Screen(t["fsm_budget"], budget_kb()),
+        "fsm_contact": Screen(t["fsm_contact"], contact_kb),
+        "thanks": Screen(t["msg_thanks"], no_kb, None),
+    }
+
+def build_screens(base_url: str) -> MappingProxyType:
+    """Renders every screen for every language in LOCALES."""
+    shop_url = f"{base_url}/shop/index.html"
+    screens = {}
+    for lang, t in LOCALES.items():
+        for name, screen in _build_language(t, shop_url).items():
+            screens[(lang, name)] = screen
+    return MappingProxyType(screens)
+
+SCREENS = build_screens(WEBHOOK_URL or "https://google.com")
+
+def get_screen(lang: str, name: str) -> Screen:
+    """Returns a pre-rendered screen (falls back to Russian for unknown languages)."""
+    return SCREENS.get((lang, name)) or SCREENS[("ru", name)]
@@ -0,0 +1,89 @@
+import logging
+from sqlalchemy import select, text, or_, table, column
+from bot.database import engine, AsyncSessionLocal, Order
+
+logger = logging.getLogger(__name__)
+
+# Order search: name, contact, task, service context and admin comment.
+# - PostgreSQL: pg_trgm GIN index on one concatenated document (substring + fuzzy match).
+# - SQLite: FTS5 table `orders_fts` kept in sync by triggers (see bot/migrations.py).
+# Falls back to a LIKE scan when no index is available (or the query is too short for trigrams).
+
+SEARCH_COLUMNS = ["name", "contact_info", "task_description", "service_context", "admin_comment"]
+
+# Must match the indexed expression exactly, or PostgreSQL won't use the index
+PG_ORDER_DOCUMENT = "(" + " || ' ' || ".join(f"coalesce({c}, '')" for c in SEARCH_COLUMNS) + ")"
+
+# bm25 weights per FTS column (same order as SEARCH_COLUMNS): name matches rank highest
+FTS_WEIGHTS = "10.0, 5.0, 2.0, 2.0, 1.0"
+
+orders_fts = table("orders_fts", column("rowid"))
+
+_fts_tokenizer = None # Detected once: 'trigram', 'unicode61' or '' (no FTS table)
+
+async def _get_fts_tokenizer(session) -> str:
+    global _fts_tokenizer
+    if _fts_tokenizer is None:
+        result = await session.execute(
+            text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'orders_fts'")
+        )
+        ddl = (result.scalar_one_or_none() or "").lower()
+        _fts_tokenizer = "" if not ddl else ("trigram" if "trigram" in ddl else "unicode61")
+    return _fts_tokenizer
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def _fts_query(terms: list, tokenizer: str) -> str:
+    # Every term quoted (no FTS syntax injection), all terms required
+    quoted = ['"' + t.replace('"', '""') + '"' for t in terms]
+    if tokenizer == "unicode61":
+        quoted = [q + "*" for q in quoted] # Prefix match per word
+    return " ".join(quoted)
+
+async def search_orders(query: str, limit: int = 20, offset: int = 0):
+    """
+    Ranked order search. Returns (orders, next_offset); next_offset is None on the last page.
+    """
+    query = (query or "").strip()
+    terms = query.split()
+    if not terms:
+        return [], None
+
+    async with AsyncSessionLocal() as session:
+        stmt = None
+        dialect = engine.dialect.name
+
+        if dialect == "postgresql":
+            stmt = (
+                select(Order)
+                .where(text(
+                    f"({PG_ORDER_DOCUMENT} ILIKE :pattern OR :q <% {PG_ORDER_DOCUMENT})"
+                ).bindparams(pattern=f"%{_escape_like(query)}%", q=query))
+                .order_by(text(f"word_similarity(:q, {PG_ORDER_DOCUMENT}) DESC").bindparams(q=query), Order.id.desc())
+            )
+        elif dialect == "sqlite":
+            tokenizer = await _get_fts_tokenizer(session)
+            # Trigram index can't match terms shorter than 3 characters
+            if tokenizer and not (tokenizer == "trigram" and min(len(t) for t in terms) < 3):
+                stmt = (
+                    select(Order)
+                    .join(orders_fts, orders_fts.c.rowid == Order.id)
+                    .where(text("orders_fts MATCH :match").bindparams(match=_fts_query(terms, tokenizer)))
+                    .order_by(text(f"bm25(orders_fts, {FTS_WEIGHTS})"), Order.id.desc())
+                )
+
+        if stmt is None:
+            pattern = f"%{_escape_like(query)}%"
+            stmt = (
+                select(Order)
+                .where(or_(*[getattr(Order, c).ilike(pattern, escape="\\") for c in SEARCH_COLUMNS]))
+                .order_by(Order.created_at.desc(), Order.id.desc())
+            )
+
+        result = await session.execute(stmt.limit(limit + 1).offset(offset))
+        orders = result.scalars().all()
+
+    if len(orders) > limit:
+        return orders[:limit], offset + limit
+    return orders, None
@@ -148,43 +148,6 @@ function translateStatus(status) {
     return STATUS_MAP[status] || status;
 }
 
-async function fetchBookings(query = null) {
-    try {
-        let url = '/api/bookings';
-        if (query) url += `?q=${encodeURIComponent(query)}`;
-
-        const response = await fetch(url, { headers: getHeaders() });
-        const data = await response.json();
-        const container = document.getElementById('bookings-container');
-
-        container.innerHTML = '';
-
-        if (data.length === 0) {
-            container.innerHTML = '<div style="text-align:center; color:var(--tg-theme-hint-color); padding: 20px;">Ничего не найдено</div>';
-            return;
-        }
-
-        data.forEach(booking => {
-            const div = document.createElement('div');
-            div.className = 'booking-item';
-            div.onclick = () => showDetails(booking.id);
-            div.style.cursor = 'pointer';
-
-            div.innerHTML = `
-                <div class="booking-info">
-                    <h4>${booking.client}</h4>
-                    <p>${booking.service} • ${booking.time ? new Date(booking.time).toLocaleDateString() : 'N/A'}</p>
-                </div>
-                <!-- Use translateStatus here -->
-                <div class="status ${booking.status}">${translateStatus(booking.status)}</div>
-            `;
-            container.appendChild(div);
-        });
-    } catch (e) {
-        console.error(e);
-    }
-}
-
 // Global Filter State
 let currentFilter = 'all';
 
@@ -195,13 +158,16 @@ function setFilter(status, element) {
 
     // Logic
     currentFilter = status;
-    fetchBookings(); // Re-fetch/Re-render with filter
+    fetchBookings(document.getElementById('search-input').value || null); // Re-fetch/Re-render with filter
 }
 
-// Modify renderBookings to filter
-async function fetchBookings() {
+// Fetch recent orders, or server-side search results when a query is given
+async function fetchBookings(query = null) {
     try {
-        const response = await fetch('/api/bookings');
+        let url = '/api/bookings';
+        if (query) url += `?q=${encodeURIComponent(query)}`;
+
+        const response = await fetch(url, { headers: getHeaders() });
         const bookings = await response.json();
 
         const container = document.getElementById('bookings-container');
@@ -272,13 +238,12 @@ function toggleViewAll() {
     }
 }
 
-// Search Listener
-document.getElementById('search-input').addEventListener('keyup', (e) => {
-    // Simple debounce could be added here
-    const val = e.target.value;
-    if (val.length > 2 || val.length === 0) {
-        fetchBookings(val);
-    }
+// Search Listener (debounced: one request after the user stops typing)
+let searchTimer = null;
+document.getElementById('search-input').addEventListener('input', (e) => {
+    const val = e.target.value.trim();
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(() => fetchBookings(val || null), 300);
 });
 
 // --- Broadcast Logic ---
@@ -310,7 +275,7 @@ async function sendBroadcast() {
         const res = await response.json();
 
         if (response.ok) {
-            alert(`✅ Успешно отправлено: ${res.count} пользователям.`);
+            alert(`✅ Рассылка запущена: ${res.count} получателей.`);
             closeBroadcastModal();
             document.getElementById('broadcast-text').value = '';
         } else {
@@ -46,13 +46,21 @@ document.addEventListener('DOMContentLoaded', async () => {
 
 async function loadReferralStats(userId) {
     try {
-        const res = await fetch(`/api/client/referrals?user_id=${userId}`);
-        const data = await res.json();
-
-        if (data && typeof data.count === 'number') {
-            document.getElementById('referral-stats').innerText = `Приглашено: ${data.count}`;
-            document.getElementById('referral-card').style.display = 'block';
-        }
+        // The list is paged (next page cursor in X-Next-Cursor): walk every page to count
+        const headers = { 'X-Telegram-User': String(userId) };
+        let count = 0;
+        let cursor = null;
+        do {
+            const url = '/api/client/referrals?limit=100' + (cursor ? `&cursor=${encodeURIComponent(cursor)}` : '');
+            const res = await fetch(url, { headers });
+            if (!res.ok) return;
+            const page = await res.json();
+            count += page.length;
+            cursor = res.headers.get('X-Next-Cursor');
+        } while (cursor);
+
+        document.getElementById('referral-stats').innerText = `Приглашено: ${count}`;
+        document.getElementById('referral-card').style.display = 'block';
     } catch (e) {
         console.error("Referral stats fail:", e);
     }
@@ -0,0 +1,36 @@
+import asyncio
+import os
+import sys
+import tempfile
+import pytest
+
+# Point the app at a throwaway SQLite file and the offline model backend
+# before anything imports bot.database / bot.ai_service.
+_tmp = tempfile.mkdtemp(prefix="bot-tests-")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(_tmp, 'test.db')}"
+os.environ.setdefault("AI_BACKEND", "fake")
+os.environ.setdefault("FAKE_AI_LATENCY", "fixed:1")
+os.environ.setdefault("FAKE_AI_CHUNK_DELAY_MS", "0")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def run_db():
+    """
+    run_db(scenario) runs the coroutine function `scenario` on a fresh event loop against
+    the migrated test database, then flushes buffered messages and disposes the engine
+    (its pooled connections belong to that loop). Returns the scenario's result.
+    """
+    from bot import database as db
+    from bot.migrations import migrate
+
+    def run(scenario):
+        async def wrapper():
+            await migrate()
+            try:
+                return await scenario()
+            finally:
+                await db.flush_messages()
+                await db.engine.dispose()
+        return asyncio.run(wrapper())
+    return run
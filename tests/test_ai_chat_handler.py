@@ -0,0 +1,46 @@
+import asyncio
+from types import SimpleNamespace
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import EditMessageText
+import bot.ai_service
+from bot.handlers import ai_chat_handler
+
+class _Sent:
+    def __init__(self, calls, flood_once: bool):
+        self.calls, self.flood_once = calls, flood_once
+
+    async def edit_text(self, text, parse_mode=None, reply_markup=None):
+        if self.flood_once and parse_mode == "Markdown":
+            self.flood_once = False
+            raise TelegramRetryAfter(EditMessageText(text=text), "Flood control exceeded", 0)
+        self.calls.append(("edit", text, parse_mode, reply_markup is not None))
+
+def _run_handler(monkeypatch, chunks, flood_once=False):
+    calls = []
+
+    async def dispatch(user_id, text, lang):
+        for chunk in chunks:
+            yield chunk
+
+    async def answer(text, parse_mode=None, reply_markup=None):
+        calls.append(("send", text, parse_mode, reply_markup is not None))
+        return _Sent(calls, flood_once)
+
+    async def send_chat_action(**kwargs):
+        pass
+
+    monkeypatch.setattr(bot.ai_service, "dispatch_ai_response", dispatch)
+    message = SimpleNamespace(
+        text="hi", answer=answer, chat=SimpleNamespace(id=1), from_user=SimpleNamespace(id=1),
+        bot=SimpleNamespace(send_chat_action=send_chat_action)
+    )
+    asyncio.run(ai_chat_handler(message, "ru"))
+    return calls
+
+def test_single_chunk_reply_is_sent_once_with_markdown_and_keyboard(monkeypatch):
+    assert _run_handler(monkeypatch, ["*Cached* answer"]) == [("send", "*Cached* answer", "Markdown", True)]
+
+def test_final_edit_waits_out_flood_control(monkeypatch):
+    calls = _run_handler(monkeypatch, ["Hel", "Hello"], flood_once=True)
+    assert calls[0] == ("send", "Hel", None, False)
+    assert calls[-1] == ("edit", "Hello", "Markdown", True)
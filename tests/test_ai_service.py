@@ -0,0 +1,83 @@
+import asyncio
+import pytest
+from bot import ai_service
+from bot.ai_backends import get_backend
+
+FIRST, SECOND = ai_service.MODEL_NAMES[:2]
+
+@pytest.fixture
+def fake_ai(monkeypatch):
+    """A fresh fake backend (built from the FAKE_AI_* env) with closed breakers and FIRST selected."""
+    def build(**env):
+        monkeypatch.setenv("FAKE_AI_SEED", "7")
+        for key, value in env.items():
+            monkeypatch.setenv(key, value)
+        backend = get_backend("fake")
+        monkeypatch.setattr(ai_service, "backend", backend)
+        monkeypatch.setattr(ai_service, "_breakers", {name: ai_service.CircuitBreaker(name) for name in ai_service.MODEL_NAMES})
+        monkeypatch.setattr(ai_service, "_models", {})
+        monkeypatch.setattr(ai_service, "_initialized", True) # No startup probe
+        monkeypatch.setattr(ai_service, "model_name", FIRST)
+        return backend
+    return build
+
+def _ping(timeout: float = None):
+    return ai_service.call_model(lambda m: m.generate_content_async("ping"), persona=False, timeout=timeout)
+
+def test_failing_model_fails_over_to_the_next(fake_ai):
+    backend = fake_ai(FAKE_AI_FAILING_MODELS=FIRST)
+
+    response = asyncio.run(_ping())
+
+    assert response.text.startswith("[fake]")
+    assert backend.stats()["calls"] == 2 and backend.stats()["errors"] == 1
+    assert ai_service._breakers[FIRST].failures == 1
+    assert ai_service._breakers[SECOND].state == "closed"
+
+def test_breaker_opens_on_hangs_then_half_opens(fake_ai, monkeypatch):
+    backend = fake_ai(FAKE_AI_HANG_RATE="1")
+
+    async def scenario():
+        # Every call hangs past its deadline, which the first model uses up
+        for _ in range(ai_service.BREAKER_FAILURES):
+            with pytest.raises(ai_service.AIUnavailableError):
+                await _ping(timeout=0.05)
+        opened = ai_service.get_circuit_states()[FIRST]
+
+        backend.hang_rate = 0 # Recovered
+        monkeypatch.setattr(ai_service, "BREAKER_RESET_SECONDS", 0)
+        seen = []
+        async def trial(m):
+            seen.append(ai_service._breakers[FIRST].state)
+            return await m.generate_content_async("ping")
+        await ai_service.call_model(trial, persona=False)
+        return opened, seen, ai_service.get_circuit_states()[FIRST]
+
+    opened, seen, after = asyncio.run(scenario())
+    assert opened == "open"
+    assert seen == ["half_open"] # One trial call on the first model
+    assert after == "closed"
+    assert backend.stats()["hangs"] == ai_service.BREAKER_FAILURES
+
+def test_quick_messages_coalesce_into_one_model_call(run_db, fake_ai, monkeypatch):
+    backend = fake_ai(FAKE_AI_FAILING_MODELS="")
+
+    async def reply(text: str) -> list:
+        return [chunk async for chunk in ai_service.dispatch_ai_response(5001, text, "ru")]
+
+    async def scenario():
+        semaphore = asyncio.Semaphore(1)
+        monkeypatch.setattr(ai_service, "_ai_semaphore", semaphore)
+        await semaphore.acquire() # Every AI slot busy: both messages arrive while the first waits
+        first = asyncio.create_task(reply("Сколько стоит бот для записи клиентов на стрижку?"))
+        second = asyncio.create_task(reply("И сколько по времени делается?"))
+        await asyncio.sleep(0.05)
+        semaphore.release()
+        return await first, await second
+
+    coalesced_before = ai_service._metrics["coalesced"]
+    first, second = run_db(scenario)
+    assert first and first[-1].startswith("[fake]")
+    assert second == [] # Answered by the first call
+    assert backend.stats()["calls"] == 1
+    assert ai_service._metrics["coalesced"] == coalesced_before + 1
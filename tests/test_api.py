@@ -0,0 +1,39 @@
+import asyncio
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from bot.api import get_bookings_list, analyze_orders_batch
+
+def _request(make_app, method: str, path: str, **kwargs):
+    async def scenario():
+        server = TestServer(make_app())
+        await server.start_server()
+        try:
+            async with aiohttp.ClientSession() as client:
+                async with client.request(method, server.make_url(path), **kwargs) as response:
+                    return response.status, await response.json()
+        finally:
+            await server.close()
+    return asyncio.run(scenario())
+
+def _bookings_app() -> web.Application:
+    app = web.Application()
+    app.router.add_get("/api/bookings", get_bookings_list)
+    return app
+
+def test_bookings_search_rejects_bad_offset():
+    for offset in ("abc", "-5"):
+        status, body = _request(_bookings_app, "GET", f"/api/bookings?q=bot&offset={offset}")
+        assert status == 400
+        assert body == {"error": "Invalid offset"}
+
+def test_batch_analysis_rejects_non_json_body():
+    def make_app():
+        app = web.Application()
+        app.router.add_post("/api/orders/analyze", analyze_orders_batch)
+        return app
+
+    for data in ("not json", "[1, 2]"):
+        status, body = _request(make_app, "POST", "/api/orders/analyze", data=data)
+        assert status == 400
+        assert "error" in body
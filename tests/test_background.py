@@ -0,0 +1,28 @@
+import asyncio
+import gc
+from bot import background
+
+def test_spawned_task_is_kept_until_done_and_cancelled_on_shutdown():
+    async def scenario():
+        finished = asyncio.Event()
+
+        async def quick():
+            finished.set()
+
+        async def forever():
+            await asyncio.sleep(3600)
+
+        background.spawn(quick())
+        looping = background.spawn(forever(), name="forever")
+        del looping
+        gc.collect()
+        assert len(background._tasks) == 2 # Held without a caller reference
+
+        await finished.wait()
+        await asyncio.sleep(0)
+        assert [task.get_name() for task in background._tasks] == ["forever"]
+
+        assert await background.cancel_background_tasks() == 1
+        assert not background._tasks
+
+    asyncio.run(scenario())
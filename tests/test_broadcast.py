@@ -0,0 +1,32 @@
+from sqlalchemy import select
+from bot import database as db
+
+def test_chunk_results_are_recorded_in_one_statement(run_db):
+    async def scenario():
+        for user_id in (8001, 8002, 8003):
+            await db.add_order(user_id, {"name": "lead"})
+        job_id, _ = await db.create_broadcast("hello")
+
+        statements = []
+        def count(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith("UPDATE broadcast_recipients"):
+                statements.append(executemany)
+        db.event.listen(db.engine.sync_engine, "before_cursor_execute", count)
+        try:
+            await db.record_broadcast_results(job_id, [(8001, "sent", None), (8002, "failed", "blocked")])
+        finally:
+            db.event.remove(db.engine.sync_engine, "before_cursor_execute", count)
+
+        async with db.AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(db.BroadcastRecipient.user_id, db.BroadcastRecipient.status, db.BroadcastRecipient.error)
+                .where(db.BroadcastRecipient.broadcast_id == job_id,
+                       db.BroadcastRecipient.user_id.in_([8001, 8002, 8003]))
+                .order_by(db.BroadcastRecipient.user_id)
+            )
+            return statements, result.all(), await db.get_broadcast(job_id)
+
+    statements, rows, job = run_db(scenario)
+    assert statements == [True]
+    assert [tuple(row) for row in rows] == [(8001, "sent", None), (8002, "failed", "blocked"), (8003, "pending", None)]
+    assert (job.sent, job.failed) == (1, 1)
@@ -0,0 +1,20 @@
+from bot import database as db
+
+def test_clients_are_paged_by_latest_order(run_db):
+    async def scenario():
+        a, b, c = 9001, 9002, 9003
+        await db.add_order(a, {"name": "A", "budget": "100"})
+        await db.add_order(b, {"name": "B", "budget": "200"})
+        paid = await db.add_order(a, {"name": "A", "budget": "300"})
+        await db.update_order_status(paid, "completed")
+        await db.add_order(c, {"name": "C"})
+
+        first = await db.get_clients_page(limit=2)
+        second = await db.get_clients_page(limit=2, cursor=first.next_cursor)
+        return first, second
+
+    first, second = run_db(scenario)
+    assert [row.user_id for row in first.items] == [9003, 9001]
+    assert (first.items[1].count, first.items[1].spend) == (2, 300)
+    assert second.items[0].user_id == 9002
+    assert 9001 not in [row.user_id for row in second.items] # Older order of a paged client is skipped
@@ -0,0 +1,78 @@
+import asyncio
+from bot import database as db
+
+def test_concurrent_status_changes_keep_rollup_exact(run_db):
+    async def scenario():
+        ids = [await db.add_order(1, {"name": f"lead {i}", "budget": "100 TJS"}) for i in range(40)]
+        revenue_before = (await db.get_dashboard_snapshot())["revenue"]
+        # Every order is moved to two different statuses at the same time
+        await asyncio.gather(*(
+            db.update_order_status(order_id, status)
+            for order_id in ids for status in ("in_progress", "completed")
+        ))
+        return revenue_before, (await db.get_dashboard_snapshot())["revenue"], await db.reconcile_daily_stats()
+
+    revenue_before, revenue_after, drift = run_db(scenario)
+    assert drift == 0
+    assert revenue_after - revenue_before == 40 * 100
+
+def test_amount_change_moves_rollup(run_db):
+    async def scenario():
+        order_id = await db.add_order(2, {"name": "x", "budget": "500"})
+        await db.update_order_status(order_id, "completed")
+        await asyncio.gather(
+            db.update_order_details(order_id, {"budget": "700"}),
+            db.update_order_details(order_id, {"budget": "900"}, status="in_progress"),
+        )
+        return await db.reconcile_daily_stats()
+
+    assert run_db(scenario) == 0
+
+def test_reconcile_racing_order_writes_leaves_no_drift(run_db):
+    async def scenario():
+        ids = [await db.add_order(3, {"name": f"lead {i}", "budget": "50"}) for i in range(20)]
+        await db.reconcile_daily_stats()
+        # Writers commit while the rebuild runs; none of them may be lost or double-counted
+        results = await asyncio.gather(
+            db.reconcile_daily_stats(),
+            *(db.update_order_status(order_id, "completed") for order_id in ids),
+            *(db.add_order(3, {"name": "late", "budget": "70"}) for _ in range(5)),
+            db.reconcile_daily_stats(),
+        )
+        return results[0], results[-1], await db.reconcile_daily_stats()
+
+    first, second, after = run_db(scenario)
+    assert (first, second, after) == (0, 0, 0)
+
+def test_reconcile_repairs_a_corrupted_cell(run_db):
+    async def scenario():
+        await db.add_order(4, {"name": "x", "budget": "100"})
+        async with db.AsyncSessionLocal() as session:
+            await session.execute(db.update(db.DailyStat).values(orders=db.DailyStat.orders + 1))
+            await session.commit()
+        return await db.reconcile_daily_stats(), await db.reconcile_daily_stats()
+
+    repaired, after = run_db(scenario)
+    assert repaired > 0
+    assert after == 0
+
+def test_items_only_edit_keeps_the_numeric_budget(run_db):
+    async def scenario():
+        order_id = await db.add_order(5, {"name": "x", "budget": "500"})
+        free = await db.update_order_details(order_id, {"items": [{"title": "Bot", "price": 300, "qty": 1}]})
+        unpriced = await db.add_order(5, {"name": "y", "budget": "by agreement"})
+        totalled = await db.update_order_details(unpriced, {"items": [{"title": "Bot", "price": 300, "qty": 2}]})
+        return free.amount, totalled.amount, await db.reconcile_daily_stats()
+
+    assert run_db(scenario) == (500, 600, 0)
+
+def test_dashboard_snapshot_splits_todays_revenue(run_db):
+    async def scenario():
+        before = await db.get_dashboard_snapshot()
+        order_id = await db.add_order(6, {"name": "x", "budget": "250"})
+        await db.update_order_status(order_id, "completed")
+        return before, await db.get_dashboard_snapshot()
+
+    before, after = run_db(scenario)
+    assert after["revenue_today"] - before["revenue_today"] == 250
+    assert after["revenue"] >= after["revenue_today"]
@@ -0,0 +1,39 @@
+import asyncio
+from bot import faq_cache
+from bot.faq_cache import FAQPartition, is_generic_question, lookup_answer, remember_answer
+
+def _reset():
+    faq_cache._partitions.clear()
+
+def test_personal_question_is_not_learned():
+    _reset()
+    assert not remember_answer("Меня зовут Алишер, сколько стоит бот для кафе?", "Алишер, для вашего кафе ...")
+    assert not remember_answer("Здравствуйте, это Алишер, сколько стоит бот?", "Алишер, ...")
+    assert not remember_answer("сколько стоит бот, мой номер +992 900 12 34 56", "...")
+    assert not faq_cache._partitions.get("ru") or not faq_cache._partitions["ru"].entries
+
+def test_learned_answer_is_not_served_for_another_users_question():
+    _reset()
+    assert remember_answer("сколько стоит бот для кафе", "Алишер, для кафе подойдет визитка за 1000 TJS")
+
+    # Another user's similar (not identical) question: no near hit on learned entries
+    assert asyncio.run(lookup_answer("сколько стоит бот для кофейни")) is None
+    assert asyncio.run(lookup_answer("Фаррух: сколько стоит бот для кафе?")) is None
+    # ...not even at the loose threshold used while the AI is down
+    assert asyncio.run(lookup_answer("сколько стоит бот для доставки", threshold=0.5)) is None
+    assert asyncio.run(lookup_answer("хочу записать клиентов в салон", threshold=0.5)) is None
+    # The same generic question still hits
+    assert asyncio.run(lookup_answer("Сколько стоит бот для кафе?")) is not None
+
+def test_seeded_entries_still_match_near():
+    part = FAQPartition(10)
+    part.add("сколько стоит crm система", "CRM: от 4000 TJS", pinned=True, source="products")
+    part.add("сколько стоит бот для кафе", "Алишер, ...")
+    assert part.lookup("сколько стоит crm системы", threshold=0.5) == ("CRM: от 4000 TJS", "near")
+    assert part.lookup("сколько стоит бот для кофейни", threshold=0.5) is None
+
+def test_generic_question_rules():
+    assert is_generic_question("Какие у вас услуги?")
+    assert is_generic_question("сколько стоит CRM")
+    assert not is_generic_question("напишите мне @farrukh_log")
+    assert not is_generic_question("привет " + "очень " * 10 + "длинный вопрос")
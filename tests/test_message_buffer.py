@@ -0,0 +1,64 @@
+import asyncio
+from bot import database as db
+
+def test_flush_between_buffer_copy_and_query_is_not_double_counted(run_db, monkeypatch):
+    user_id = 9001
+    real_session, real_buffered = db.AsyncSessionLocal, db._buffered_for
+    flush_next = []
+
+    class Session:
+        """Runs a flush right before the reader's query (after it copied the buffer)."""
+        def __init__(self):
+            self._session = real_session()
+
+        async def __aenter__(self):
+            if flush_next:
+                flush_next.clear()
+                await db.flush_messages()
+            return await self._session.__aenter__()
+
+        async def __aexit__(self, *exc):
+            return await self._session.__aexit__(*exc)
+
+    def buffered_for(uid):
+        flush_next.append(True)
+        return real_buffered(uid)
+
+    async def scenario():
+        await db.flush_messages()
+        await db.add_message(user_id, "user", "hello")
+        await db.add_message(user_id, "model", "hi")
+        monkeypatch.setattr(db, "AsyncSessionLocal", Session)
+        monkeypatch.setattr(db, "_buffered_for", buffered_for)
+        history = await db.get_chat_history(user_id, limit=10)
+        monkeypatch.undo()
+        return [h["parts"][0] for h in history]
+
+    assert run_db(scenario) == ["hello", "hi"]
+
+def test_failed_flush_keeps_rows_and_does_not_raise(run_db, monkeypatch):
+    user_id = 9002
+    real_session = db.AsyncSessionLocal
+    failures = [RuntimeError("database is locked")]
+
+    def flaky_session():
+        if failures:
+            raise failures.pop()
+        return real_session()
+
+    async def scenario():
+        await db.flush_messages()
+        monkeypatch.setattr(db, "MESSAGE_FLUSH_BATCH", 2)
+        monkeypatch.setattr(db, "MESSAGE_FLUSH_INTERVAL", 0.01)
+        monkeypatch.setattr(db, "AsyncSessionLocal", flaky_session)
+        await db.add_message(user_id, "user", "question")
+        await db.add_message(user_id, "model", "answer") # Reaches the batch size: inline flush fails
+        assert len(db._message_buffer) == 2
+        await asyncio.sleep(0.1) # Background retry
+        monkeypatch.undo()
+        return len(db._message_buffer), await db.get_messages_after(user_id)
+
+    pending, rows = run_db(scenario)
+    assert pending == 0
+    assert [(r.role, r.content) for r in rows] == [("user", "question"), ("model", "answer")]
+    assert all(r.id is not None for r in rows)
@@ -0,0 +1,21 @@
+from sqlalchemy import select, func
+from bot import database as db
+from bot import migrations
+
+def test_interrupted_amount_backfill_can_be_rerun(run_db, monkeypatch):
+    async def scenario():
+        items = [{"id": 1, "title": "Bot", "price": 300, "qty": 2}]
+        order_ids = [await db.add_order(6001, {"name": "x", "items": items}) for _ in range(3)]
+        monkeypatch.setattr(migrations, "BACKFILL_BATCH", 2) # Several batch transactions
+        await migrations._backfill_order_amounts()
+        await migrations._backfill_order_amounts() # As after a crash before the version row
+        async with db.AsyncSessionLocal() as session:
+            lines = (await session.execute(
+                select(func.count()).select_from(db.OrderItem).where(db.OrderItem.order_id.in_(order_ids))
+            )).scalar()
+            amounts = (await session.execute(select(db.Order.amount).where(db.Order.id.in_(order_ids)))).scalars().all()
+        return lines, amounts
+
+    lines, amounts = run_db(scenario)
+    assert lines == 3
+    assert amounts == [600, 600, 600]
@@ -0,0 +1,29 @@
+from datetime import datetime, timedelta
+from sqlalchemy import select, insert
+from bot import database as db
+from bot.retention import compact_messages
+
+def test_cap_removes_rows_without_timestamp_when_max_age_is_set(run_db):
+    user_id = 7001
+    async def scenario():
+        async with db.AsyncSessionLocal() as session:
+            await session.execute(insert(db.Message.__table__), [
+                {"user_id": user_id, "role": "user", "content": "legacy 1", "timestamp": None},
+                {"user_id": user_id, "role": "model", "content": "legacy 2", "timestamp": None},
+                {"user_id": user_id, "role": "user", "content": "aged", "timestamp": datetime.utcnow() - timedelta(days=90)},
+                {"user_id": user_id, "role": "user", "content": "new 1", "timestamp": datetime.utcnow()},
+                {"user_id": user_id, "role": "model", "content": "new 2", "timestamp": datetime.utcnow()},
+            ])
+            await session.commit()
+
+        dry = await compact_messages(keep=2, max_age_days=30, archive_dir=None, dry_run=True)
+        await compact_messages(keep=2, max_age_days=30, archive_dir=None)
+        async with db.AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(db.Message.content).where(db.Message.user_id == user_id).order_by(db.Message.id)
+            )
+            return dry, result.scalars().all()
+
+    dry, left = run_db(scenario)
+    assert left == ["new 1", "new 2"]
+    assert dry["deleted"] == 3 # aged + both NULL-timestamp rows
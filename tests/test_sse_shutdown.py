@@ -0,0 +1,36 @@
+import asyncio
+import time
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from bot import events
+from bot.api import stream_orders
+
+def _app() -> web.Application:
+    # Same wiring as bot/main.py
+    app = web.Application()
+    app.router.add_get("/api/bookings/stream", stream_orders)
+    app.on_shutdown.append(events.close_streams)
+    return app
+
+def test_open_order_stream_does_not_hold_shutdown():
+    async def scenario():
+        server = TestServer(_app())
+        await server.start_server()
+        async with aiohttp.ClientSession() as client:
+            response = await client.get(server.make_url("/api/bookings/stream"))
+            assert (await response.content.readline()).startswith(b"retry:")
+            assert len(events._order_subscribers) == 1
+
+            started = time.monotonic()
+            await server.close()
+            elapsed = time.monotonic() - started
+            response.close()
+        return elapsed
+
+    try:
+        elapsed = asyncio.run(scenario())
+    finally:
+        events._closing = None
+    assert elapsed < 5
+    assert not events._order_subscribers